@@ -1,28 +1,131 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Blueprint, Response, current_app, render_template, request, jsonify, redirect, url_for, session
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
-from config import Config
+from sqlalchemy.exc import OperationalError
+from config import engine_options, get_config
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
 import jwt
 import os
+import json
+import base64
+import binascii
+import hashlib
+import uuid
 from datetime import datetime, timedelta
 from functools import wraps
-from pubnub_config import init_pubnub, publish_message, notify_user, generate_token
-from pubnub.callbacks import SubscribeCallback
+from pubnub_config import init_pubnub, publish_message, get_cached_token
+from token_cache import TokenCache, SQLiteTokenStore
+from event_store import SeenEvents, SQLiteEventStore
+from correlation import PendingRequests, SQLitePendingStore
+from commands import CommandTracker, SQLiteCommandStore, is_confirmed
+from tracing import CLIENT_HOPS, DeliveryTracer, SQLiteTraceStore, stamp
+import box_state
+import queries
+from metrics import init_metrics, metrics, pool_stats
+from delivery_pipeline import deliver_events
+import click
+from flask.cli import with_appcontext
+
+# Initialize database (bound to the app in create_app)
+db = SQLAlchemy()
+
+main = Blueprint("main", __name__)
 
-app = Flask(__name__, template_folder="templates", static_folder="static")
-app.config.from_object(Config)
-app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+# JWT Secret key
+JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 
-# Initialize PubNub
-pubnub = init_pubnub()
 
-# Initialize database
-db = SQLAlchemy(app)
+def create_app(config=None, pubnub=None):
+    """Application factory
 
-# JWT Secret key
-JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+    config defaults to the APP_ENV profile (see config.get_config). The
+    parcel-delivery subscriber is not started here: it runs once per
+    deployment in consumer.py, so scaling gunicorn workers does not multiply
+    delivery processing. pubnub replaces the client from init_pubnub()
+    (e.g. the local stand-in used by the load tests).
+    """
+    app = Flask(__name__, template_folder="templates", static_folder="static")
+    app.config.from_object(config or get_config())
+    # Pool sizing, pre-ping, recycling and statement timeout of the profile
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(app.config),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    }
+    app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+
+    # Request, query and pool timings for /metrics
+    init_metrics(app)
+    db.init_app(app)
+
+    # Initialize PubNub
+    app.extensions["pubnub"] = pubnub or init_pubnub()
+
+    # Shared PubNub token cache
+    app.extensions["token_cache"] = TokenCache(
+        SQLiteTokenStore(app.config["TOKEN_CACHE_PATH"]),
+        refresh_fraction=app.config["TOKEN_REFRESH_FRACTION"]
+    )
+
+    # Delivery events already handled by the HTTP endpoint or the consumer
+    app.extensions["seen_events"] = SeenEvents(
+        SQLiteEventStore(app.config["SEEN_EVENTS_PATH"]),
+        ttl=app.config["SEEN_EVENTS_TTL"]
+    )
+
+    # Requests waiting for a reply from a box (e.g. weight checks)
+    app.extensions["pending_requests"] = PendingRequests(SQLitePendingStore(app.config["PENDING_REQUESTS_PATH"]))
+
+    # Lock/unlock commands and their acknowledgements
+    app.extensions["command_tracker"] = CommandTracker(
+        SQLiteCommandStore(app.config["COMMANDS_PATH"]),
+        retry_base=app.config["COMMAND_RETRY_BASE"],
+        max_attempts=app.config["COMMAND_MAX_ATTEMPTS"]
+    )
+
+    # Delivery traces from the load cell to the dashboard
+    app.extensions["delivery_tracer"] = DeliveryTracer(SQLiteTraceStore(app.config["TRACES_PATH"]))
+
+    app.register_blueprint(main)
+    app.cli.add_command(reconcile_boxes_command)
+    return app
+
+
+@click.command("reconcile-boxes")
+@with_appcontext
+@click.option("--dry-run", is_flag=True, help="Only report drift, do not rewrite box state")
+def reconcile_boxes_command(dry_run):
+    """Rebuild materialized box state from parcels and report any drift"""
+    drift = box_state.reconcile(db.session, fix=not dry_run)
+    db.session.commit()
+
+    for box in drift:
+        click.echo(f"⚠️ Box {box['box_id']}: stored {box['stored']} != actual {box['actual']}")
+    action = "would be fixed" if dry_run else "fixed"
+    click.echo(f"✅ {len(drift)} box(es) drifted" + (f" and {action}" if drift else ""))
+
+
+def get_pubnub():
+    return current_app.extensions.get("pubnub")
+
+
+def get_token_cache():
+    return current_app.extensions["token_cache"]
+
+
+def get_seen_events():
+    return current_app.extensions["seen_events"]
+
+
+def get_pending_requests():
+    return current_app.extensions["pending_requests"]
+
+
+def get_command_tracker():
+    return current_app.extensions["command_tracker"]
+
+
+def get_delivery_tracer():
+    return current_app.extensions["delivery_tracer"]
 
 
 def login_required(f):
@@ -31,48 +134,48 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         user = verify_token()
         if not user:
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         return f(user, *args, **kwargs)
 
     return decorated_function
 
 
-@app.route("/")
-@app.route("/index")
+@main.route("/")
+@main.route("/index")
 def index():
     # Home page
     return render_template("index.html")
 
 
-@app.route("/login")
+@main.route("/login")
 def login():
     # Check if user is alr logged in
     user = verify_token()
     if user:
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
     # Login page
     google_client_id = os.getenv("GOOGLE_CLIENT_ID")
     return render_template("login.html", google_client_id=google_client_id)
 
 
-@app.route("/home")
+@main.route("/home")
 @login_required
 def home(user):
     # Home page (protected)
     pubnub_subscribe_key = os.getenv("PUBNUB_SUBSCRIBE_KEY")
     
     # Generate PubNub access token for this user
-    token = generate_token(pubnub, user["user_id"])
+    token = get_cached_token(get_pubnub(), get_token_cache(), user_id=user["user_id"])
     
     return render_template("home.html", user=user, pubnub_subscribe_key=pubnub_subscribe_key, pubnub_token=token)
 
-@app.route("/api/pubnub-token", methods=["GET"])
+@main.route("/api/pubnub-token", methods=["GET"])
 @login_required
 def get_pubnub_token(user):
     """Generate a new PubNub access token for the authenticated user"""
     try:
-        token = generate_token(pubnub, user["user_id"])
+        token = get_cached_token(get_pubnub(), get_token_cache(), user_id=user["user_id"])
         
         if not token:
             return jsonify({"error": "Failed to generate token", "type": "error"}), 500
@@ -85,7 +188,7 @@ def get_pubnub_token(user):
     except Exception as e:
         return jsonify({"error": str(e), "type": "error"}), 500
 
-@app.route("/api/pubnub-token/hardware", methods=["POST"])
+@main.route("/api/pubnub-token/hardware", methods=["POST"])
 @login_required
 def get_hardware_token(user):
     """Generate PubNub token for hardware devices (load cell, servo)
@@ -98,7 +201,7 @@ def get_hardware_token(user):
             return jsonify({"error": "Box ID required", "type": "error"}), 400
         
         # Generate hardware token (no specific user_id needed - can notify any user)
-        token = generate_token(pubnub, box_id=box_id, ttl=43200)  # 30 days
+        token = get_cached_token(get_pubnub(), get_token_cache(), box_id=box_id, ttl=43200)  # 30 days
         
         if not token:
             return jsonify({"error": "Failed to generate token", "type": "error"}), 500
@@ -111,17 +214,30 @@ def get_hardware_token(user):
     except Exception as e:
         return jsonify({"error": str(e), "type": "error"}), 500
 
-@app.route("/api/health")
+@main.route("/api/health")
 def health_check():
     # Health check endpoint
     try:
-        db.session.execute(text("SELECT 1"))
-        return jsonify({"status": "healthy", "database": "connected"})
+        queries.ping(db.session)
+        return jsonify({
+            "status": "healthy",
+            "database": "connected",
+            "db_pool": pool_stats(db.engine.pool),
+            "token_cache": get_token_cache().stats(),
+            "seen_events": get_seen_events().stats(),
+            "pending_requests": get_pending_requests().stats()
+        })
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
 
-@app.route("/auth/google", methods=["POST"])
+@main.route("/metrics")
+def metrics_endpoint():
+    # Prometheus scrape target: totals across all gunicorn workers and the consumer
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@main.route("/auth/google", methods=["POST"])
 def google_auth():
     # Google OAuth login
     try:
@@ -144,32 +260,18 @@ def google_auth():
             return jsonify({"error": "Could not get email from Google", "type": "error"}), 400
 
         # Check if user exists
-        check_query = text("SELECT id, name, email FROM users WHERE email = :email")
-        result = db.session.execute(check_query, {"email": email})
-        user = result.fetchone()
+        user = queries.user_by_email(db.session, email)
 
         if not user:
             # Create new user
             try:
-                insert_query = text(
-                    "INSERT INTO users (name, email, password_hash) VALUES (:name, :email, :password_hash)"
-                )
-                db.session.execute(
-                    insert_query,
-                    {"name": name, "email": email, "password_hash": user_id},
-                )
+                user_id_db = queries.create_user(db.session, name, email, password_hash=user_id)
                 db.session.commit()
-
-                # Get the newly created user ID
-                result = db.session.execute(
-                    text("SELECT id FROM users WHERE email = :email"), {"email": email}
-                )
-                user_id_db = result.fetchone()[0]
             except Exception as e:
                 db.session.rollback()
                 return jsonify({"error": f"Failed to create user: {str(e)}", "type": "error"}), 500
         else:
-            user_id_db = user[0]
+            user_id_db = user.id
 
         # Create JWT token
         payload = {
@@ -182,7 +284,7 @@ def google_auth():
         jwt_token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
         # Set JWT as secure cookie
-        response = redirect(url_for("home"))
+        response = redirect(url_for("main.home"))
         response.set_cookie(
             "token",
             jwt_token,
@@ -214,15 +316,15 @@ def verify_token():
         return None
 
 
-@app.route("/logout")
+@main.route("/logout")
 def logout():
     # Delete JWT token cookie and log out
-    res = redirect(url_for("index"))
+    res = redirect(url_for("main.index"))
     res.delete_cookie("token")
     return res
 
 
-@app.route("/api/register-parcel", methods=["POST"])
+@main.route("/api/register-parcel", methods=["POST"])
 @login_required
 def register_parcel(user):
     # Register a parcel
@@ -233,193 +335,269 @@ def register_parcel(user):
             return jsonify({"error": "Parcel ID is required", "type": "error"}), 400
 
         # Check if parcel exists
-        check_query = text(
-            "SELECT id, user_id, parcel_name FROM parcels WHERE id=:parcel_id"
-        )
-        result = db.session.execute(check_query, {"parcel_id": parcel_id})
-        parcel = result.fetchone()
+        parcel = queries.parcel(db.session, parcel_id)
 
         if not parcel:
             return jsonify(
                 {"error": "Parcel not found. Please key in a valid ID.", "type": "error"}
             ), 404
 
-        if parcel[1] is not None:
-            if parcel[1] == user["user_id"]:
+        if parcel.user_id is not None:
+            if parcel.user_id == user["user_id"]:
                 return jsonify({"message": "This parcel is already registered to your account", "type": "info"}), 200
             return jsonify({"error": "Parcel registered to another user", "type": "error"}), 400
 
-        # Assign parcel to user
-        update_query = text("UPDATE parcels SET user_id=:user_id WHERE id=:parcel_id")
-        result = db.session.execute(
-            update_query, {"user_id": user["user_id"], "parcel_id": parcel_id}
-        )
+        # Assign parcel to user (unless someone registered it in the meantime)
+        if not queries.assign_parcels(db.session, [parcel_id], user["user_id"]):
+            db.session.rollback()
+            return jsonify({"error": "Parcel registered to another user", "type": "error"}), 400
+        box_state.refresh_expected(db.session, parcel.box_id)
+        delta = queries.parcel_changes(db.session, [parcel.id])[parcel.id]
         db.session.commit()
+        push_box_assignment(parcel.box_id)
 
         return jsonify({
-                "message": f"Parcel '{parcel[2]}' registered successfully",
+                "message": f"Parcel '{parcel.parcel_name}' registered successfully",
                 "type": "success",
+                **delta
             }), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e), "type": "error"}), 500
 
 
-@app.route("/api/fetch-parcels", methods=["GET"])
+# Fields a client may request from /api/fetch-parcels
+PARCEL_FIELDS = queries.PARCEL_FIELDS
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value, parcel_id):
+    """Opaque keyset cursor for the last row of a page"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat(sep=" ")
+    raw = json.dumps([sort_value, parcel_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (sort_value, parcel_id) from a cursor, raising ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, parcel_id = json.loads(raw)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if sort_value is not None:
+        sort_value = datetime.fromisoformat(sort_value)
+    return sort_value, str(parcel_id)
+
+
+def parcels_etag(user_id, version, history, limit, fields, cursor):
+    """Strong ETag of one parcel page: the user's data version plus the page's parameters"""
+    page = json.dumps([history, limit, fields, cursor]).encode()
+    return f"{user_id}-{version}-{hashlib.sha1(page).hexdigest()[:16]}"
+
+
+def revalidated(response, etag):
+    """Let the browser keep the page but check it with If-None-Match before every use"""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@main.route("/api/fetch-parcels", methods=["GET"])
 @login_required
 def fetch_parcels(user):
-    # Get parcels for logged in user (filtered by status)
+    """Get a page of parcels for the logged in user (filtered by status)
+
+    Query params:
+        status: 'active' (default) or 'history'
+        limit: Page size (default 20, max 100)
+        cursor: next_cursor from the previous page
+        fields: Comma-separated subset of PARCEL_FIELDS to return
+    """
     try:
         status = request.args.get('status', 'active')  # 'active' or 'history'
-        
-        if status == 'history':
-            # Get collected parcels
-            query = text("""
-                SELECT p.id, p.parcel_name, p.is_delivered, p.collected_at, p.delivered_at,
-                b.box_name, b.location, b.id as box_id
-                FROM parcels p
-                JOIN boxes b ON p.box_id = b.id
-                WHERE p.user_id = :user_id AND p.collected_at IS NOT NULL
-                ORDER BY p.collected_at DESC
-            """)
-        else:
-            # Get active parcels (not collected)
-            query = text("""
-                SELECT p.id, p.parcel_name, p.is_delivered, p.collected_at, p.delivered_at,
-                b.box_name, b.location, b.id as box_id
-                FROM parcels p
-                JOIN boxes b ON p.box_id = b.id
-                WHERE p.user_id = :user_id AND p.collected_at IS NULL
-                ORDER BY p.delivered_at DESC
-            """)
-
-        result = db.session.execute(query, {"user_id": user["user_id"]})
-        parcels = result.fetchall()
-
-        parcels_list = [
-            {
-                "id": p[0],
-                "parcel_name": p[1],
-                "is_delivered": p[2],
-                "collected_at": p[3],
-                "delivered_at": p[4],
-                "box_name": p[5],
-                "location": p[6],
-                "box_id": p[7]
-            }
-            for p in parcels
-        ]
 
-        return jsonify({"parcels": parcels_list, "type": "success"}), 200
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "limit must be a number", "type": "error"}), 400
+
+        fields = list(PARCEL_FIELDS)
+        if request.args.get('fields'):
+            fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+            unknown = [f for f in fields if f not in PARCEL_FIELDS]
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(unknown)}", "type": "error"}), 400
+
+        # Collected parcels sort by collected_at, active ones by delivered_at (in transit last)
+        history = status == 'history'
+        sort_field = "collected_at" if history else "delivered_at"
+
+        cursor_at = cursor_id = None
+        if request.args.get('cursor'):
+            try:
+                cursor_at, cursor_id = decode_cursor(request.args['cursor'])
+            except ValueError:
+                return jsonify({"error": "Invalid cursor", "type": "error"}), 400
+
+        # The page only changes when the user's data version does, so a client
+        # holding the current ETag is answered without running the page query
+        version = queries.data_version(db.session, user["user_id"])
+        etag = parcels_etag(user["user_id"], version, history, limit, fields, request.args.get('cursor'))
+        if request.if_none_match.contains_weak(etag):
+            return revalidated(Response(status=304), etag)
+
+        parcels = queries.parcel_page(db.session, user["user_id"], fields, history=history, limit=limit,
+                                      cursor_at=cursor_at, cursor_id=cursor_id)
+
+        next_cursor = None
+        if len(parcels) > limit:
+            parcels = parcels[:limit]
+            next_cursor = encode_cursor(parcels[-1][sort_field], parcels[-1]["id"])
+
+        parcels_list = [{f: p[f] for f in fields} for p in parcels]
+
+        return revalidated(jsonify({
+            "parcels": parcels_list,
+            "next_cursor": next_cursor,
+            "data_version": version,
+            "type": "success"
+        }), etag)
     except Exception as e:
         return jsonify({"error": str(e), "type": "error"}), 500
 
 
-@app.route("/api/box/<int:box_id>/expected-parcel", methods=["GET"])
+@main.route("/api/box/<int:box_id>/expected-parcel", methods=["GET"])
 def get_expected_parcel(box_id):
     """Get the parcel expected to be delivered to a specific box"""
     try:
-        # Find a parcel assigned to this box that hasn't been delivered yet
-        parcel = db.session.execute(
-            text("""
-                SELECT p.id, p.parcel_name, p.user_id
-                FROM parcels p
-                WHERE p.box_id = :box_id 
-                AND p.is_delivered = 0
-                AND p.user_id IS NOT NULL
-                ORDER BY p.id ASC
-                LIMIT 1
-            """),
-            {"box_id": box_id}
-        ).fetchone()
-        
-        if parcel:
+        # Primary-key read of the box's materialized state (see box_state.py)
+        box = box_state.expected_parcel(db.session, box_id)
+        
+        if box and box.expected_parcel_id:
             return jsonify({
-                "parcel_id": parcel[0],
-                "parcel_name": parcel[1],
-                "user_id": parcel[2]
+                "parcel_id": box.expected_parcel_id,
+                "parcel_name": box.parcel_name,
+                "user_id": box.user_id,
+                "state": box.state
             }), 200
         else:
-            return jsonify({"parcel_id": None, "message": "No parcel expected in this box"}), 200
+            return jsonify({
+                "parcel_id": None,
+                "state": box.state if box else None,
+                "message": "No parcel expected in this box"
+            }), 200
             
     except Exception as e:
         return jsonify({"error": str(e), "type": "error"}), 500
 
 
-@app.route("/api/parcel-delivered", methods=["POST"])
+def push_box_assignment(box_id):
+    """Push the box's current expected parcel to its load cell (call after commit)"""
+    pubnub = get_pubnub()
+    if pubnub:
+        publish_message(pubnub, f"load-cell-control-{box_id}", box_state.assignment_message(db.session, box_id))
+
+
+def deliver_parcel(parcel_id, attempts=2):
+    """Atomically mark a parcel delivered and claim its box
+
+    Returns (outcome, state) as described in box_state.deliver_parcels,
+    plus the dashboard delta of a delivered parcel (see queries.parcel_changes).
+    Racing deliveries of the same parcel can deadlock on MySQL; the loser is
+    retried and then sees the parcel as already delivered.
+    """
+    for attempt in range(attempts):
+        try:
+            outcome, state = box_state.deliver_parcels(db.session, [str(parcel_id)])[str(parcel_id)]
+            delta = queries.parcel_changes(db.session, [state.id]).get(state.id) if outcome == "delivered" else None
+            db.session.commit()
+            return outcome, state, delta
+        except OperationalError:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+
+
+@main.route("/api/parcel-delivered", methods=["POST"])
 def parcel_delivered():
     # Parcel delivered to box
     try:
-        data = request.json
+        data = stamp(request.json, "received")
         parcel_id = data.get("parcel_id")
+        event_id = data.get("event_id")
         
         if not parcel_id:
             return jsonify({"error": "Parcel ID required", "type": "error"}), 400
         
-        # Get parcel info
-        parcel = db.session.execute(
-            text("""
-                SELECT p.id, p.user_id, p.box_id, p.parcel_name, p.is_delivered, b.box_name
-                FROM parcels p
-                JOIN boxes b ON p.box_id = b.id
-                WHERE p.id = :pid
-            """),
-            {"pid": parcel_id}
-        ).fetchone()
+        # Devices send each delivery over HTTP and PubNub with the same event_id,
+        # only the first copy is processed
+        if event_id:
+            first, result = get_seen_events().claim(event_id)
+            if not first:
+                return jsonify({
+                    "info": "Delivery event already processed",
+                    "type": "info",
+                    "duplicate": True,
+                    **(result or {"outcome": "processing", "parcel_id": parcel_id})
+                }), 200
         
-        if not parcel: 
-            return jsonify({"error": "Parcel not found", "type": "error"}), 400
-        
-        if parcel[4]: # is_delivered
-            return jsonify({"info": f"Parcel {parcel[3]} already delivered", "type": "info"}), 200
-        
-        # Check if box already has an uncollected parcel
-        existing_parcel = db.session.execute(
-            text("""
-                SELECT p.id, p.parcel_name, p.user_id, u.name
-                FROM parcels p
-                LEFT JOIN users u ON p.user_id = u.id
-                WHERE p.box_id = :box_id 
-                AND p.is_delivered = 1 
-                AND p.collected_at IS NULL
-                LIMIT 1
-            """),
-            {"box_id": parcel[2]}
-        ).fetchone()
-        
-        if existing_parcel:
-            user_info = f" (registered to {existing_parcel[3]})" if existing_parcel[2] else " (unregistered)"
+        try:
+            outcome, parcel, delta = deliver_parcel(parcel_id)
+        except Exception:
+            if event_id:
+                get_seen_events().release(event_id)
+            raise
+        
+        if event_id:
+            get_seen_events().complete(event_id, box_state.delivery_summary(parcel_id, outcome, parcel))
+
+        if outcome == "not_found":
+            return jsonify({"error": "Parcel not found", "type": "error", "outcome": outcome}), 400
+        
+        if outcome == "already_delivered":
+            return jsonify({"info": f"Parcel {parcel.parcel_name} already delivered", "type": "info", "outcome": outcome}), 200
+        
+        if outcome == "box_occupied":
+            user_info = f" (registered to {parcel.occupant_user_name})" if parcel.occupant_user_id else " (unregistered)"
             return jsonify({
-                "error": f"Box {parcel[5]} is currently occupied by parcel '{existing_parcel[1]}'{user_info}. Please wait for collection.",
-                "type": "error"
+                "error": f"Box {parcel.box_name} is currently occupied by parcel '{parcel.occupant_name}'{user_info}. Please wait for collection.",
+                "type": "error",
+                "outcome": outcome
             }), 400
         
-        # Update parcel as delivered
-        db.session.execute(
-            text("UPDATE parcels SET is_delivered = 1, delivered_at = :now WHERE id = :pid"),
-            {"now": datetime.now(), "pid": parcel_id}
-        )
-        db.session.commit()
-        
+        stamp(data, "committed")
+
+        # The box now expects its next parcel (if any)
+        push_box_assignment(parcel.box_id)
+
         # Publish notification to user's channel via PubNub (if user exists)
-        if parcel[1] and pubnub:  # user_id and pubnub initialized
-            notification_channel = f"user-{parcel[1]}"
+        if parcel.user_id and get_pubnub():
+            notification_channel = f"user-{parcel.user_id}"
             notification_message = {
                 "type": "parcel_delivered",
-                "parcel_id": parcel[0],
-                "parcel_name": parcel[3],
-                "box_name": parcel[5],
-                "timestamp": datetime.now().isoformat()
+                "parcel_id": parcel.id,
+                "parcel_name": parcel.parcel_name,
+                "box_name": parcel.box_name,
+                "trace_id": data.get("trace_id"),
+                "timestamp": datetime.now().isoformat(),
+                **delta
             }
-            publish_message(pubnub, notification_channel, notification_message)
+            publish_message(get_pubnub(), notification_channel, notification_message)
+            stamp(data, "notified")
+
+        get_delivery_tracer().record(data, via="http")
         
         return jsonify({
-            "message": f"Parcel '{parcel[3]}' delivered to Box {parcel[5]}",
+            "message": f"Parcel '{parcel.parcel_name}' delivered to Box {parcel.box_name}",
             "type": "success",
+            "outcome": outcome,
             "parcel": {
-                "id": parcel[0],
-                "name": parcel[3],
-                "box": parcel[5]
+                "id": parcel.id,
+                "name": parcel.parcel_name,
+                "box": parcel.box_name
             }
         }), 200
         
@@ -428,7 +606,39 @@ def parcel_delivered():
         return jsonify({"error": str(e), "type": "error"}), 500
     
 
-@app.route("/api/open-box", methods=["POST"])
+MAX_DELIVERY_BATCH = 100
+
+
+@main.route("/api/parcel-delivered/batch", methods=["POST"])
+def parcel_delivered_batch():
+    # Delivery events a device journaled (e.g. while offline), recorded in one transaction
+    try:
+        events = (request.json or {}).get("events")
+
+        if not isinstance(events, list) or not events:
+            return jsonify({"error": "Events required", "type": "error"}), 400
+
+        if len(events) > MAX_DELIVERY_BATCH:
+            return jsonify({"error": f"At most {MAX_DELIVERY_BATCH} events per batch", "type": "error"}), 400
+
+        if not all(isinstance(event, dict) for event in events):
+            return jsonify({"error": "Events must be objects", "type": "error"}), 400
+
+        for event in events:
+            stamp(event, "received")
+
+        summaries = deliver_events(db, get_pubnub(), get_seen_events(), events, get_delivery_tracer(), via="http")
+        return jsonify({
+            "type": "success",
+            "results": [{"event_id": event.get("event_id"), **summary} for event, summary in zip(events, summaries)]
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "type": "error"}), 500
+
+
+@main.route("/api/open-box", methods=["POST"])
 @login_required
 def open_box(user):
     # Unlock box
@@ -438,48 +648,37 @@ def open_box(user):
         if not parcel_id:
             return jsonify({"error": "Parcel ID required", "type": "error"})
         
-         # Get parcel and verify ownership
-        parcel = db.session.execute(
-            text("""
-                SELECT p.id, p.box_id, p.is_delivered, p.collected_at, b.box_name 
-                FROM parcels p 
-                JOIN boxes b ON p.box_id = b.id 
-                WHERE p.id = :pid AND p.user_id = :uid
-            """),
-            {"pid": parcel_id, "uid": user["user_id"]}
-        ).fetchone()
+        # Get parcel and verify ownership
+        parcel = queries.owned_parcel(db.session, parcel_id, user["user_id"])
 
         if not parcel:
             return jsonify({"error": "Parcel not found", "type": "error"}), 404
 
-        if not parcel[2]:  # is_delivered
+        if not parcel.is_delivered:
             return jsonify({"error": "Parcel not yet delivered to box", "type": "error"}), 400
 
-        if parcel[3]:  # collected_at
+        if parcel.collected_at:
             return jsonify({"info": "Parcel already collected", "type": "info"}), 200
 
-        # Publish unlock message to PubNub
-        channel = f"box-{parcel[1]}"
-        message = {
-            "action": "unlock",
-            "parcel_id": parcel_id,
-            "box_id": parcel[1],
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        publish_message(pubnub, channel, message)
+        # Publish unlock command to PubNub; the box acknowledges it on command-ack
+        command_id = get_command_tracker().send(get_pubnub(), parcel.box_id, "unlock", parcel_id=parcel_id)
+
+        box_state.mark_unlocked(db.session, parcel.box_id)
+        db.session.commit()
         
         return jsonify({
-            "message": f"Box {parcel[4]} is unlocking... Please collect your parcel.",
+            "message": f"Box {parcel.box_name} is unlocking... Please collect your parcel.",
             "type": "success",
-            "box_id": parcel[1]
+            "box_id": parcel.box_id,
+            "command_id": command_id
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e), "type": "error"}), 500      
 
 
-@app.route("/api/lock-box", methods=["POST"])
+@main.route("/api/lock-box", methods=["POST"])
 @login_required
 def lock_box(user):
     # Lock box via PubNub
@@ -490,39 +689,100 @@ def lock_box(user):
             return jsonify({"error": "Box ID required", "type": "error"})
         
         # Verify user has permission (has/had parcel in this box)
-        parcel = db.session.execute(
-            text("""
-                SELECT p.id, b.box_name
-                FROM parcels p 
-                JOIN boxes b ON p.box_id = b.id 
-                WHERE p.box_id = :bid AND p.user_id = :uid
-                LIMIT 1
-            """),
-            {"bid": box_id, "uid": user["user_id"]}
-        ).fetchone()
+        parcel = queries.user_box(db.session, box_id, user["user_id"])
 
         if not parcel: 
             return jsonify({"error": "You don't have permission to lock this box", "type": "error"}), 403
         
-        # Publish lock message to PubNub
-        channel = f"box-{box_id}"
-        message = {
-            "action": "lock",
-            "box_id": box_id,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        publish_message(pubnub, channel, message)
+        # Publish lock command to PubNub; the box acknowledges it on command-ack
+        command_id = get_command_tracker().send(get_pubnub(), box_id, "lock")
+
+        box_state.mark_locked(db.session, box_id)
+        db.session.commit()
         
         return jsonify({
-            "message": f"Box {parcel[1]} is locking...",
-            "type": "success"
+            "message": f"Box {parcel.box_name} is locking...",
+            "type": "success",
+            "command_id": command_id
         }), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e), "type": "error"}), 500  
 
 
-@app.route("/api/mark-collected", methods=["POST"])
+@main.route("/api/commands/<command_id>")
+@login_required
+def get_command(user, command_id):
+    """Status of a lock/unlock command; ?wait=N waits up to N seconds for the box to confirm it"""
+    try:
+        wait = min(request.args.get("wait", 0, type=float), current_app.config["COMMAND_WAIT_MAX"])
+        command = get_command_tracker().wait(command_id, 0)
+
+        # Only users who may open or lock the box can see its commands (same check as lock_box)
+        if not command or not queries.user_box(db.session, command["box_id"], user["user_id"]):
+            return jsonify({"error": "Command not found", "type": "error"}), 404
+
+        if wait > 0 and command["status"] == "pending":
+            # Don't hold a pooled connection while waiting
+            db.session.rollback()
+            command = get_command_tracker().wait(command_id, wait)
+
+        return jsonify({
+            "type": "success",
+            "confirmed": is_confirmed(command),
+            "command": command
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e), "type": "error"}), 500
+
+
+@main.route("/api/command-latency")
+def command_latency():
+    # End-to-end lock/unlock latency percentiles per box (operators only: nginx serves it to localhost)
+    try:
+        return jsonify({"boxes": get_command_tracker().latency_stats()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@main.route("/api/traces/<trace_id>", methods=["POST"])
+@login_required
+def record_trace_span(user, trace_id):
+    # The dashboard reports when it showed a delivery notification
+    try:
+        spans = (request.json or {}).get("spans")
+
+        if not isinstance(spans, dict) or not spans:
+            return jsonify({"error": "Spans required", "type": "error"}), 400
+
+        if not set(spans) <= set(CLIENT_HOPS):
+            return jsonify({"error": f"Only {', '.join(CLIENT_HOPS)} can be reported", "type": "error"}), 400
+
+        # Only the parcel's owner can time its delivery
+        parcel_id = get_delivery_tracer().parcel_of(trace_id)
+        if not parcel_id or not queries.owned_parcel(db.session, parcel_id, user["user_id"]):
+            return jsonify({"error": "Trace not found", "type": "error"}), 404
+
+        recorded = [hop for hop, at in spans.items() if get_delivery_tracer().add_span(trace_id, hop, float(at))]
+        return jsonify({"type": "success", "recorded": recorded}), 200
+    except (TypeError, ValueError):
+        return jsonify({"error": "Span times must be epoch seconds", "type": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "type": "error"}), 500
+
+
+@main.route("/api/delivery-latency")
+def delivery_latency():
+    # Per-hop and end-to-end delivery latency percentiles, from load cell to dashboard
+    # (operators only: nginx serves it to localhost)
+    try:
+        limit = min(max(request.args.get("limit", 1000, type=int), 1), 10000)
+        return jsonify(get_delivery_tracer().report(limit))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@main.route("/api/mark-collected", methods=["POST"])
 @login_required
 def mark_collected(user):
     # Mark parcel as collected
@@ -534,68 +794,79 @@ def mark_collected(user):
             return jsonify({"error": "Parcel ID required", "type": "error"}), 400
         
         # Get parcel and check if parcel belongs to this user
-        parcel = db.session.execute(
-            text("""
-                SELECT p.id, p.is_delivered, p.collected_at, p.parcel_name, p.box_id
-                FROM parcels p 
-                WHERE p.id = :pid AND p.user_id = :uid
-            """),
-            {"pid": parcel_id, "uid": user["user_id"]}
-        ).fetchone()
+        parcel = queries.owned_parcel(db.session, parcel_id, user["user_id"])
         
         if not parcel:
             return jsonify({"error": "Parcel not found", "type": "error"}), 404
 
-        if not parcel[1]:  # is_delivered
+        if not parcel.is_delivered:
             return jsonify({"error": "Parcel not yet delivered", "type": "error"}), 400
 
-        if parcel[2]:  # collected_at
+        if parcel.collected_at:
             return jsonify({"info": "Parcel already marked as collected", "type": "info"}), 200
 
-        # If not forcing, request weight check from load cell
+        # If not forcing, ask the load cell whether the box is empty and wait for its answer
         if not force:
-            # Send PubNub message to load cell to check weight
-            channel = f"load-cell-control-{parcel[4]}"  # box_id
+            # Don't hold a pooled connection while waiting
+            db.session.rollback()
+            
+            # The load cell echoes request_id to /api/weight-response, which resolves the wait
+            request_id = uuid.uuid4().hex
+            timeout = current_app.config["WEIGHT_CHECK_TIMEOUT"]
+            get_pending_requests().register(request_id, timeout)
+            channel = f"load-cell-control-{parcel.box_id}"
             message = {
                 "action": "check_weight",
+                "request_id": request_id,
                 "parcel_id": parcel_id,
                 "user_id": user["user_id"],
                 "timestamp": datetime.now().isoformat()
             }
-            publish_message(pubnub, channel, message)
+            published = publish_message(get_pubnub(), channel, message)
+            result = get_pending_requests().wait(request_id, timeout if published else 0)
             
-            # Return a special response that tells frontend to wait for weight check
-            return jsonify({
-                "type": "weight_check",
-                "message": "Checking if parcel was removed...",
-                "parcel_id": parcel_id
-            }), 200
-        
-        # Force collection (user confirmed despite weight)
-        db.session.execute(
-            text("UPDATE parcels SET collected_at = :now WHERE id = :pid"),
-            {"now": datetime.now(), "pid": parcel_id}
-        )
+            if result is None:
+                return jsonify({
+                    "type": "weight_check_timeout",
+                    "error": "The box did not respond to the weight check. Confirm the parcel was removed.",
+                    "parcel_id": parcel_id
+                }), 200
+            
+            if result.get("has_weight"):
+                return jsonify({
+                    "type": "weight_detected",
+                    "message": "Weight is still detected in the box.",
+                    "parcel_id": parcel_id,
+                    "weight": result.get("weight")
+                }), 200
+        
+        # Collect: the box was verified empty or the user confirmed despite weight
+        delta = {}
+        if queries.mark_collected(db.session, [parcel.id]):
+            delta = queries.parcel_changes(db.session, [parcel.id])[parcel.id]
+        box_state.release_box(db.session, parcel.box_id, parcel.id)
         db.session.commit()
+        push_box_assignment(parcel.box_id)
         
         # Notify load cell to reset weight
-        channel = f"load-cell-control-{parcel[4]}"
+        channel = f"load-cell-control-{parcel.box_id}"
         message = {
             "action": "reset",
             "timestamp": datetime.now().isoformat()
         }
-        publish_message(pubnub, channel, message)
+        publish_message(get_pubnub(), channel, message)
         
         return jsonify({
-            "message": f"Parcel '{parcel[3]}' marked as collected!",
-            "type": "success"
+            "message": f"Parcel '{parcel.parcel_name}' marked as collected!",
+            "type": "success",
+            **delta
         }), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e), "type": "error"}), 500
 
 
-@app.route("/api/weight-response", methods=["POST"])
+@main.route("/api/weight-response", methods=["POST"])
 def weight_response():
     """Receive weight check response from load cell"""
     try:
@@ -603,67 +874,23 @@ def weight_response():
         parcel_id = data.get("parcel_id")
         has_weight = data.get("has_weight")
         weight = data.get("weight", 0)
+        request_id = data.get("request_id")
+        
+        print(f"⚖️ Weight check {request_id} for parcel {parcel_id}: {weight}g (has_weight={has_weight})")
         
-        # This will be handled by frontend via PubNub
-        # Just acknowledge receipt
-        return jsonify({"status": "received"}), 200
+        # Hand the answer to the mark-collected request waiting for it
+        waiting = bool(request_id) and get_pending_requests().resolve(
+            request_id, {"parcel_id": parcel_id, "has_weight": has_weight, "weight": weight}
+        )
+        return jsonify({"status": "received", "request_id": request_id, "waiting": waiting}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500         
 
 
-# PubNub listener for IoT device messages
-class ParcelDeliveryListener(SubscribeCallback):
-    def message(self, pubnub_instance, message):
-        """Handle delivery notifications from IoT devices"""
-        try:
-            msg = message.message
-            print(f"📨 Received delivery notification: {msg}")
-            
-            if msg.get('action') == 'delivered':
-                parcel_id = msg.get('parcel_id')
-                
-                # Get parcel details
-                query = text("""
-                    SELECT p.id, p.user_id, p.parcel_name, b.box_name, p.is_delivered
-                    FROM parcels p
-                    JOIN boxes b ON p.box_id = b.id
-                    WHERE p.id = :parcel_id
-                """)
-                result = db.session.execute(query, {"parcel_id": parcel_id})
-                parcel = result.fetchone()
-                
-                if parcel:
-                    # Update database to mark as delivered
-                    if not parcel[4]:  # if not already delivered
-                        db.session.execute(
-                            text("UPDATE parcels SET is_delivered = 1, delivered_at = :now WHERE id = :pid"),
-                            {"now": datetime.now(), "pid": parcel_id}
-                        )
-                        db.session.commit()
-                    
-                    user_id = parcel[1]
-                    parcel_name = parcel[2]
-                    box_name = parcel[3]
-                    
-                    # Send real-time notification to user
-                    if user_id:
-                        notify_user(pubnub, user_id, 'parcel_delivered', {
-                            'parcel_id': parcel_id,
-                            'parcel_name': parcel_name,
-                            'box_name': box_name
-                        })
-                        print(f"✅ Notified user {user_id} about delivery")
-                    
-        except Exception as e:
-            print(f"❌ Error handling delivery notification: {e}")
-
-# Subscribe to parcel-delivery channel
-if pubnub:
-    pubnub.add_listener(ParcelDeliveryListener())
-    pubnub.subscribe().channels(['parcel-delivery']).execute()
-    print("📡 Backend listening on parcel-delivery channel")
-
-
 if __name__ == "__main__":
-    # For local development only
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    # For local development only: serve the app and consume delivery events in one process
+    from consumer import start_consumer
+
+    app = create_app()
+    start_consumer(app)
+    app.run(debug=True, host='0.0.0.0', port=5001, use_reloader=False)
@@ -0,0 +1,273 @@
+"""
+Materialized box occupancy state
+
+boxes.state, occupant_parcel_id and expected_parcel_id are maintained here in
+the same transaction as parcel registration, delivery and collection, so
+device-facing lookups are primary-key reads instead of parcel scans.
+Every function takes the caller's session (or connection) and leaves
+committing to the caller. Rows are returned as the named tuples below.
+"""
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import bindparam, text
+
+EMPTY = "empty"
+EXPECTING = "expecting"
+OCCUPIED = "occupied"
+UNLOCKED = "unlocked"
+
+# A parcel after a delivery attempt, with the other parcel (if any) occupying its box
+DeliveryState = namedtuple(
+    "DeliveryState",
+    "id user_id box_id parcel_name is_delivered box_name occupant_id occupant_name occupant_user_id occupant_user_name"
+)
+BoxAssignment = namedtuple("BoxAssignment", "box_id state expected_parcel_id parcel_name user_id")
+
+# Next registered parcel still in transit to a box
+NEXT_EXPECTED = """
+    SELECT MIN(p.id) FROM parcels p
+    WHERE p.box_id = boxes.id AND p.is_delivered = 0 AND p.user_id IS NOT NULL
+"""
+
+REFRESH_EXPECTED = text(f"""
+    UPDATE boxes SET expected_parcel_id = ({NEXT_EXPECTED}), state_updated_at = :now
+    WHERE id = :box_id
+""").execution_options(query_name="box_state.refresh_expected")
+
+# Derive state from the (already updated) occupant and expected columns
+REFRESH_STATE = text("""
+    UPDATE boxes SET state = CASE
+        WHEN occupant_parcel_id IS NOT NULL AND state = 'unlocked' THEN 'unlocked'
+        WHEN occupant_parcel_id IS NOT NULL THEN 'occupied'
+        WHEN expected_parcel_id IS NOT NULL THEN 'expecting'
+        ELSE 'empty'
+    END
+    WHERE id = :box_id
+""").execution_options(query_name="box_state.refresh_state")
+
+PARCEL_IDS = text("""
+    SELECT id FROM parcels WHERE id IN :pids
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="box_state.parcel_ids")
+
+PARCEL_ID = text("""
+    SELECT id FROM parcels WHERE id = :pid
+""").execution_options(query_name="box_state.parcel_id")
+
+# Claim a box for a delivered parcel. The box row lock serializes concurrent
+# deliveries; only the first one finds occupant_parcel_id empty.
+CLAIM_BOX = text(f"""
+    UPDATE boxes SET
+        occupant_parcel_id = :pid,
+        state = 'occupied',
+        expected_parcel_id = ({NEXT_EXPECTED} AND p.id <> :pid),
+        state_updated_at = :now
+    WHERE id = (
+        SELECT box_id FROM parcels
+        WHERE id = :pid AND is_delivered = 0 AND collected_at IS NULL
+    )
+    AND occupant_parcel_id IS NULL
+""").execution_options(query_name="box_state.claim_box")
+
+MARK_DELIVERED = text("""
+    UPDATE parcels SET is_delivered = 1, delivered_at = :now
+    WHERE id IN :pids AND is_delivered = 0
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="box_state.mark_delivered")
+
+# Resulting state of a parcel and the parcel (if any) occupying its box
+DELIVERY_STATE = text("""
+    SELECT p.id, p.user_id, p.box_id, p.parcel_name, p.is_delivered, b.box_name,
+    occ.id, occ.parcel_name, occ.user_id, u.name
+    FROM parcels p
+    JOIN boxes b ON p.box_id = b.id
+    LEFT JOIN parcels occ ON occ.id = b.occupant_parcel_id AND occ.id <> p.id
+    LEFT JOIN users u ON occ.user_id = u.id
+    WHERE p.id IN :pids
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="box_state.delivery_state")
+
+RELEASE_BOX = text("""
+    UPDATE boxes SET
+        occupant_parcel_id = NULL,
+        state = CASE WHEN expected_parcel_id IS NOT NULL THEN 'expecting' ELSE 'empty' END,
+        state_updated_at = :now
+    WHERE id = :box_id AND occupant_parcel_id = :pid
+""").execution_options(query_name="box_state.release_box")
+
+SET_UNLOCKED = text("""
+    UPDATE boxes SET state = 'unlocked', state_updated_at = :now
+    WHERE id = :box_id AND occupant_parcel_id IS NOT NULL
+""").execution_options(query_name="box_state.set_unlocked")
+
+SET_LOCKED = text("""
+    UPDATE boxes SET state = 'occupied', state_updated_at = :now
+    WHERE id = :box_id AND state = 'unlocked'
+""").execution_options(query_name="box_state.set_locked")
+
+EXPECTED_PARCEL = text("""
+    SELECT b.id, b.state, b.expected_parcel_id, p.parcel_name, p.user_id
+    FROM boxes b
+    LEFT JOIN parcels p ON p.id = b.expected_parcel_id
+    WHERE b.id = :box_id
+""").execution_options(query_name="box_state.expected_parcel")
+
+
+def refresh_expected(conn, box_id):
+    """Recompute a box's expected parcel and state, e.g. after a registration"""
+    conn.execute(REFRESH_EXPECTED, {"box_id": box_id, "now": datetime.now()})
+    conn.execute(REFRESH_STATE, {"box_id": box_id})
+
+
+def deliver_parcels(conn, parcel_ids):
+    """Mark parcels delivered, each into an unoccupied box
+
+    Returns {parcel_id: (outcome, state)} keyed by the given IDs, where
+    outcome is "delivered", "already_delivered", "box_occupied" or
+    "not_found" and state is the DeliveryState. state.id is the stored ID,
+    which MySQL may have matched case-insensitively, so callers key anything
+    read back from the database on it. The IDs are resolved in one read;
+    apart from a box claim per parcel, the writes share one UPDATE and one read.
+    """
+    now = datetime.now()
+    stored = _stored_ids(conn, parcel_ids)
+
+    # Stored ID -> the given ID whose claim won (two spellings of one parcel deliver it once)
+    claimed = {}
+    for pid, row_id in stored.items():
+        if row_id not in claimed and conn.execute(CLAIM_BOX, {"pid": row_id, "now": now}).rowcount:
+            claimed[row_id] = pid
+    if claimed:
+        conn.execute(MARK_DELIVERED, {"pids": list(claimed), "now": now})
+
+    states = {}
+    if stored:
+        states = {row[0]: DeliveryState._make(row)
+                  for row in conn.execute(DELIVERY_STATE, {"pids": list(set(stored.values()))})}
+
+    results = {}
+    for pid in parcel_ids:
+        state = states.get(stored.get(pid))
+        if state and claimed.get(state.id) == pid:
+            results[pid] = ("delivered", state)
+        elif not state:
+            results[pid] = ("not_found", None)
+        elif state.is_delivered:
+            results[pid] = ("already_delivered", state)
+        else:
+            results[pid] = ("box_occupied", state)
+    return results
+
+
+def _id_key(parcel_id):
+    """Comparison key for parcel IDs, as MySQL's case-insensitive PAD SPACE collations compare them"""
+    return parcel_id.rstrip(" ").casefold()
+
+
+def _stored_ids(conn, parcel_ids):
+    """{given ID: stored ID} of the parcels that exist"""
+    if not parcel_ids:
+        return {}
+    rows = set(conn.execute(PARCEL_IDS, {"pids": list(set(parcel_ids))}).scalars())
+    by_key = {}
+    for row_id in rows:
+        by_key.setdefault(_id_key(row_id), row_id)
+
+    stored = {}
+    for pid in parcel_ids:
+        row_id = pid if pid in rows else by_key.get(_id_key(pid))
+        if row_id is not None:
+            stored[pid] = row_id
+
+    # A row the database matched that no key did (e.g. an accent-insensitive
+    # collation): ask the database about the remaining IDs one by one
+    if rows - set(stored.values()):
+        for pid in parcel_ids:
+            if pid not in stored:
+                row_id = conn.execute(PARCEL_ID, {"pid": pid}).scalar()
+                if row_id is not None:
+                    stored[pid] = row_id
+    return stored
+
+
+def delivery_summary(parcel_id, outcome, state):
+    """JSON-safe summary of a deliver_parcels result, kept for duplicate delivery reports"""
+    return {
+        "outcome": outcome,
+        "parcel_id": parcel_id,
+        "parcel_name": state.parcel_name if state else None,
+        "box_name": state.box_name if state else None,
+    }
+
+
+def release_box(conn, box_id, parcel_id):
+    """Free a box once its parcel has been collected"""
+    conn.execute(RELEASE_BOX, {"box_id": box_id, "pid": parcel_id, "now": datetime.now()})
+
+
+def mark_unlocked(conn, box_id):
+    conn.execute(SET_UNLOCKED, {"box_id": box_id, "now": datetime.now()})
+
+
+def mark_locked(conn, box_id):
+    conn.execute(SET_LOCKED, {"box_id": box_id, "now": datetime.now()})
+
+
+def expected_parcel(conn, box_id):
+    """Primary-key read of a box's state and expected parcel (a BoxAssignment, None for unknown boxes)"""
+    row = conn.execute(EXPECTED_PARCEL, {"box_id": box_id}).fetchone()
+    return BoxAssignment._make(row) if row else None
+
+
+def assignment_message(conn, box_id):
+    """Message pushed on load-cell-control-{box_id} whenever a box's expected parcel may have changed"""
+    box = expected_parcel(conn, box_id)
+    return {
+        "action": "expected_parcel",
+        "box_id": box_id,
+        "parcel_id": box.expected_parcel_id if box else None,
+        "parcel_name": box.parcel_name if box else None,
+        "user_id": box.user_id if box else None,
+        "state": box.state if box else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def reconcile(conn, fix=True):
+    """Rebuild every box's state from parcels and return the boxes that drifted
+
+    Returns a list of dicts with the stored and derived (state, occupant,
+    expected) of each box whose materialized state did not match.
+    """
+    rows = conn.execute(text("""
+        SELECT b.id, b.state, b.occupant_parcel_id, b.expected_parcel_id,
+        (SELECT MIN(p.id) FROM parcels p
+            WHERE p.box_id = b.id AND p.is_delivered = 1 AND p.collected_at IS NULL),
+        (SELECT MIN(p.id) FROM parcels p
+            WHERE p.box_id = b.id AND p.is_delivered = 0 AND p.user_id IS NOT NULL)
+        FROM boxes b
+        ORDER BY b.id
+    """)).fetchall()
+
+    drift = []
+    now = datetime.now()
+    for box_id, state, occupant, expected, actual_occupant, actual_expected in rows:
+        if actual_occupant:
+            actual_state = UNLOCKED if state == UNLOCKED else OCCUPIED
+        else:
+            actual_state = EXPECTING if actual_expected else EMPTY
+
+        if (state, occupant, expected) == (actual_state, actual_occupant, actual_expected):
+            continue
+
+        drift.append({
+            "box_id": box_id,
+            "stored": {"state": state, "occupant_parcel_id": occupant, "expected_parcel_id": expected},
+            "actual": {"state": actual_state, "occupant_parcel_id": actual_occupant,
+                       "expected_parcel_id": actual_expected},
+        })
+        if fix:
+            conn.execute(text("""
+                UPDATE boxes SET state = :state, occupant_parcel_id = :occupant,
+                expected_parcel_id = :expected, state_updated_at = :now
+                WHERE id = :box_id
+            """), {"state": actual_state, "occupant": actual_occupant, "expected": actual_expected,
+                   "now": now, "box_id": box_id})
+    return drift
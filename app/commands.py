@@ -0,0 +1,224 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pubnub_config import publish_message
+from stats import latency_stats
+from sqlite_store import SQLiteStore
+
+ACK_CHANNEL = "command-ack"
+# Door state each action should leave the box in
+TARGET_STATES = {"unlock": "unlocked", "lock": "locked"}
+
+
+class SQLiteCommandStore(SQLiteStore):
+    """Door commands sent to boxes and their acknowledgements, shared by the web workers and the consumer"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS commands (
+            command_id TEXT PRIMARY KEY,
+            box_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            next_retry_at REAL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            state TEXT,
+            acked_at REAL,
+            latency_ms REAL,
+            actuation_ms REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_commands_retry ON commands (status, next_retry_at)",
+        "CREATE INDEX IF NOT EXISTS idx_commands_box ON commands (box_id, acked_at)",
+    )
+
+    def add(self, command_id, box_id, action, message, next_retry_at):
+        now = time.time()
+        with self._connect() as conn:
+            # A newer command for the box replaces any still waiting for an ack
+            conn.execute(
+                "UPDATE commands SET status = 'superseded' WHERE box_id = ? AND status = 'pending'",
+                (box_id,)
+            )
+            conn.execute(
+                """
+                INSERT INTO commands (command_id, box_id, action, message, created_at, next_retry_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (command_id, box_id, action, json.dumps(message), now, next_retry_at)
+            )
+
+    def get(self, command_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                """
+                SELECT command_id, box_id, action, status, state, attempts, created_at, acked_at,
+                latency_ms, actuation_ms
+                FROM commands WHERE command_id = ?
+                """,
+                (command_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def ack(self, command_id, status, state, actuation_ms):
+        """Record an acknowledgement. Returns False for unknown or already acknowledged commands
+
+        A superseded command keeps that status; its ack is still recorded for the latency figures.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE commands SET status = CASE WHEN status = 'superseded' THEN status ELSE ? END,
+                state = ?, acked_at = ?,
+                latency_ms = (? - created_at) * 1000, actuation_ms = ?
+                WHERE command_id = ? AND acked_at IS NULL
+                """,
+                (status, state, now, now, actuation_ms, command_id)
+            )
+            return cursor.rowcount == 1
+
+    def due(self, now):
+        """Pending commands whose retry time has come"""
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                SELECT command_id, box_id, message, attempts FROM commands
+                WHERE status = 'pending' AND next_retry_at <= ?
+                ORDER BY next_retry_at
+                """,
+                (now,)
+            ).fetchall()
+
+    def record_retry(self, command_id, next_retry_at):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE commands SET attempts = attempts + 1, next_retry_at = ? WHERE command_id = ?",
+                (next_retry_at, command_id)
+            )
+
+    def give_up(self, command_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE commands SET status = 'unacknowledged' WHERE command_id = ? AND status = 'pending'",
+                (command_id,)
+            )
+
+    def latencies(self, limit=500):
+        """{box_id: [latency_ms, ...]} of the most recent acknowledged commands of each box"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT box_id, latency_ms FROM (
+                    SELECT box_id, latency_ms,
+                    ROW_NUMBER() OVER (PARTITION BY box_id ORDER BY acked_at DESC) AS n
+                    FROM commands WHERE acked_at IS NOT NULL AND status != 'stale'
+                ) WHERE n <= ?
+                """,
+                (limit,)
+            ).fetchall()
+        by_box = {}
+        for box_id, latency_ms in rows:
+            by_box.setdefault(box_id, []).append(latency_ms)
+        return by_box
+
+    def purge(self, max_age):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM commands WHERE created_at < ?", (time.time() - max_age,))
+
+
+def is_confirmed(command):
+    """True once the box reported the door in the state the command asked for"""
+    return (command["status"] in ("done", "noop", "coalesced")
+            and command["state"] == TARGET_STATES.get(command["action"]))
+
+
+class CommandTracker:
+    """Publishes door commands with an ID and follows them until the box acknowledges them
+
+    The servo daemon answers every command on ACK_CHANNEL. Commands without
+    an ack are republished (same command_id) after retry_base, 2x retry_base,
+    ... seconds, up to max_attempts sends, unless a newer command for the
+    same box superseded them.
+    """
+
+    def __init__(self, store, retry_base=2, max_attempts=4, poll_interval=0.05):
+        self.store = store
+        self.retry_base = retry_base
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def send(self, pubnub, box_id, action, **fields):
+        """Publish a command to box-{box_id} and return its command_id (None if it could not be published)"""
+        command_id = uuid.uuid4().hex
+        message = {
+            "action": action,
+            "command_id": command_id,
+            "box_id": box_id,
+            **fields,
+            "timestamp": datetime.now().isoformat()
+        }
+        # Stored before publishing so an early ack finds it
+        self.store.add(command_id, str(box_id), action, message, time.time() + self.retry_base)
+        if not publish_message(pubnub, f"box-{box_id}", message):
+            self.store.give_up(command_id)
+            return None
+        return command_id
+
+    def handle_ack(self, ack):
+        if not ack.get("command_id"):
+            return False
+        recorded = self.store.ack(ack["command_id"], ack.get("status", "done"), ack.get("state"),
+                                  ack.get("actuation_ms"))
+        if recorded:
+            print(f"✅ Box {ack.get('box_id')} acknowledged {ack.get('action')} ({ack.get('status')})")
+        return recorded
+
+    def wait(self, command_id, timeout):
+        """Return the command once acknowledged (or given up on), or its current state after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            command = self.store.get(command_id)
+            if not command or command["status"] != "pending" or time.monotonic() >= deadline:
+                return command
+            time.sleep(self.poll_interval)
+
+    def retry_due(self, pubnub):
+        now = time.time()
+        for command_id, box_id, message, attempts in self.store.due(now):
+            if attempts >= self.max_attempts:
+                self.store.give_up(command_id)
+                print(f"❌ Box {box_id} never acknowledged command {command_id}")
+                continue
+            publish_message(pubnub, f"box-{box_id}", json.loads(message))
+            self.store.record_retry(command_id, now + self.retry_base * 2 ** attempts)
+            print(f"🔁 Resent command {command_id} to box {box_id} (attempt {attempts + 1})")
+
+    def latency_stats(self):
+        """End-to-end command latency percentiles (ms) per box"""
+        return {box_id: latency_stats(samples) for box_id, samples in self.store.latencies().items()}
+
+    def start_retries(self, pubnub, interval=0.5):
+        """Resend unacknowledged commands from a background thread (run once, in the consumer)"""
+        def run():
+            last_purge = 0
+            while not self._stop.wait(interval):
+                try:
+                    self.retry_due(pubnub)
+                    if time.time() - last_purge > 3600:
+                        self.store.purge(7 * 86400)
+                        last_purge = time.time()
+                except Exception as e:
+                    print(f"❌ Command retry failed: {e}")
+
+        threading.Thread(target=run, name="command-retry", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
@@ -19,10 +19,122 @@ class Config:
     # URL-encode the password to handle special characters like @
     encoded_password = quote_plus(DB_PASSWORD) if DB_PASSWORD else ''
     
-    # SQLAlchemy configuration
-    if encoded_password:
+    # SQLAlchemy configuration; DATABASE_URL (e.g. sqlite:////tmp/delivery_box.db) replaces MySQL
+    if os.getenv('DATABASE_URL'):
+        SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    elif encoded_password:
         SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{DB_USER}:{encoded_password}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
     else:
         SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ECHO = True
\ No newline at end of file
+    SQLALCHEMY_ECHO = os.getenv('SQLALCHEMY_ECHO', 'false').lower() == 'true'
+
+    # Connection pool of each process (see engine_options)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW') or 10)
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT') or 30)  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE') or 3600)  # Replace connections older than this (seconds)
+    DB_POOL_PRE_PING = (os.getenv('DB_POOL_PRE_PING') or 'true').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS') or 0)  # 0 = no limit
+
+    # PubNub token cache (SQLite file shared by all gunicorn workers)
+    TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH') or os.path.join(current_dir, 'instance', 'token_cache.db')
+    TOKEN_REFRESH_FRACTION = float(os.getenv('TOKEN_REFRESH_FRACTION', 0.8))  # Refresh once 80% of TTL has passed
+
+    # Only one parcel-delivery consumer may run per host (see consumer.py)
+    CONSUMER_LOCK_PATH = os.getenv('CONSUMER_LOCK_PATH') or os.path.join(current_dir, 'instance', 'delivery-consumer.lock')
+
+    # Delivery event pipeline (see delivery_pipeline.py)
+    DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 2))
+    DELIVERY_QUEUE_SIZE = int(os.getenv('DELIVERY_QUEUE_SIZE', 1000))
+    DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', 50))
+    DELIVERY_BATCH_WAIT_MS = int(os.getenv('DELIVERY_BATCH_WAIT_MS', 50))  # How long to gather events into one batch
+    DEAD_LETTER_PATH = os.getenv('DEAD_LETTER_PATH') or os.path.join(current_dir, 'instance', 'delivery-dead-letter.jsonl')
+
+    # Delivery event deduplication (see event_store.py)
+    SEEN_EVENTS_PATH = os.getenv('SEEN_EVENTS_PATH') or os.path.join(current_dir, 'instance', 'seen_events.db')
+    SEEN_EVENTS_TTL = int(os.getenv('SEEN_EVENTS_TTL', 86400))  # Seconds a delivery event ID is remembered
+
+    # Weight-verified collection (see correlation.py)
+    PENDING_REQUESTS_PATH = os.getenv('PENDING_REQUESTS_PATH') or os.path.join(current_dir, 'instance', 'pending_requests.db')
+    WEIGHT_CHECK_TIMEOUT = float(os.getenv('WEIGHT_CHECK_TIMEOUT', 3))  # Seconds mark-collected waits for the load cell
+
+    # Door command acknowledgements (see commands.py)
+    COMMANDS_PATH = os.getenv('COMMANDS_PATH') or os.path.join(current_dir, 'instance', 'commands.db')
+    COMMAND_RETRY_BASE = float(os.getenv('COMMAND_RETRY_BASE', 2))  # Seconds before the first resend, doubled each time
+    COMMAND_MAX_ATTEMPTS = int(os.getenv('COMMAND_MAX_ATTEMPTS', 4))
+    COMMAND_WAIT_MAX = float(os.getenv('COMMAND_WAIT_MAX', 10))  # Longest wait a client may ask for
+
+    # Prometheus metrics (see metrics.py), shared by the gunicorn workers and the consumer
+    METRICS_PATH = os.getenv('METRICS_PATH') or os.path.join(current_dir, 'instance', 'metrics.db')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))  # Seconds between flushes of a worker's metrics
+
+    # End-to-end delivery tracing (see tracing.py)
+    TRACES_PATH = os.getenv('TRACES_PATH') or os.path.join(current_dir, 'instance', 'traces.db')
+
+
+class DevelopmentConfig(Config):
+    """Local development: every query is logged"""
+    SQLALCHEMY_ECHO = os.getenv('SQLALCHEMY_ECHO', 'true').lower() == 'true'
+
+
+class TestingConfig(Config):
+    """Tests and local benchmarks, on SQLite unless TEST_DATABASE_URL or DATABASE_URL says otherwise"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = (os.getenv('TEST_DATABASE_URL') or os.getenv('DATABASE_URL')
+                               or 'sqlite:///' + os.path.join(current_dir, 'instance', 'test.db'))
+    DB_POOL_PRE_PING = False
+
+
+class ProductionConfig(Config):
+    """gunicorn behind nginx: one pooled connection per gthread thread, stale connections replaced"""
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or 8)  # --threads of delivery-box.service
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW') or 4)  # The consumer's workers and background threads
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE') or 1800)  # Well inside MySQL's wait_timeout
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS') or 5000)
+
+
+PROFILES = {
+    'dev': DevelopmentConfig,
+    'test': TestingConfig,
+    'prod': ProductionConfig,
+}
+
+
+def get_config(profile=None):
+    """Config class of profile, by default the APP_ENV environment variable (dev, test or prod)"""
+    profile = profile or os.getenv('APP_ENV', 'dev')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown APP_ENV '{profile}', expected one of: {', '.join(PROFILES)}")
+    return PROFILES[profile]
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the pool and timeout settings of a loaded config"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+
+    if uri.startswith('sqlite'):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            return options  # One shared connection, nothing to size
+        # No server to drop idle connections and no statement timeout: just wait for the file lock
+        options['connect_args'] = {'timeout': config['DB_POOL_TIMEOUT']}
+        options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                       pool_timeout=config['DB_POOL_TIMEOUT'])
+        return options
+
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+    )
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout_ms and uri.startswith('mysql'):
+        # max_execution_time bounds SELECTs; writes are bounded by how long they may wait for row locks
+        lock_wait = max(1, -(-timeout_ms // 1000))
+        options['connect_args'] = {
+            'init_command': f'SET SESSION max_execution_time = {timeout_ms}, innodb_lock_wait_timeout = {lock_wait}'
+        }
+    return options
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Parcel-delivery consumer
+Runs the PubNub parcel-delivery subscriber exactly once per deployment,
+separately from the gunicorn web workers.
+Usage: python3 consumer.py
+"""
+import fcntl
+import os
+import sys
+from time import monotonic, sleep
+from pubnub.callbacks import SubscribeCallback
+from app import create_app, db
+from delivery_pipeline import DeliveryPipeline
+from commands import ACK_CHANNEL
+from tracing import stamp
+
+DELIVERY_CHANNEL = "parcel-delivery"
+
+
+# PubNub listener for IoT device messages
+class ParcelDeliveryListener(SubscribeCallback):
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def message(self, pubnub_instance, message):
+        """Hand delivery notifications from IoT devices to the delivery pipeline"""
+        if message.channel != DELIVERY_CHANNEL:
+            return
+        msg = message.message
+        print(f"📨 Received delivery notification: {msg}")
+
+        if isinstance(msg, dict) and msg.get('action') == 'delivered':
+            self.pipeline.submit(stamp(msg, "received"))
+
+
+class CommandAckListener(SubscribeCallback):
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def message(self, pubnub_instance, message):
+        """Record lock/unlock acknowledgements from the servo daemons"""
+        if message.channel != ACK_CHANNEL or not isinstance(message.message, dict):
+            return
+        try:
+            self.tracker.handle_ack(message.message)
+        except Exception as e:
+            print(f"❌ Error recording command ack: {e}")
+
+
+def acquire_consumer_lock(app):
+    """Take an exclusive lock so a second consumer on this host refuses to start"""
+    lock_path = app.config["CONSUMER_LOCK_PATH"]
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(lock_path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+def start_consumer(app):
+    """Subscribe to the parcel-delivery and command-ack channels. Returns False if another consumer holds the lock"""
+    pubnub = app.extensions.get("pubnub")
+    if not pubnub:
+        print("⚠️ PubNub not configured - delivery consumer not started")
+        return False
+
+    lock_file = acquire_consumer_lock(app)
+    if lock_file is None:
+        print("⚠️ Another delivery consumer is already running - not subscribing")
+        return False
+    app.extensions["consumer_lock"] = lock_file
+
+    pipeline = DeliveryPipeline(
+        app, db, pubnub,
+        workers=app.config["DELIVERY_WORKERS"],
+        maxsize=app.config["DELIVERY_QUEUE_SIZE"],
+        batch_size=app.config["DELIVERY_BATCH_SIZE"],
+        batch_wait=app.config["DELIVERY_BATCH_WAIT_MS"] / 1000,
+        dead_letter_path=app.config["DEAD_LETTER_PATH"],
+        seen_events=app.extensions["seen_events"],
+        tracer=app.extensions["delivery_tracer"]
+    )
+    pipeline.start()
+    app.extensions["delivery_pipeline"] = pipeline
+
+    # Unacknowledged lock/unlock commands are resent from here, once per deployment
+    tracker = app.extensions["command_tracker"]
+    tracker.start_retries(pubnub)
+
+    pubnub.add_listener(ParcelDeliveryListener(pipeline))
+    pubnub.add_listener(CommandAckListener(tracker))
+    pubnub.subscribe().channels([DELIVERY_CHANNEL, ACK_CHANNEL]).execute()
+    print(f"📡 Backend listening on {DELIVERY_CHANNEL} and {ACK_CHANNEL} channels")
+    return True
+
+
+def main():
+    app = create_app()
+    if not start_consumer(app):
+        sys.exit(1)
+
+    pipeline = app.extensions["delivery_pipeline"]
+    last_report = monotonic()
+    try:
+        # Keep the process alive; PubNub delivers messages on its own threads
+        while True:
+            sleep(1)
+            if monotonic() - last_report >= 60:
+                print(f"📊 Delivery pipeline: {pipeline.metrics()}")
+                last_report = monotonic()
+    except KeyboardInterrupt:
+        print("\n⚠️ Stopping delivery consumer...")
+    finally:
+        app.extensions["pubnub"].stop()
+        app.extensions["command_tracker"].stop()
+        pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from sqlite_store import SQLiteStore
+
+
+class SQLitePendingStore(SQLiteStore):
+    """Device replies in a SQLite file, so a reply handled by one gunicorn worker reaches a request waiting in another"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS pending_requests (
+            request_id TEXT PRIMARY KEY,
+            result TEXT,
+            expires_at REAL NOT NULL
+        )
+        """,
+    )
+
+    def create(self, request_id, expires_at):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM pending_requests WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "INSERT OR REPLACE INTO pending_requests (request_id, result, expires_at) VALUES (?, NULL, ?)",
+                (request_id, expires_at)
+            )
+
+    def resolve(self, request_id, result):
+        """Store the reply of a pending request. Returns False if nobody is waiting for it"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE pending_requests SET result = ? WHERE request_id = ? AND result IS NULL",
+                (json.dumps(result), request_id)
+            )
+            return cursor.rowcount == 1
+
+    def get(self, request_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM pending_requests WHERE request_id = ?", (request_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def delete(self, request_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM pending_requests WHERE request_id = ?", (request_id,))
+
+
+class PendingRequests:
+    """Requests waiting for a device reply, keyed by correlation ID
+
+    register() creates a future for a request ID before the command is
+    published, resolve() completes it when the device answers and wait()
+    blocks the request thread until then or until the timeout. A reply that
+    arrives at another worker process is picked up from the shared store
+    every poll_interval seconds.
+    """
+
+    def __init__(self, store=None, poll_interval=0.05):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.registered = 0
+        self.resolved = 0
+        self.timeouts = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def register(self, request_id, timeout):
+        future = Future()
+        with self._lock:
+            self._futures[request_id] = future
+            self.registered += 1
+        if self.store:
+            try:
+                self.store.create(request_id, time.time() + timeout + 60)
+            except sqlite3.Error as e:
+                print(f"⚠️ Pending request store unavailable, waiting in this worker only: {e}")
+        return future
+
+    def resolve(self, request_id, result):
+        """Complete a pending request with the device's reply. Returns False if nobody is waiting"""
+        with self._lock:
+            future = self._futures.get(request_id)
+        if future and not future.done():
+            future.set_result(result)
+            return True
+
+        if self.store:
+            try:
+                return self.store.resolve(request_id, result)
+            except sqlite3.Error as e:
+                print(f"⚠️ Failed to store device reply: {e}")
+        return False
+
+    def wait(self, request_id, timeout):
+        """Return the reply to a registered request, or None after timeout seconds"""
+        with self._lock:
+            future = self._futures[request_id]
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._count("timeouts")
+                    return None
+                try:
+                    result = future.result(timeout=min(self.poll_interval, remaining) if self.store else remaining)
+                except FutureTimeout:
+                    result = self._stored_result(request_id)
+                if result is not None:
+                    self._count("resolved")
+                    return result
+        finally:
+            with self._lock:
+                self._futures.pop(request_id, None)
+            if self.store:
+                try:
+                    self.store.delete(request_id)
+                except sqlite3.Error:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "registered": self.registered,
+                "resolved": self.resolved,
+                "timeouts": self.timeouts,
+                "waiting": len(self._futures),
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _stored_result(self, request_id):
+        if not self.store:
+            return None
+        try:
+            return self.store.get(request_id)
+        except sqlite3.Error:
+            return None
@@ -0,0 +1,237 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import box_state
+import queries
+from pubnub_config import notify_user, publish_message
+from tracing import stamp
+
+
+class DeliveryPipeline:
+    """Bounded queue of delivery events drained by a pool of workers
+
+    The PubNub callback thread only calls submit(). Workers collect events that
+    arrive together into one batch and deliver them in one transaction (see
+    deliver_events), inside an app context. Events that keep failing are written to a dead-letter file
+    instead of being lost.
+    """
+
+    def __init__(self, app, db, pubnub, workers=2, maxsize=1000, batch_size=50,
+                 batch_wait=0.05, submit_timeout=0.5, dead_letter_path=None, seen_events=None, tracer=None):
+        self.app = app
+        self.db = db
+        self.pubnub = pubnub
+        self.seen_events = seen_events
+        self.tracer = tracer
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.submit_timeout = submit_timeout
+        self.dead_letter_path = dead_letter_path
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dead_letters = deque(maxlen=500)  # Most recent failures, for inspection
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._metrics = {
+            "enqueued": 0,
+            "rejected": 0,
+            "processed": 0,
+            "duplicates": 0,
+            "batches": 0,
+            "dead_lettered": 0,
+            "max_queue_depth": 0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"delivery-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stop accepting work, let workers finish what is queued"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, event):
+        """Enqueue a delivery event. Blocks briefly when full, then dead-letters it"""
+        try:
+            self.queue.put(event, timeout=self.submit_timeout)
+        except queue.Full:
+            self._count("rejected")
+            self._dead_letter(event, "queue full")
+            return False
+
+        with self._lock:
+            self._metrics["enqueued"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self.queue.qsize())
+        return True
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self.queue.qsize()
+        metrics["queue_capacity"] = self.queue.maxsize
+        metrics["avg_batch_size"] = round(metrics["processed"] / metrics["batches"], 2) if metrics["batches"] else 0
+        return metrics
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            with self.app.app_context():
+                try:
+                    self.process_batch(batch)
+                except Exception as e:
+                    self.db.session.rollback()
+                    print(f"⚠️ Delivery batch of {len(batch)} failed ({e}), retrying events individually")
+                    self._process_individually(batch)
+                finally:
+                    self.db.session.remove()
+
+            self._count("batches")
+            for _ in batch:
+                self.queue.task_done()
+
+    def _next_batch(self):
+        """Wait for one event, then gather whatever else arrives within batch_wait"""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process_individually(self, batch):
+        for event in batch:
+            try:
+                self.process_batch([event])
+            except Exception as e:
+                self.db.session.rollback()
+                self._dead_letter(event, str(e))
+
+    def process_batch(self, events):
+        """Mark the parcels of a batch of delivery events as delivered and notify their users"""
+        summaries = deliver_events(self.db, self.pubnub, self.seen_events, events, self.tracer, via="pubnub")
+        self._count("duplicates", sum(1 for summary in summaries if summary.get("duplicate")))
+        self._count("processed", len(events))
+
+    def _dead_letter(self, event, reason):
+        record = {"event": event, "reason": reason, "failed_at": datetime.now().isoformat()}
+        self.dead_letters.append(record)
+        self._count("dead_lettered")
+        print(f"❌ Dead-lettered delivery event {event.get('parcel_id')}: {reason}")
+
+        if not self.dead_letter_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"❌ Failed to write dead-letter file: {e}")
+
+
+def deliver_events(db, pubnub, seen_events, events, tracer=None, via=None):
+    """Record a batch of delivery events in one transaction and notify their users
+
+    Shared by the consumer and the batch ingest endpoint. Events whose
+    event_id was already handled are answered from seen_events. Returns one
+    summary per event (see box_state.delivery_summary), marked with
+    "duplicate": True for repeated events. The traces of delivered events
+    (see tracing.py) are stored with tracer, tagged with the path they came by.
+    """
+    summaries = [None] * len(events)
+    new_events, claimed = [], []
+    for i, event in enumerate(events):
+        event_id = event.get("event_id")
+        parcel_id = event.get("parcel_id")
+        if not parcel_id:
+            summaries[i] = {"outcome": "invalid", "parcel_id": None}
+            continue
+        if event_id and seen_events:
+            first, result = seen_events.claim(event_id)
+            if not first:
+                summaries[i] = {**(result or {"outcome": "processing", "parcel_id": str(parcel_id)}),
+                                "duplicate": True}
+                continue
+            claimed.append(event_id)
+        new_events.append((i, event))
+
+    missing = sum(1 for summary in summaries if summary and summary["outcome"] == "invalid")
+    if missing:
+        print(f"⚠️ Ignoring {missing} delivery event(s) without parcel_id")
+    if not new_events:
+        return summaries
+
+    parcel_ids = list(dict.fromkeys(str(event["parcel_id"]) for _, event in new_events))
+    try:
+        results = box_state.deliver_parcels(db.session, parcel_ids)
+        deltas = queries.parcel_changes(db.session, [parcel.id for outcome, parcel in results.values()
+                                                     if outcome == "delivered"])
+        db.session.commit()
+    except Exception:
+        # Let the retry (or a later copy of the event) process it again
+        for event_id in claimed:
+            seen_events.release(event_id)
+        raise
+
+    traced = {}
+    for i, event in new_events:
+        pid = str(event["parcel_id"])
+        traced.setdefault(pid, stamp(event, "committed"))
+        summaries[i] = box_state.delivery_summary(pid, *results[pid])
+        if event.get("event_id") in claimed:
+            seen_events.complete(event["event_id"], summaries[i])
+
+    # Boxes that took a parcel now expect their next one
+    delivered_boxes = {parcel.box_id for outcome, parcel in results.values() if outcome == "delivered"}
+    for box_id in delivered_boxes if pubnub else ():
+        publish_message(pubnub, f"load-cell-control-{box_id}", box_state.assignment_message(db.session, box_id))
+
+    for parcel_id, (outcome, parcel) in results.items():
+        if outcome == "box_occupied":
+            print(f"⚠️ Parcel {parcel_id} reported delivered but box {parcel.box_name} is occupied by {parcel.occupant_id}")
+            continue
+        # Users are only notified by whoever recorded the delivery
+        if outcome != "delivered" or not parcel.user_id:
+            continue
+
+        # Send real-time notification to user
+        event = traced[parcel_id]
+        notify_user(pubnub, parcel.user_id, 'parcel_delivered', {
+            'parcel_id': parcel.id,
+            'parcel_name': parcel.parcel_name,
+            'box_name': parcel.box_name,
+            'trace_id': event.get('trace_id'),
+            **deltas[parcel.id]
+        })
+        stamp(event, "notified")
+        print(f"✅ Notified user {parcel.user_id} about delivery")
+
+    for parcel_id, (outcome, parcel) in results.items():
+        if tracer and outcome == "delivered":
+            tracer.record(traced[parcel_id], via)
+
+    return summaries
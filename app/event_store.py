@@ -0,0 +1,155 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlite_store import SQLiteStore
+
+
+class SQLiteEventStore(SQLiteStore):
+    """Seen delivery events in a SQLite file shared by the web workers and the consumer"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS seen_events (
+            event_id TEXT PRIMARY KEY,
+            result TEXT,
+            expires_at REAL NOT NULL
+        )
+        """,
+    )
+
+    def claim(self, event_id, expires_at, now):
+        """Record event_id as seen. Returns False if it was already seen and has not expired"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO seen_events (event_id, result, expires_at) VALUES (?, NULL, ?)
+                ON CONFLICT(event_id) DO UPDATE SET result = NULL, expires_at = excluded.expires_at
+                WHERE seen_events.expires_at < ?
+                """,
+                (event_id, expires_at, now)
+            )
+            return cursor.rowcount == 1
+
+    def get(self, event_id):
+        """Return the stored result of event_id, None while it is still being processed"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM seen_events WHERE event_id = ?", (event_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def complete(self, event_id, result):
+        with self._connect() as conn:
+            conn.execute("UPDATE seen_events SET result = ? WHERE event_id = ?", (json.dumps(result), event_id))
+
+    def delete(self, event_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+
+    def purge(self, now):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM seen_events WHERE expires_at < ?", (now,))
+
+
+class SeenEvents:
+    """Time-bounded record of processed delivery events
+
+    Devices report each delivery over HTTP and over PubNub with the same
+    event_id. The first copy to claim() the id processes it and stores its
+    result with complete(); later copies get that result back without
+    touching the parcels table. Recent ids are kept in memory and the shared
+    store makes the HTTP and PubNub paths see each other. If the store is
+    unavailable, deduplication falls back to this process only.
+    """
+
+    def __init__(self, store=None, ttl=86400, max_memory=10000, purge_interval=300):
+        self.store = store
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.purge_interval = purge_interval
+        self.claimed = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._memory = OrderedDict()  # event_id -> (expires_at, result)
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def claim(self, event_id):
+        """Return (True, None) for the first copy of an event, (False, result) for later copies
+
+        result is None while the first copy is still being processed.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(event_id)
+            if entry and entry[0] > now:
+                self.duplicates += 1
+                return False, entry[1]
+            self._remember(event_id, None, now)
+
+        if self.store:
+            try:
+                self._purge(now)
+                if not self.store.claim(event_id, now + self.ttl, now):
+                    result = self.store.get(event_id)
+                    with self._lock:
+                        if result is None:
+                            # Still in flight elsewhere: do not keep our placeholder
+                            self._memory.pop(event_id, None)
+                        else:
+                            self._remember(event_id, result, now)
+                        self.duplicates += 1
+                    return False, result
+            except sqlite3.Error as e:
+                self._count("errors")
+                print(f"⚠️ Seen-events store unavailable, deduplicating in memory only: {e}")
+
+        self._count("claimed")
+        return True, None
+
+    def complete(self, event_id, result):
+        """Store the result that later copies of event_id are answered with"""
+        with self._lock:
+            self._remember(event_id, result, time.time())
+        if self.store:
+            try:
+                self.store.complete(event_id, result)
+            except sqlite3.Error as e:
+                self._count("errors")
+                print(f"⚠️ Failed to store delivery event result: {e}")
+
+    def release(self, event_id):
+        """Forget a claimed event whose processing failed, so a retry is processed again"""
+        with self._lock:
+            self._memory.pop(event_id, None)
+        if self.store:
+            try:
+                self.store.delete(event_id)
+            except sqlite3.Error as e:
+                self._count("errors")
+                print(f"⚠️ Failed to release delivery event: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+                "errors": self.errors,
+                "in_memory": len(self._memory),
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _remember(self, event_id, result, now):
+        self._memory[event_id] = (now + self.ttl, result)
+        self._memory.move_to_end(event_id)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def _purge(self, now):
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        self.store.purge(now)
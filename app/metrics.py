@@ -0,0 +1,376 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlite_store import SQLiteStore
+
+# Latency buckets in seconds, from a primary-key read to a weight-check wait
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help) of everything exported on /metrics
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Flask request latency by route"),
+    "http_requests_total": ("counter", "Flask requests by route and status"),
+    "db_query_duration_seconds": ("histogram", "SQL execution time by query name"),
+    "db_pool_checkout_wait_seconds": ("histogram", "Time spent waiting for a pooled DB connection"),
+    "db_pool_size": ("gauge", "Configured DB pool size, summed over live workers"),
+    "db_pool_connections": ("gauge", "Pooled DB connections by state, summed over live workers"),
+    "pubnub_request_duration_seconds": ("histogram", "PubNub publish and grant latency"),
+    "pubnub_requests_total": ("counter", "PubNub publish and grant calls by result"),
+    "token_cache_events_total": ("counter", "PubNub token cache hits, misses, background refreshes and errors"),
+}
+
+TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)", re.IGNORECASE)
+
+
+class Registry:
+    """Counters and histograms of this process, as cumulative Prometheus samples"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+    def inc(self, name, labels, value=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, labels, seconds):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def samples(self):
+        """[(sample name, labels JSON, le, value)]; buckets are cumulative as Prometheus expects"""
+        with self._lock:
+            counters = list(self._counters.items()) + list(self._gauges.items())
+            histograms = [(key, list(values)) for key, values in self._histograms.items()]
+
+        rows = [(name, labels, "", value) for (name, labels), value in counters]
+        for (name, labels), values in histograms:
+            for bound, count in zip(self.buckets, values):
+                rows.append((f"{name}_bucket", labels, str(bound), count))
+            rows.append((f"{name}_bucket", labels, "+Inf", values[-2]))
+            rows.append((f"{name}_count", labels, "", values[-2]))
+            rows.append((f"{name}_sum", labels, "", values[-1]))
+        return rows
+
+
+def _label_key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+class SQLiteMetricsStore(SQLiteStore):
+    """Each process's latest samples in a SQLite file, summed across gunicorn workers on /metrics"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            worker TEXT NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            le TEXT NOT NULL,
+            value REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (worker, name, labels, le)
+        )
+        """,
+    )
+
+    def write(self, worker, samples):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO metrics (worker, name, labels, le, value, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (worker, name, labels, le) DO UPDATE SET
+                value = excluded.value, updated_at = excluded.updated_at
+                """,
+                [(worker, name, labels, le, value, now) for name, labels, le, value in samples]
+            )
+            conn.execute("COMMIT")
+
+    def totals(self, gauges=(), fresh_after=0):
+        """Samples summed over workers; gauges only count workers that flushed since fresh_after"""
+        with self._connect() as conn:
+            return conn.execute(
+                f"""
+                SELECT name, labels, le, SUM(value) FROM metrics
+                WHERE name NOT IN ({", ".join("?" * len(gauges))}) OR updated_at >= ?
+                GROUP BY name, labels, le ORDER BY name, labels
+                """,
+                (*gauges, fresh_after)
+            ).fetchall()
+
+    def counter(self, name):
+        """[(labels, value)] of one counter summed over workers"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT labels, SUM(value) FROM metrics WHERE name = ? GROUP BY labels",
+                (name,)
+            ).fetchall()
+
+    def purge(self, max_age):
+        """Forget workers that stopped reporting (the totals drop, which Prometheus reads as a reset)"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM metrics WHERE worker IN (SELECT worker FROM metrics GROUP BY worker HAVING MAX(updated_at) < ?)",
+                (time.time() - max_age,)
+            )
+
+
+class Metrics:
+    """Process-wide metrics, flushed to a shared store every flush_interval seconds
+
+    Every gunicorn worker (and the consumer) records into its own Registry
+    and writes it under a per-process worker ID, so /metrics in any worker
+    can report totals across all of them.
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        self.worker = uuid.uuid4().hex
+        self.store = None
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._collectors = []
+
+    def configure(self, store, flush_interval=5, retention=86400):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.retention = retention
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def inc(self, name, labels, value=1):
+        self.registry.inc(name, labels, value)
+
+    def set(self, name, labels, value):
+        self.registry.set(name, labels, value)
+
+    def add_collector(self, collect):
+        """Call collect(metrics) before every flush, e.g. to set gauges"""
+        self._collectors.append(collect)
+
+    def collect(self):
+        for collect in self._collectors:
+            try:
+                collect(self)
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+
+    def observe(self, name, labels, seconds):
+        self.registry.observe(name, labels, seconds)
+
+    def record_pubnub(self, operation, started, error=False):
+        """Record a PubNub call that started at perf_counter() value started"""
+        self.observe("pubnub_request_duration_seconds", {"operation": operation}, time.perf_counter() - started)
+        self.inc("pubnub_requests_total", {"operation": operation, "result": "error" if error else "ok"})
+
+    def totals(self, name, label):
+        """{label value: total} of a counter across all workers, e.g. for /api/health"""
+        if self.store:
+            self.flush()
+            rows = self.store.counter(name)
+        else:
+            rows = [(labels, value) for sample, labels, _, value in self.registry.samples() if sample == name]
+        totals = defaultdict(float)
+        for labels, value in rows:
+            totals[json.loads(labels).get(label)] += value
+        return totals
+
+    def flush(self):
+        self.collect()
+        if not self.store:
+            return
+        with self._flush_lock:
+            self.store.write(self.worker, self.registry.samples())
+
+    def _run(self):
+        last_purge = 0
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.time() - last_purge > 3600:
+                    self.store.purge(self.retention)
+                    last_purge = time.time()
+            except sqlite3.Error as e:
+                print(f"⚠️ Failed to flush metrics: {e}")
+
+    def render(self):
+        """All workers' totals in the Prometheus text format"""
+        if self.store:
+            self.flush()
+            gauges = [name for name, (kind, _) in METRICS.items() if kind == "gauge"]
+            rows = self.store.totals(gauges, fresh_after=time.time() - 3 * self.flush_interval)
+        else:
+            self.collect()
+            rows = self.registry.samples()
+
+        by_metric = defaultdict(list)
+        for name, labels, le, value in rows:
+            base = re.sub(r"_(bucket|count|sum)$", "", name) if name not in METRICS else name
+            by_metric[base].append((name, labels, le, value))
+
+        lines = []
+        for base in sorted(by_metric):
+            kind, help_text = METRICS.get(base, ("untyped", ""))
+            lines.append(f"# HELP {base} {help_text}")
+            lines.append(f"# TYPE {base} {kind}")
+            for name, labels, le, value in sorted(by_metric[base], key=_sample_order):
+                pairs = json.loads(labels)
+                if le:
+                    pairs["le"] = le
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items())
+                lines.append(f"{name}{{{label_text}}} {_format(value)}" if label_text else f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _sample_order(row):
+    name, labels, le, _ = row
+    return labels, name, float("inf") if le == "+Inf" else float(le or 0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+metrics = Metrics()
+
+
+# Pools of this process, for the db_pool_* gauges
+_pools = weakref.WeakSet()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db_pool_checkout_wait_seconds", {}, time.perf_counter() - started)
+
+
+def pool_stats(pool):
+    """Size and connection counts of a QueuePool (None for pools that do not queue, e.g. in-memory SQLite)"""
+    if not isinstance(pool, QueuePool):
+        return None
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+        "timeout": pool.timeout(),
+    }
+
+
+def _collect_pools(metrics):
+    totals = defaultdict(int)
+    for pool in list(_pools):
+        stats = pool_stats(pool)
+        for key in ("size", "checked_in", "checked_out", "overflow"):
+            totals[key] += stats[key]
+    metrics.set("db_pool_size", {}, totals["size"])
+    metrics.set("db_pool_connections", {"state": "idle"}, totals["checked_in"])
+    metrics.set("db_pool_connections", {"state": "in_use"}, totals["checked_out"])
+    metrics.set("db_pool_connections", {"state": "overflow"}, totals["overflow"])
+
+
+metrics.add_collector(_collect_pools)
+
+
+def query_name(statement, context):
+    """execution_options(query_name=...) of the statement, else the handler plus verb and table"""
+    name = context.execution_options.get("query_name") if context is not None else None
+    if not name:
+        words = statement.split(None, 1)
+        table = TABLE_PATTERN.search(statement)
+        name = " ".join(filter(None, [words[0].lower() if words else "", table.group(1) if table else ""]))
+        if has_request_context() and request.endpoint:
+            name = f"{request.endpoint.split('.')[-1]}: {name}"
+    return name
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    metrics.observe("db_query_duration_seconds", {"query": query_name(statement, context)},
+                    time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def init_metrics(app):
+    """Time every request (call before db.init_app so the pool is timed too)"""
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    # In-memory SQLite lives in a single connection, a queue pool would hand out empty databases
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        options.setdefault("poolclass", TimedQueuePool)
+
+    metrics.configure(
+        SQLiteMetricsStore(app.config["METRICS_PATH"]),
+        flush_interval=app.config["METRICS_FLUSH_INTERVAL"]
+    )
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            metrics.observe("http_request_duration_seconds", {"route": route, "method": request.method},
+                            time.perf_counter() - started)
+            metrics.inc("http_requests_total", {"route": route, "method": request.method,
+                                                "status": str(response.status_code)})
+        return response
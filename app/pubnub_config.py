@@ -1,9 +1,11 @@
 import os
+import time
 from pubnub.pnconfiguration import PNConfiguration
 from pubnub.pubnub import PubNub
 from pubnub.callbacks import SubscribeCallback
 from pubnub.enums import PNStatusCategory, PNReconnectionPolicy
 from pubnub.models.consumer.v3.channel import Channel
+from metrics import metrics
 
 def init_pubnub():
     """Initialize PubNub configuration for server (with secret key)"""
@@ -45,6 +47,7 @@ def init_pubnub():
 
 def _generate_server_token(pubnub, ttl=43200):
     """Generate a token for the server with full permissions (30 days)"""
+    started = time.perf_counter()
     try:
         # Server needs access to all channels via patterns
         channels = [
@@ -52,6 +55,7 @@ def _generate_server_token(pubnub, ttl=43200):
             Channel.pattern("user-.*").read().write(),          # All user channels  
             Channel.pattern("load-cell-control-.*").read().write(),  # All load cell channels
             Channel.id("parcel-delivery").read().write(),       # Delivery channel
+            Channel.id("command-ack").read().write(),           # Door command acknowledgements
         ]
         
         envelope = pubnub.grant_token()\
@@ -59,9 +63,11 @@ def _generate_server_token(pubnub, ttl=43200):
             .authorized_uuid("delivery-box-server")\
             .channels(channels)\
             .sync()
+        metrics.record_pubnub("grant", started)
         
         return envelope.result.token
     except Exception as e:
+        metrics.record_pubnub("grant", started, error=True)
         print(f"❌ Error generating server token: {e}")
         import traceback
         traceback.print_exc()
@@ -82,6 +88,7 @@ def generate_token(pubnub, user_id=None, box_id=None, ttl=1440):
     if pubnub is None:
         return None
     
+    started = time.perf_counter()
     try:
         # Build token permissions
         if box_id:
@@ -90,6 +97,7 @@ def generate_token(pubnub, user_id=None, box_id=None, ttl=1440):
                 Channel.id(f"box-{box_id}").read(),
                 Channel.id(f"load-cell-control-{box_id}").read(),
                 Channel.id("parcel-delivery").write(),  # Load cell publishes delivery events
+                Channel.id("command-ack").write(),  # Servo acknowledges lock/unlock commands
                 Channel.pattern("user-.*").write()  # Pattern for writing to any user channel
             ]
             
@@ -113,22 +121,59 @@ def generate_token(pubnub, user_id=None, box_id=None, ttl=1440):
         else:
             raise ValueError("Either user_id or box_id must be provided")
         
+        metrics.record_pubnub("grant", started)
         return envelope.result.token
     except Exception as e:
+        metrics.record_pubnub("grant", started, error=True)
         print(f"❌ Error generating token: {e}")
         import traceback
         traceback.print_exc()
         return None
 
+def get_cached_token(pubnub, token_cache, user_id=None, box_id=None, ttl=1440):
+    """Return a PubNub access token from the shared token cache
+
+    Tokens are keyed by subject (user or box) and permission set, so a user
+    reloading the dashboard reuses a still-valid grant instead of waiting on
+    a grant_token() round trip.
+
+    Args:
+        pubnub: PubNub instance
+        token_cache: TokenCache instance
+        user_id: User ID (required for user tokens)
+        box_id: Box ID (required for hardware tokens)
+        ttl: Token time-to-live in minutes (default 24 hours)
+
+    Returns:
+        str: Access token
+    """
+    if pubnub is None:
+        return None
+
+    if box_id:
+        key = f"box-{box_id}|hardware|{ttl}"
+    elif user_id:
+        key = f"user-{user_id}|user-read|{ttl}"
+    else:
+        raise ValueError("Either user_id or box_id must be provided")
+
+    return token_cache.get(
+        key,
+        ttl * 60,
+        lambda: generate_token(pubnub, user_id=user_id, box_id=box_id, ttl=ttl)
+    )
+
 def publish_message(pubnub, channel, message):
     """Helper function to publish messages to PubNub (non-blocking)"""
     if pubnub is None:
         print("PubNub not initialized - skipping publish")
         return False
     
+    started = time.perf_counter()
     try:
         # Use async publish to avoid blocking
         def callback(envelope, status):
+            metrics.record_pubnub("publish", started, error=status.is_error())
             if status.is_error():
                 print(f"PubNub publish error: {status.error_data}")
             else:
@@ -137,6 +182,7 @@ def publish_message(pubnub, channel, message):
         pubnub.publish().channel(channel).message(message).pn_async(callback)
         return True
     except Exception as e:
+        metrics.record_pubnub("publish", started, error=True)
         print(f"PubNub publish error: {e}")
         return False
 
@@ -0,0 +1,267 @@
+"""
+Users and parcels data access
+
+Every statement is built once at import time (or once per shape, for the
+parcel pages) and named for /metrics, so a request only binds parameters
+and hits SQLAlchemy's compiled cache. Rows come back as named tuples.
+Bulk variants take lists of IDs and run one statement for all of them.
+Box state lives in box_state.py. Like there, every function takes the
+caller's session (or connection) and leaves committing to the caller.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import bindparam, text
+from werkzeug.http import http_date
+
+User = namedtuple("User", "id name email")
+Parcel = namedtuple("Parcel", "id user_id parcel_name box_id")
+OwnedParcel = namedtuple("OwnedParcel", "id box_id parcel_name is_delivered collected_at box_name")
+UserBox = namedtuple("UserBox", "parcel_id box_name")
+
+PING = text("SELECT 1").execution_options(query_name="ping")
+
+USER_BY_EMAIL = text("""
+    SELECT id, name, email FROM users WHERE email = :email
+""").execution_options(query_name="users.by_email")
+
+INSERT_USER = text("""
+    INSERT INTO users (name, email, password_hash) VALUES (:name, :email, :password_hash)
+""").execution_options(query_name="users.insert")
+
+PARCEL = text("""
+    SELECT id, user_id, parcel_name, box_id FROM parcels WHERE id = :pid
+""").execution_options(query_name="parcels.by_id")
+
+PARCELS = text("""
+    SELECT id, user_id, parcel_name, box_id FROM parcels WHERE id IN :pids
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="parcels.by_ids")
+
+# Only unregistered parcels are assigned, so a race cannot steal another user's parcel
+ASSIGN_PARCELS = text("""
+    UPDATE parcels SET user_id = :user_id WHERE id IN :pids AND user_id IS NULL
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="parcels.assign")
+
+OWNED_PARCEL = text("""
+    SELECT p.id, p.box_id, p.parcel_name, p.is_delivered, p.collected_at, b.box_name
+    FROM parcels p
+    JOIN boxes b ON p.box_id = b.id
+    WHERE p.id = :pid AND p.user_id = :uid
+""").execution_options(query_name="parcels.owned")
+
+USER_BOX = text("""
+    SELECT p.id, b.box_name
+    FROM parcels p
+    JOIN boxes b ON p.box_id = b.id
+    WHERE p.box_id = :bid AND p.user_id = :uid
+    LIMIT 1
+""").execution_options(query_name="parcels.user_box")
+
+# Per-user data version, bumped with every change to the user's parcels (see data_version)
+DATA_VERSION = text("""
+    SELECT data_version FROM users WHERE id = :uid
+""").execution_options(query_name="users.data_version")
+
+BUMP_VERSIONS = text("""
+    UPDATE users SET data_version = data_version + :n WHERE id IN :uids
+""").bindparams(bindparam("uids", expanding=True)).execution_options(query_name="users.bump_versions")
+
+DATA_VERSIONS = text("""
+    SELECT id, data_version FROM users WHERE id IN :uids
+""").bindparams(bindparam("uids", expanding=True)).execution_options(query_name="users.data_versions")
+
+MARK_COLLECTED = text("""
+    UPDATE parcels SET collected_at = :now WHERE id IN :pids AND collected_at IS NULL
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="parcels.mark_collected")
+
+# Fields of a parcel page (name -> column)
+PARCEL_FIELDS = {
+    "id": "p.id",
+    "parcel_name": "p.parcel_name",
+    "is_delivered": "p.is_delivered",
+    "collected_at": "p.collected_at",
+    "delivered_at": "p.delivered_at",
+    "box_name": "b.box_name",
+    "location": "b.location",
+    "box_id": "p.box_id",
+}
+
+# Every field of a parcel page, with the owner, for the deltas pushed to dashboards
+PARCEL_RECORDS = text(f"""
+    SELECT p.user_id, {", ".join(f"{column} AS {field}" for field, column in PARCEL_FIELDS.items())}
+    FROM parcels p
+    JOIN boxes b ON p.box_id = b.id
+    WHERE p.id IN :pids
+""").bindparams(bindparam("pids", expanding=True)).execution_options(query_name="parcels.records")
+
+
+def ping(conn):
+    conn.execute(PING)
+
+
+def user_by_email(conn, email):
+    row = conn.execute(USER_BY_EMAIL, {"email": email}).fetchone()
+    return User._make(row) if row else None
+
+
+def create_user(conn, name, email, password_hash):
+    """Insert a user and return the new ID"""
+    result = conn.execute(INSERT_USER, {"name": name, "email": email, "password_hash": password_hash})
+    return result.lastrowid
+
+
+def parcel(conn, parcel_id):
+    row = conn.execute(PARCEL, {"pid": parcel_id}).fetchone()
+    return Parcel._make(row) if row else None
+
+
+def parcels(conn, parcel_ids):
+    """{parcel_id: Parcel} of the parcels that exist"""
+    if not parcel_ids:
+        return {}
+    return {row[0]: Parcel._make(row) for row in conn.execute(PARCELS, {"pids": list(parcel_ids)})}
+
+
+def assign_parcels(conn, parcel_ids, user_id):
+    """Register unregistered parcels to a user. Returns how many were assigned"""
+    if not parcel_ids:
+        return 0
+    return conn.execute(ASSIGN_PARCELS, {"pids": list(parcel_ids), "user_id": user_id}).rowcount
+
+
+def owned_parcel(conn, parcel_id, user_id):
+    """A parcel of the user with its box name, or None if it is not theirs"""
+    row = conn.execute(OWNED_PARCEL, {"pid": parcel_id, "uid": user_id}).fetchone()
+    return OwnedParcel._make(row) if row else None
+
+
+def user_box(conn, box_id, user_id):
+    """Any parcel the user has (or had) in a box, or None if they may not use it"""
+    row = conn.execute(USER_BOX, {"bid": box_id, "uid": user_id}).fetchone()
+    return UserBox._make(row) if row else None
+
+
+def mark_collected(conn, parcel_ids, now=None):
+    """Stamp parcels as collected. Returns how many were not collected before"""
+    if not parcel_ids:
+        return 0
+    return conn.execute(MARK_COLLECTED, {"pids": list(parcel_ids), "now": now or datetime.now()}).rowcount
+
+
+def data_version(conn, user_id):
+    """Version of a user's parcels (0 for unknown users); ETags of their parcel pages are built from it"""
+    return conn.execute(DATA_VERSION, {"uid": user_id}).scalar() or 0
+
+
+def bump_versions(conn, user_ids):
+    """Bump a user's data version once per entry of user_ids (one entry per changed parcel)
+
+    Returns the version each entry produced, in order (None for None
+    entries), so every change can be sent to the dashboard as its own delta.
+    """
+    counts = Counter(uid for uid in user_ids if uid is not None)
+    if not counts:
+        return [None] * len(user_ids)
+    # Sorted so concurrent bumps of overlapping users lock their rows in the same order
+    if set(counts.values()) == {1}:
+        conn.execute(BUMP_VERSIONS, {"uids": sorted(counts), "n": 1})
+    else:
+        for uid in sorted(counts):
+            conn.execute(BUMP_VERSIONS, {"uids": [uid], "n": counts[uid]})
+
+    versions = dict(conn.execute(DATA_VERSIONS, {"uids": sorted(counts)}).fetchall())
+    # The bumps of a user count up to its new version, oldest entry first
+    produced = []
+    for uid in user_ids:
+        if uid is None:
+            produced.append(None)
+            continue
+        produced.append(versions[uid] - counts[uid] + 1)
+        counts[uid] -= 1
+    return produced
+
+
+def parcel_changes(conn, parcel_ids):
+    """Bump the data versions of the owners of changed parcels and return the deltas to push
+
+    Call after changing the parcels and before committing. Returns
+    {parcel_id: {"parcel": record, "data_version": version}} where record has
+    every PARCEL_FIELDS field, dates formatted as in jsonify responses.
+    Unregistered parcels have no dashboard and are left out.
+    """
+    if not parcel_ids:
+        return {}
+    rows = {row.id: row for row in conn.execute(PARCEL_RECORDS, {"pids": list(parcel_ids)})}
+    owned = [pid for pid in parcel_ids if pid in rows and rows[pid].user_id is not None]
+    versions = bump_versions(conn, [rows[pid].user_id for pid in owned])
+    return {
+        pid: {
+            "parcel": {field: http_date(value) if isinstance(value, datetime) else value
+                       for field, value in rows[pid]._mapping.items() if field in PARCEL_FIELDS},
+            "data_version": version,
+        }
+        for pid, version in zip(owned, versions)
+    }
+
+
+@lru_cache(maxsize=256)
+def parcel_page_statement(selected, history, cursor, nulls=False):
+    """Statement for one shape of parcel page
+
+    selected: tuple of PARCEL_FIELDS names; history: collected parcels
+    instead of active ones; cursor: None or "after" (:cursor_at, :cursor_id);
+    nulls: the trailing block of parcels without a sort timestamp, which
+    pages on :cursor_id alone.
+
+    The two blocks are separate statements so that each cursor condition is
+    a plain range over the index that ends in (sort timestamp, id).
+    """
+    sort_column = PARCEL_FIELDS["collected_at" if history else "delivered_at"]
+    conditions = ["p.user_id = :user_id", "p.collected_at IS NOT NULL" if history else "p.collected_at IS NULL"]
+    if nulls:
+        conditions.append(f"{sort_column} IS NULL")
+        if cursor == "after":
+            conditions.append("p.id < :cursor_id")
+        order_by = "p.id DESC"
+    else:
+        if cursor == "after":
+            conditions.append(f"{sort_column} <= :cursor_at AND ({sort_column} < :cursor_at OR p.id < :cursor_id)")
+        elif not history:
+            conditions.append(f"{sort_column} IS NOT NULL")
+        order_by = f"{sort_column} DESC, p.id DESC"
+    join = "JOIN boxes b ON p.box_id = b.id" if any(PARCEL_FIELDS[f].startswith("b.") for f in selected) else ""
+
+    return text(f"""
+        SELECT {", ".join(f"{PARCEL_FIELDS[f]} AS {f}" for f in selected)}
+        FROM parcels p
+        {join}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {order_by}
+        LIMIT :limit
+    """).execution_options(query_name="parcels.page_nulls" if nulls else "parcels.page")
+
+
+def parcel_page(conn, user_id, fields, history=False, limit=20, cursor_at=None, cursor_id=None):
+    """Up to limit + 1 parcels of a user as mappings, newest first, after an optional keyset cursor
+
+    Sort keys are always selected so the caller can build the next cursor.
+    Active parcels still in transit (no delivered_at) come last; a page that
+    runs out of timestamped parcels is filled from that block.
+    """
+    sort_field = "collected_at" if history else "delivered_at"
+    selected = tuple(dict.fromkeys(list(fields) + ["id", sort_field]))
+    cursor = None if cursor_id is None else "after"
+    params = {"user_id": user_id, "limit": limit + 1, "cursor_at": cursor_at, "cursor_id": cursor_id}
+
+    rows = []
+    if cursor_id is None or cursor_at is not None:
+        statement = parcel_page_statement(selected, history, cursor)
+        rows = conn.execute(statement, {k: v for k, v in params.items() if v is not None}).mappings().fetchall()
+        # Collected parcels always have a collected_at, so history has no trailing block
+        if history or len(rows) > limit:
+            return rows
+        params.update(limit=limit + 1 - len(rows), cursor_at=None, cursor_id=None)
+        cursor = None
+
+    statement = parcel_page_statement(selected, history, cursor, nulls=True)
+    return rows + conn.execute(statement, {k: v for k, v in params.items() if v is not None}).mappings().fetchall()
@@ -0,0 +1,34 @@
+"""
+Base of the SQLite files under app/instance that the gunicorn workers and the consumer share
+"""
+import os
+import sqlite3
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    """A SQLite file in WAL mode, created with SCHEMA on first use
+
+    Subclasses list their CREATE ... IF NOT EXISTS statements in SCHEMA and
+    open a connection per operation with _connect(). Connections are in
+    autocommit mode, so multi-statement writes use explicit BEGIN / COMMIT.
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
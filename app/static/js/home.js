@@ -81,9 +81,93 @@ function switchTab(tab) {
 // Parcel Fetching
 // ==========================================
 
-async function fetchActiveParcels() {
+// Only request the fields each list renders
+const ACTIVE_FIELDS = 'id,parcel_name,is_delivered,delivered_at,box_name,location,box_id'
+const HISTORY_FIELDS = 'id,parcel_name,collected_at,box_name,location'
+const ACTIVE_PAGE_SIZE = 20
+const HISTORY_PAGE_SIZE = 20
+
+// ==========================================
+// Local Parcel Store
+// ==========================================
+
+// The dashboard's copy of each list and the user data version it reflects.
+// Every change of the user's parcels bumps the version by one and comes with
+// the parcel's full record (a delta), so the lists are patched in place; a
+// version gap means a delta was missed and the list is fetched again.
+// Both lists are paged; nextCursor is set while more pages are on the server.
+const parcelLists = {
+    active: { version: null, parcels: [], nextCursor: null, sortField: 'delivered_at', refetch: () => fetchActiveParcels() },
+    history: { version: null, parcels: [], nextCursor: null, sortField: 'collected_at', refetch: () => fetchHistoryParcels() }
+}
+
+// Newest first, parcels without a timestamp last (the server's order)
+function compareParcels(a, b, sortField) {
+    const key = parcel => parcel[sortField] ? Date.parse(parcel[sortField]) : -Infinity
+    return key(b) - key(a) || (a.id < b.id ? 1 : a.id > b.id ? -1 : 0)
+}
+
+/**
+ * Replace (or extend, for the next page) a list with a fetch-parcels response.
+ * Returns false if the response is older than what the list already shows.
+ */
+function storeParcels(name, data, append = false) {
+    const list = parcelLists[name]
+    if (append && data.data_version !== list.version) {
+        // The list changed since its first page: start over so the pages line up
+        list.refetch()
+        return false
+    }
+    if (!append && list.version !== null && data.data_version < list.version) {
+        return false
+    }
+    list.version = data.data_version
+    list.parcels = append ? list.parcels.concat(data.parcels || []) : (data.parcels || [])
+    list.nextCursor = data.next_cursor
+    return true
+}
+
+/**
+ * Patch the lists with a delta ({parcel, data_version}) from a PubNub
+ * notification or an API response. Returns false if there is no delta.
+ */
+function applyParcelDelta(delta) {
+    if (!delta || !delta.parcel || delta.data_version == null) return false
+
+    for (const [name, list] of Object.entries(parcelLists)) {
+        // Not loaded yet (the fetch will include it) or already applied
+        if (list.version === null || delta.data_version <= list.version) continue
+
+        if (delta.data_version > list.version + 1) {
+            console.log(`🔄 Missed a parcel update (v${list.version} -> v${delta.data_version}), refetching ${name} parcels`)
+            list.refetch()
+            continue
+        }
+
+        list.version = delta.data_version
+        const others = list.parcels.filter(parcel => parcel.id !== delta.parcel.id)
+        const last = others[others.length - 1]
+        // A parcel sorting after the loaded pages shows up when the user loads its page
+        const belongs = (name === 'history') === Boolean(delta.parcel.collected_at) &&
+            !(list.nextCursor && last && compareParcels(delta.parcel, last, list.sortField) > 0)
+        if (!belongs && others.length === list.parcels.length) continue
+
+        list.parcels = belongs ? [...others, delta.parcel].sort((a, b) => compareParcels(a, b, list.sortField)) : others
+        if (name === 'active') renderActiveParcels()
+        else renderHistoryParcels()
+    }
+    return true
+}
+
+async function fetchActiveParcels(loadMore = false) {
     try {
-        const response = await fetch('/api/fetch-parcels?status=active')
+        const list = parcelLists.active
+        let url = `/api/fetch-parcels?status=active&limit=${ACTIVE_PAGE_SIZE}&fields=${ACTIVE_FIELDS}`
+        if (loadMore && list.nextCursor) {
+            url += `&cursor=${encodeURIComponent(list.nextCursor)}`
+        }
+
+        const response = await fetch(url)
         const data = await response.json()
 
         if (data.type === 'error') {
@@ -93,70 +177,8 @@ async function fetchActiveParcels() {
         }
 
         document.getElementById('parcelsMessage').innerHTML = ''
-        const activeParcels = document.getElementById('activeParcels')
-
-        if (data.parcels && data.parcels.length > 0) {
-            activeParcels.innerHTML = data.parcels.map(parcel => `
-                <div class="border-2 border-gray-200 rounded-xl sm:rounded-2xl p-4 sm:p-8 mb-4 sm:mb-5 hover:shadow-2xl hover:border-indigo-300 transition-all duration-300 bg-gradient-to-br from-white to-gray-50">
-                    <div class="flex flex-col sm:flex-row sm:justify-between sm:items-start gap-3 sm:gap-0 mb-4 sm:mb-5">
-                        <div class="flex-1">
-                            <h3 class="text-lg sm:text-2xl font-bold text-gray-800 mb-1 sm:mb-2">${parcel.parcel_name}</h3>
-                            <p class="text-xs sm:text-sm text-gray-500 mb-1">🏷️ Parcel ID: <span class="font-mono font-semibold">${parcel.id}</span></p>
-                            ${parcel.is_delivered ? `<p class="text-xs sm:text-sm text-gray-500">📅 Delivered: ${new Date(parcel.delivered_at).toLocaleString()}</p>` : ''}
-                        </div>
-                        <span class="self-start px-3 sm:px-4 py-1.5 sm:py-2 rounded-full text-xs sm:text-sm font-bold shadow-md ${parcel.is_delivered ? 'bg-gradient-to-r from-green-400 to-emerald-500 text-white' : 'bg-gradient-to-r from-yellow-400 to-orange-500 text-white'}">
-                            ${parcel.is_delivered ? '✓ Ready' : '⏳ In Transit'}
-                        </span>
-                    </div>
-                    
-                    <div class="bg-gradient-to-r from-indigo-50 to-purple-50 rounded-lg sm:rounded-xl p-3 sm:p-5 mb-4 sm:mb-5 border border-indigo-100">
-                        <p class="text-xs font-semibold text-indigo-600 uppercase tracking-wide mb-1 sm:mb-2">📍 Collection Point</p>
-                        <p class="text-base sm:text-lg font-bold text-indigo-700">Box: ${parcel.box_name}</p>
-                        <p class="text-xs sm:text-sm text-gray-600">${parcel.location}</p>
-                    </div>
-
-                    ${parcel.is_delivered ? `
-                    <div class="bg-gradient-to-r from-yellow-50 to-amber-50 border-l-4 border-yellow-400 p-3 sm:p-5 mb-4 sm:mb-5 rounded-lg shadow-sm">
-                        <div class="flex gap-2 sm:gap-3">
-                            <div class="flex-shrink-0">
-                                <svg class="h-5 w-5 sm:h-6 sm:w-6 text-yellow-500" viewBox="0 0 20 20" fill="currentColor">
-                                    <path fill-rule="evenodd" d="M8.257 3.099c.765-1.36 2.722-1.36 3.486 0l5.58 9.92c.75 1.334-.213 2.98-1.742 2.98H4.42c-1.53 0-2.493-1.646-1.743-2.98l5.58-9.92zM11 13a1 1 0 11-2 0 1 1 0 012 0zm-1-8a1 1 0 00-1 1v3a1 1 0 002 0V6a1 1 0 00-1-1z" clip-rule="evenodd"/>
-                                </svg>
-                            </div>
-                            <div>
-                                <p class="text-xs sm:text-sm font-semibold text-yellow-800 mb-1">⚠️ Important Notice</p>
-                                <p class="text-xs sm:text-sm text-yellow-700">
-                                    Only click "Unlock Box" when you are <span class="font-bold">physically at the collection point</span> and ready to collect your parcel immediately.
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                    <div id="buttons-${parcel.id}">
-                        <button 
-                            onclick="unlockBox('${parcel.id}', '${parcel.box_id}')"
-                            class="w-full bg-gradient-to-r from-indigo-600 to-purple-600 hover:from-indigo-700 hover:to-purple-700 text-white font-bold py-3 sm:py-4 rounded-xl transition-all duration-200 shadow-lg hover:shadow-xl transform hover:-translate-y-1 flex items-center justify-center gap-2 sm:gap-3 text-sm sm:text-base"
-                        >
-                            <svg class="w-5 h-5 sm:w-6 sm:h-6" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M8 11V7a4 4 0 118 0m-4 8v2m-6 4h12a2 2 0 002-2v-6a2 2 0 00-2-2H6a2 2 0 00-2 2v6a2 2 0 002 2z"/>
-                            </svg>
-                            <span>Unlock Box</span>
-                        </button>
-                    </div>
-                    ` : '<div class="bg-gray-50 border-2 border-dashed border-gray-300 rounded-lg sm:rounded-xl p-4 sm:p-5 text-center"><p class="text-gray-500 text-xs sm:text-sm font-medium">📦 Parcel is still in transit to collection point</p></div>'}
-                </div>
-            `).join('')
-        } else {
-            activeParcels.innerHTML = `
-                <div class="text-center py-10 sm:py-16 bg-gradient-to-br from-gray-50 to-indigo-50 rounded-xl sm:rounded-2xl border-2 border-dashed border-gray-300">
-                    <div class="inline-flex items-center justify-center w-16 h-16 sm:w-20 sm:h-20 bg-gradient-to-br from-indigo-100 to-purple-100 rounded-full mb-3 sm:mb-4">
-                        <svg class="w-8 h-8 sm:w-10 sm:h-10 text-indigo-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M20 13V6a2 2 0 00-2-2H6a2 2 0 00-2 2v7m16 0v5a2 2 0 01-2 2H6a2 2 0 01-2-2v-5m16 0h-2.586a1 1 0 00-.707.293l-2.414 2.414a1 1 0 01-.707.293h-3.172a1 1 0 01-.707-.293l-2.414-2.414A1 1 0 006.586 13H4"/>
-                        </svg>
-                    </div>
-                    <p class="text-gray-500 font-semibold text-base sm:text-lg">No active parcels</p>
-                    <p class="text-gray-400 text-xs sm:text-sm mt-2">Register a parcel above to get started</p>
-                </div>
-            `
+        if (storeParcels('active', data, loadMore)) {
+            renderActiveParcels()
         }
     } catch (e) {
         showMessage('parcelsMessage', {
@@ -167,9 +189,84 @@ async function fetchActiveParcels() {
     }
 }
 
-async function fetchHistoryParcels() {
+function renderActiveParcels() {
+    const activeParcels = document.getElementById('activeParcels')
+    const parcels = parcelLists.active.parcels
+    document.getElementById('activeLoadMore').classList.toggle('hidden', !parcelLists.active.nextCursor)
+
+    if (parcels.length > 0) {
+        activeParcels.innerHTML = parcels.map(parcel => `
+            <div class="border-2 border-gray-200 rounded-xl sm:rounded-2xl p-4 sm:p-8 mb-4 sm:mb-5 hover:shadow-2xl hover:border-indigo-300 transition-all duration-300 bg-gradient-to-br from-white to-gray-50">
+                <div class="flex flex-col sm:flex-row sm:justify-between sm:items-start gap-3 sm:gap-0 mb-4 sm:mb-5">
+                    <div class="flex-1">
+                        <h3 class="text-lg sm:text-2xl font-bold text-gray-800 mb-1 sm:mb-2">${parcel.parcel_name}</h3>
+                        <p class="text-xs sm:text-sm text-gray-500 mb-1">🏷️ Parcel ID: <span class="font-mono font-semibold">${parcel.id}</span></p>
+                        ${parcel.is_delivered ? `<p class="text-xs sm:text-sm text-gray-500">📅 Delivered: ${new Date(parcel.delivered_at).toLocaleString()}</p>` : ''}
+                    </div>
+                    <span class="self-start px-3 sm:px-4 py-1.5 sm:py-2 rounded-full text-xs sm:text-sm font-bold shadow-md ${parcel.is_delivered ? 'bg-gradient-to-r from-green-400 to-emerald-500 text-white' : 'bg-gradient-to-r from-yellow-400 to-orange-500 text-white'}">
+                        ${parcel.is_delivered ? '✓ Ready' : '⏳ In Transit'}
+                    </span>
+                </div>
+                
+                <div class="bg-gradient-to-r from-indigo-50 to-purple-50 rounded-lg sm:rounded-xl p-3 sm:p-5 mb-4 sm:mb-5 border border-indigo-100">
+                    <p class="text-xs font-semibold text-indigo-600 uppercase tracking-wide mb-1 sm:mb-2">📍 Collection Point</p>
+                    <p class="text-base sm:text-lg font-bold text-indigo-700">Box: ${parcel.box_name}</p>
+                    <p class="text-xs sm:text-sm text-gray-600">${parcel.location}</p>
+                </div>
+
+                ${parcel.is_delivered ? `
+                <div class="bg-gradient-to-r from-yellow-50 to-amber-50 border-l-4 border-yellow-400 p-3 sm:p-5 mb-4 sm:mb-5 rounded-lg shadow-sm">
+                    <div class="flex gap-2 sm:gap-3">
+                        <div class="flex-shrink-0">
+                            <svg class="h-5 w-5 sm:h-6 sm:w-6 text-yellow-500" viewBox="0 0 20 20" fill="currentColor">
+                                <path fill-rule="evenodd" d="M8.257 3.099c.765-1.36 2.722-1.36 3.486 0l5.58 9.92c.75 1.334-.213 2.98-1.742 2.98H4.42c-1.53 0-2.493-1.646-1.743-2.98l5.58-9.92zM11 13a1 1 0 11-2 0 1 1 0 012 0zm-1-8a1 1 0 00-1 1v3a1 1 0 002 0V6a1 1 0 00-1-1z" clip-rule="evenodd"/>
+                            </svg>
+                        </div>
+                        <div>
+                            <p class="text-xs sm:text-sm font-semibold text-yellow-800 mb-1">⚠️ Important Notice</p>
+                            <p class="text-xs sm:text-sm text-yellow-700">
+                                Only click "Unlock Box" when you are <span class="font-bold">physically at the collection point</span> and ready to collect your parcel immediately.
+                            </p>
+                        </div>
+                    </div>
+                </div>
+                <div id="buttons-${parcel.id}">
+                    <button 
+                        onclick="unlockBox('${parcel.id}', '${parcel.box_id}')"
+                        class="w-full bg-gradient-to-r from-indigo-600 to-purple-600 hover:from-indigo-700 hover:to-purple-700 text-white font-bold py-3 sm:py-4 rounded-xl transition-all duration-200 shadow-lg hover:shadow-xl transform hover:-translate-y-1 flex items-center justify-center gap-2 sm:gap-3 text-sm sm:text-base"
+                    >
+                        <svg class="w-5 h-5 sm:w-6 sm:h-6" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M8 11V7a4 4 0 118 0m-4 8v2m-6 4h12a2 2 0 002-2v-6a2 2 0 00-2-2H6a2 2 0 00-2 2v6a2 2 0 002 2z"/>
+                        </svg>
+                        <span>Unlock Box</span>
+                    </button>
+                </div>
+                ` : '<div class="bg-gray-50 border-2 border-dashed border-gray-300 rounded-lg sm:rounded-xl p-4 sm:p-5 text-center"><p class="text-gray-500 text-xs sm:text-sm font-medium">📦 Parcel is still in transit to collection point</p></div>'}
+            </div>
+        `).join('')
+    } else {
+        activeParcels.innerHTML = `
+            <div class="text-center py-10 sm:py-16 bg-gradient-to-br from-gray-50 to-indigo-50 rounded-xl sm:rounded-2xl border-2 border-dashed border-gray-300">
+                <div class="inline-flex items-center justify-center w-16 h-16 sm:w-20 sm:h-20 bg-gradient-to-br from-indigo-100 to-purple-100 rounded-full mb-3 sm:mb-4">
+                    <svg class="w-8 h-8 sm:w-10 sm:h-10 text-indigo-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                        <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M20 13V6a2 2 0 00-2-2H6a2 2 0 00-2 2v7m16 0v5a2 2 0 01-2 2H6a2 2 0 01-2-2v-5m16 0h-2.586a1 1 0 00-.707.293l-2.414 2.414a1 1 0 01-.707.293h-3.172a1 1 0 01-.707-.293l-2.414-2.414A1 1 0 006.586 13H4"/>
+                    </svg>
+                </div>
+                <p class="text-gray-500 font-semibold text-base sm:text-lg">No active parcels</p>
+                <p class="text-gray-400 text-xs sm:text-sm mt-2">Register a parcel above to get started</p>
+            </div>
+        `
+    }
+}
+
+async function fetchHistoryParcels(loadMore = false) {
     try {
-        const response = await fetch('/api/fetch-parcels?status=history')
+        let url = `/api/fetch-parcels?status=history&limit=${HISTORY_PAGE_SIZE}&fields=${HISTORY_FIELDS}`
+        if (loadMore && parcelLists.history.nextCursor) {
+            url += `&cursor=${encodeURIComponent(parcelLists.history.nextCursor)}`
+        }
+
+        const response = await fetch(url)
         const data = await response.json()
 
         if (data.type === 'error') {
@@ -179,52 +276,8 @@ async function fetchHistoryParcels() {
         }
 
         document.getElementById('parcelsMessage').innerHTML = ''
-        const historyParcels = document.getElementById('historyParcels')
-
-        if (data.parcels && data.parcels.length > 0) {
-            historyParcels.innerHTML = data.parcels.map(parcel => `
-                <div class="border-2 border-gray-200 rounded-2xl p-7 mb-4 bg-gradient-to-br from-gray-50 to-gray-100 hover:shadow-lg transition-all duration-300">
-                    <div class="flex justify-between items-start mb-4">
-                        <div class="flex-1">
-                            <h3 class="text-xl font-bold text-gray-800 mb-2">${parcel.parcel_name}</h3>
-                            <p class="text-sm text-gray-500 font-mono">🏷️ ID: ${parcel.id}</p>
-                        </div>
-                        <span class="px-4 py-2 rounded-full text-sm font-bold bg-gradient-to-r from-gray-400 to-gray-500 text-white shadow-md">
-                            ✓ Collected
-                        </span>
-                    </div>
-                    
-                    <div class="bg-white rounded-xl p-4 space-y-2 border border-gray-200">
-                        <div class="flex items-center gap-2 text-gray-700">
-                            <svg class="w-5 h-5 text-indigo-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"/>
-                                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"/>
-                            </svg>
-                            <span class="font-semibold text-sm">Box: ${parcel.box_name}</span>
-                            <span class="text-gray-400">•</span>
-                            <span class="text-sm">${parcel.location}</span>
-                        </div>
-                        <div class="flex items-center gap-2 text-gray-700">
-                            <svg class="w-5 h-5 text-green-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 12l2 2 4-4m6 2a9 9 0 11-18 0 9 9 0 0118 0z"/>
-                            </svg>
-                            <span class="text-sm font-medium">${new Date(parcel.collected_at).toLocaleString()}</span>
-                        </div>
-                    </div>
-                </div>
-            `).join('')
-        } else {
-            historyParcels.innerHTML = `
-                <div class="text-center py-16 bg-gradient-to-br from-gray-50 to-slate-100 rounded-2xl border-2 border-dashed border-gray-300">
-                    <div class="inline-flex items-center justify-center w-20 h-20 bg-gradient-to-br from-gray-100 to-slate-200 rounded-full mb-4">
-                        <svg class="w-10 h-10 text-gray-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M12 8v4l3 3m6-3a9 9 0 11-18 0 9 9 0 0118 0z"/>
-                        </svg>
-                    </div>
-                    <p class="text-gray-500 font-semibold text-lg">No collection history yet</p>
-                    <p class="text-gray-400 text-sm mt-2">Your collected parcels will appear here</p>
-                </div>
-            `
+        if (storeParcels('history', data, loadMore)) {
+            renderHistoryParcels()
         }
     } catch (e) {
         showMessage('parcelsMessage', {
@@ -235,6 +288,58 @@ async function fetchHistoryParcels() {
     }
 }
 
+function renderHistoryParcels() {
+    const historyParcels = document.getElementById('historyParcels')
+    const parcels = parcelLists.history.parcels
+    document.getElementById('historyLoadMore').classList.toggle('hidden', !parcelLists.history.nextCursor)
+
+    if (parcels.length > 0) {
+        historyParcels.innerHTML = parcels.map(parcel => `
+            <div class="border-2 border-gray-200 rounded-2xl p-7 mb-4 bg-gradient-to-br from-gray-50 to-gray-100 hover:shadow-lg transition-all duration-300">
+                <div class="flex justify-between items-start mb-4">
+                    <div class="flex-1">
+                        <h3 class="text-xl font-bold text-gray-800 mb-2">${parcel.parcel_name}</h3>
+                        <p class="text-sm text-gray-500 font-mono">🏷️ ID: ${parcel.id}</p>
+                    </div>
+                    <span class="px-4 py-2 rounded-full text-sm font-bold bg-gradient-to-r from-gray-400 to-gray-500 text-white shadow-md">
+                        ✓ Collected
+                    </span>
+                </div>
+                
+                <div class="bg-white rounded-xl p-4 space-y-2 border border-gray-200">
+                    <div class="flex items-center gap-2 text-gray-700">
+                        <svg class="w-5 h-5 text-indigo-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"/>
+                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"/>
+                        </svg>
+                        <span class="font-semibold text-sm">Box: ${parcel.box_name}</span>
+                        <span class="text-gray-400">•</span>
+                        <span class="text-sm">${parcel.location}</span>
+                    </div>
+                    <div class="flex items-center gap-2 text-gray-700">
+                        <svg class="w-5 h-5 text-green-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 12l2 2 4-4m6 2a9 9 0 11-18 0 9 9 0 0118 0z"/>
+                        </svg>
+                        <span class="text-sm font-medium">${new Date(parcel.collected_at).toLocaleString()}</span>
+                    </div>
+                </div>
+            </div>
+        `).join('')
+    } else {
+        historyParcels.innerHTML = `
+            <div class="text-center py-16 bg-gradient-to-br from-gray-50 to-slate-100 rounded-2xl border-2 border-dashed border-gray-300">
+                <div class="inline-flex items-center justify-center w-20 h-20 bg-gradient-to-br from-gray-100 to-slate-200 rounded-full mb-4">
+                    <svg class="w-10 h-10 text-gray-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                        <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M12 8v4l3 3m6-3a9 9 0 11-18 0 9 9 0 0118 0z"/>
+                    </svg>
+                </div>
+                <p class="text-gray-500 font-semibold text-lg">No collection history yet</p>
+                <p class="text-gray-400 text-sm mt-2">Your collected parcels will appear here</p>
+            </div>
+        `
+    }
+}
+
 // ==========================================
 // Box Control Functions
 // ==========================================
@@ -252,6 +357,8 @@ async function unlockBox(parcelId, boxId) {
         else if (data.error) showToast(data.error, data.type)
 
         if (data.type === 'success') {
+            confirmCommand(data.command_id, 'Box unlocked')
+
             // Replace unlock button with lock and collected buttons
             const buttonsContainer = document.getElementById(`buttons-${parcelId}`)
             if (buttonsContainer) {
@@ -284,6 +391,24 @@ async function unlockBox(parcelId, boxId) {
     }
 }
 
+/**
+ * Wait for the box to acknowledge a lock/unlock command and report the result
+ */
+async function confirmCommand(commandId, doneMessage) {
+    if (!commandId) return
+    try {
+        const response = await fetch(`/api/commands/${commandId}?wait=8`)
+        const data = await response.json()
+
+        if (data.confirmed) showToast(doneMessage, 'success')
+        else if (data.command && data.command.status !== 'superseded') {
+            showToast('The box has not confirmed yet. Please check it.', 'error')
+        }
+    } catch (e) {
+        console.error('Failed to confirm box command:', e)
+    }
+}
+
 async function lockBox(parcelId, boxId) {
     try {
         const response = await fetch('/api/lock-box', {
@@ -297,6 +422,8 @@ async function lockBox(parcelId, boxId) {
         else if (data.error) showToast(data.error, data.type)
 
         if (data.type === 'success') {
+            confirmCommand(data.command_id, 'Box locked')
+
             // Replace lock/collected buttons with unlock button
             const buttonsContainer = document.getElementById(`buttons-${parcelId}`)
             if (buttonsContainer) {
@@ -361,15 +488,11 @@ async function forceMarkCollected() {
                 parcelCard.style.opacity = '0'
                 parcelCard.style.transform = 'scale(0.95)'
                 
-                // Wait for animation then refresh
-                setTimeout(() => {
-                    fetchActiveParcels()
-                    fetchHistoryParcels()
-                }, 500)
+                // Wait for animation then move it to the history list
+                setTimeout(() => refreshAfterCollection(data), 500)
             } else {
                 // Fallback if card not found
-                fetchActiveParcels()
-                fetchHistoryParcels()
+                refreshAfterCollection(data)
             }
         }
     } catch (e) {
@@ -377,6 +500,14 @@ async function forceMarkCollected() {
     }
 }
 
+// Apply the collected parcel's delta, or refetch both lists if the response has none
+function refreshAfterCollection(data) {
+    if (!applyParcelDelta(data)) {
+        fetchActiveParcels()
+        fetchHistoryParcels()
+    }
+}
+
 async function markCollected(parcelId) {
     try {
         showToast('Checking if parcel was removed...', 'info')
@@ -389,16 +520,16 @@ async function markCollected(parcelId) {
 
         const data = await response.json()
 
-        if (data.type === 'weight_check') {
-            // Wait for weight check response from load cell via PubNub
-            // The response will be handled by PubNub listener
-            // Store parcelId for later use
-            window.pendingWeightCheckParcelId = parcelId
+        if (data.type === 'weight_detected') {
+            // The load cell still reports weight: let the user confirm
+            showWeightWarningModal(parcelId)
+        } else if (data.type === 'weight_check_timeout') {
+            // The box did not answer in time: let the user confirm
+            showToast(data.error, 'info')
+            showWeightWarningModal(parcelId)
         } else if (data.type === 'success') {
             if (data.message) showToast(data.message, data.type)
-            // Refresh parcels list
-            fetchActiveParcels()
-            fetchHistoryParcels()
+            refreshAfterCollection(data)
         } else if (data.error) {
             showToast(data.error, data.type)
         }
@@ -428,7 +559,7 @@ function initRegisterForm() {
 
             if (data.type === 'success' || data.type === 'info') {
                 document.getElementById('parcelId').value = ''
-                fetchActiveParcels()
+                if (!applyParcelDelta(data)) fetchActiveParcels()
             }
         } catch (e) {
             showMessage('registerMessage', {
@@ -452,8 +583,8 @@ function initHomePubNub(userId, subscribeKey, pubnubToken) {
                 type: 'success'
             })
 
-            // Refresh parcel list if on active tab
-            if (currentTab === 'active') {
+            // Patch the list from the notification's delta; older messages without one need a refetch
+            if (!applyParcelDelta(parcelInfo)) {
                 fetchActiveParcels()
             }
         }
@@ -90,71 +90,24 @@ function handlePubNubMessage(event, callbacks) {
     
     if (messageType === 'parcel_delivered' && callbacks.onParcelDelivered) {
         callbacks.onParcelDelivered(event.message)
+        reportDisplayed(event.message.trace_id)
     } else if (messageType === 'weight_check_response') {
-        // Handle weight check response from load cell
-        const hasWeight = event.message.has_weight
-        const parcelId = event.message.parcel_id
-        
-        console.log(`⚖️ Weight check response for ${parcelId}: ${hasWeight ? 'HAS WEIGHT' : 'EMPTY'}`)
-        
-        if (hasWeight) {
-            // Show warning modal
-            console.log('⚠️ Weight detected, showing warning modal')
-            if (typeof showWeightWarningModal === 'function') {
-                showWeightWarningModal(parcelId)
-            }
-        } else {
-            // No weight detected, directly mark as collected
-            console.log('✅ No weight detected, marking as collected automatically')
-            markAsCollectedAfterWeightCheck(parcelId)
-        }
+        // The mark-collected request waits for this answer on the server and acts on it
+        console.log(`⚖️ Weight check response for ${event.message.parcel_id}: ${event.message.has_weight ? 'HAS WEIGHT' : 'EMPTY'}`)
     }
 }
 
 /**
- * Mark parcel as collected after successful weight check
+ * Report when a traced delivery reached the dashboard (see /api/delivery-latency)
  */
-async function markAsCollectedAfterWeightCheck(parcelId) {
-    try {
-        console.log(`🔄 Attempting to mark parcel ${parcelId} as collected...`)
-        
-        const response = await fetch('/api/mark-collected', {
-            method: "POST",
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                parcel_id: parcelId,
-                force: true  // Force collection since weight check passed
-            })
-        })
-
-        const data = await response.json()
-        
-        if (data.message) {
-            if (typeof showToast === 'function') {
-                showToast(data.message, data.type)
-            }
-        } else if (data.error) {
-            if (typeof showToast === 'function') {
-                showToast(data.error, data.type)
-            }
-        }
-
-        if (data.type === 'success') {
-            console.log('✅ Parcel marked as collected successfully')
-            // Refresh parcels list
-            if (typeof fetchActiveParcels === 'function') {
-                fetchActiveParcels()
-            }
-            if (typeof fetchHistoryParcels === 'function') {
-                fetchHistoryParcels()
-            }
-        }
-    } catch (e) {
-        console.error('❌ Error marking parcel as collected:', e)
-        if (typeof showToast === 'function') {
-            showToast('Connection error. Please try again.', 'error')
-        }
-    }
+function reportDisplayed(traceId) {
+    if (!traceId) return
+    fetch(`/api/traces/${encodeURIComponent(traceId)}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ spans: { displayed: Date.now() / 1000 } }),
+        keepalive: true
+    }).catch(e => console.warn('Failed to report delivery trace:', e))
 }
 
 /**
@@ -0,0 +1,23 @@
+"""
+Latency statistics shared by the command tracker, the delivery tracer and the benchmarks
+"""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers (None for no samples)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def latency_stats(samples):
+    """Count, p50/p95/p99 and max of a non-empty list of millisecond latencies"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50), 1),
+        "p95_ms": round(percentile(samples, 95), 1),
+        "p99_ms": round(percentile(samples, 99), 1),
+        "max_ms": round(max(samples), 1),
+    }
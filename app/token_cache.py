@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+from metrics import metrics
+from sqlite_store import SQLiteStore
+
+
+class SQLiteTokenStore(SQLiteStore):
+    """Token store backed by a SQLite file so every gunicorn worker shares the same tokens"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS tokens (
+            cache_key TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            issued_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            refresh_claimed_until REAL NOT NULL DEFAULT 0
+        )
+        """,
+    )
+
+    def get(self, key):
+        """Return (token, issued_at, expires_at) or None"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT token, issued_at, expires_at FROM tokens WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+
+    def put(self, key, token, issued_at, expires_at):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO tokens (cache_key, token, issued_at, expires_at, refresh_claimed_until)
+                VALUES (?, ?, ?, ?, 0)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    token = excluded.token,
+                    issued_at = excluded.issued_at,
+                    expires_at = excluded.expires_at,
+                    refresh_claimed_until = 0
+                """,
+                (key, token, issued_at, expires_at)
+            )
+
+    def claim_refresh(self, key, lease_seconds):
+        """Claim the right to refresh a token so only one worker re-grants it"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE tokens SET refresh_claimed_until = ?
+                WHERE cache_key = ? AND refresh_claimed_until < ?
+                """,
+                (now + lease_seconds, key, now)
+            )
+            return cursor.rowcount == 1
+
+    def release_refresh(self, key):
+        with self._connect() as conn:
+            conn.execute("UPDATE tokens SET refresh_claimed_until = 0 WHERE cache_key = ?", (key,))
+
+
+class TokenCache:
+    """TTL-aware cache for PubNub access tokens
+
+    A token is served from the store while it is valid. Once it is older than
+    refresh_fraction of its TTL it is still served, and a background thread
+    grants a replacement so no request waits on PubNub.
+    Hit, miss, refresh and error counts go to the shared metrics, so stats()
+    covers every gunicorn worker.
+    """
+
+    COUNTERS = ("hits", "misses", "refreshes", "errors")
+
+    def __init__(self, store, refresh_fraction=0.8, expiry_margin=60, refresh_lease=30):
+        self.store = store
+        self.refresh_fraction = refresh_fraction
+        self.expiry_margin = expiry_margin  # Never hand out a token this close (seconds) to expiry
+        self.refresh_lease = refresh_lease
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def get(self, key, ttl_seconds, grant):
+        """Return a cached token for key, calling grant() on a miss
+
+        Args:
+            key: Cache key, e.g. "user-42|user-read"
+            ttl_seconds: Lifetime of a freshly granted token
+            grant: Callable returning a new token string (or None on failure)
+        """
+        now = time.time()
+        try:
+            entry = self.store.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ Token cache unavailable: {e}")
+            entry = None
+
+        if entry and now < entry[2] - self.expiry_margin:
+            token, issued_at, expires_at = entry
+            self._count("hits")
+            if now - issued_at >= (expires_at - issued_at) * self.refresh_fraction:
+                self._refresh_in_background(key, ttl_seconds, grant)
+            return token
+
+        self._count("misses")
+        return self._grant_and_store(key, ttl_seconds, grant)
+
+    def stats(self):
+        totals = metrics.totals("token_cache_events_total", "result")
+        return {counter: int(totals[counter]) for counter in self.COUNTERS}
+
+    def _count(self, counter):
+        metrics.inc("token_cache_events_total", {"result": counter})
+
+    def _grant_and_store(self, key, ttl_seconds, grant):
+        issued_at = time.time()
+        token = grant()
+        if not token:
+            self._count("errors")
+            return None
+
+        try:
+            self.store.put(key, token, issued_at, issued_at + ttl_seconds)
+        except sqlite3.Error as e:
+            print(f"⚠️ Failed to cache token: {e}")
+        return token
+
+    def _refresh_in_background(self, key, ttl_seconds, grant):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                # Another worker may already be refreshing this token
+                if not self.store.claim_refresh(key, self.refresh_lease):
+                    return
+                if self._grant_and_store(key, ttl_seconds, grant):
+                    self._count("refreshes")
+                else:
+                    self.store.release_refresh(key)
+            except Exception as e:
+                self._count("errors")
+                print(f"❌ Background token refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
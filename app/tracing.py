@@ -0,0 +1,160 @@
+import sqlite3
+import time
+from stats import latency_stats
+from sqlite_store import SQLiteStore
+
+# Hops of a delivery in the order they happen; each event carries spans {hop: epoch seconds}
+HOPS = ("detected", "sent", "received", "committed", "notified", "displayed")
+
+# Hops the dashboard may report itself
+CLIENT_HOPS = ("displayed",)
+
+
+def stamp(event, hop):
+    """Record that a traced event reached hop now (no-op for events without a trace_id)"""
+    if isinstance(event, dict) and event.get("trace_id"):
+        spans = event.get("spans")
+        if not isinstance(spans, dict):
+            spans = event["spans"] = {}
+        spans.setdefault(hop, time.time())
+    return event
+
+
+class SQLiteTraceStore(SQLiteStore):
+    """Delivery traces and their spans, shared by the web workers and the consumer"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS traces (
+            trace_id TEXT PRIMARY KEY,
+            box_id TEXT,
+            parcel_id TEXT,
+            via TEXT,
+            created_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spans (
+            trace_id TEXT NOT NULL,
+            hop TEXT NOT NULL,
+            at REAL NOT NULL,
+            PRIMARY KEY (trace_id, hop)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_traces_created ON traces (created_at)",
+    )
+
+    def record(self, trace_id, spans, box_id=None, parcel_id=None, via=None):
+        """Store a trace's spans; the first time recorded for a hop wins"""
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT OR IGNORE INTO traces (trace_id, box_id, parcel_id, via, created_at) VALUES (?, ?, ?, ?, ?)",
+                (trace_id, box_id, parcel_id, via, time.time())
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO spans (trace_id, hop, at) VALUES (?, ?, ?)",
+                [(trace_id, hop, at) for hop, at in spans.items()]
+            )
+            conn.execute("COMMIT")
+
+    def parcel_of(self, trace_id):
+        """Parcel ID a trace was recorded for, None for unknown traces"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT parcel_id FROM traces WHERE trace_id = ?", (trace_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_span(self, trace_id, hop, at):
+        """Add a span to a known trace. Returns False if the trace is unknown or already has the hop"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO spans (trace_id, hop, at)
+                SELECT trace_id, ?, ? FROM traces WHERE trace_id = ?
+                """,
+                (hop, at, trace_id)
+            )
+            return cursor.rowcount == 1
+
+    def recent(self, limit=1000):
+        """[(via, {hop: at})] of the most recent traces"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT t.trace_id, t.via, s.hop, s.at FROM (
+                    SELECT trace_id, via FROM traces ORDER BY created_at DESC LIMIT ?
+                ) t JOIN spans s ON s.trace_id = t.trace_id
+                """,
+                (limit,)
+            ).fetchall()
+        traces = {}
+        for trace_id, via, hop, at in rows:
+            traces.setdefault(trace_id, (via, {}))[1][hop] = at
+        return list(traces.values())
+
+    def purge(self, max_age):
+        with self._connect() as conn:
+            cutoff = time.time() - max_age
+            conn.execute("DELETE FROM spans WHERE trace_id IN (SELECT trace_id FROM traces WHERE created_at < ?)",
+                         (cutoff,))
+            conn.execute("DELETE FROM traces WHERE created_at < ?", (cutoff,))
+
+
+class DeliveryTracer:
+    """Follows delivery events from the load cell to the user's browser
+
+    Boxes give each delivery a trace_id and stamp the detected and sent
+    hops; the backend stamps received, committed and notified and stores
+    the spans of the copy (HTTP or PubNub) that recorded the delivery; the
+    dashboard reports displayed. Spans are wall-clock times from different
+    hosts, so hop latencies are only as good as their clock sync.
+    """
+
+    def __init__(self, store, retention=7 * 86400):
+        self.store = store
+        self.retention = retention
+        self._last_purge = 0
+
+    def record(self, event, via):
+        """Store the spans of a traced delivery event; tracing never fails a delivery"""
+        trace_id = event.get("trace_id")
+        spans = event.get("spans")
+        if not trace_id or not isinstance(spans, dict):
+            return
+        try:
+            self.store.record(str(trace_id), {hop: float(at) for hop, at in spans.items() if hop in HOPS},
+                              box_id=str(event.get("box_id")), parcel_id=str(event.get("parcel_id")), via=via)
+            if time.time() - self._last_purge > 3600:
+                self.store.purge(self.retention)
+                self._last_purge = time.time()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"⚠️ Failed to record delivery trace {trace_id}: {e}")
+
+    def parcel_of(self, trace_id):
+        return self.store.parcel_of(trace_id)
+
+    def add_span(self, trace_id, hop, at):
+        return self.store.add_span(trace_id, hop, at)
+
+    def report(self, limit=1000):
+        """Per-hop latency (from the previous recorded hop) and total latency percentiles of recent deliveries"""
+        traces = self.store.recent(limit)
+        hops, total, by_via = {}, [], {}
+        for via, spans in traces:
+            previous = spans.get("detected")
+            for hop in HOPS[1:]:
+                if hop not in spans:
+                    continue
+                if previous is not None:
+                    hops.setdefault(hop, []).append((spans[hop] - previous) * 1000)
+                previous = spans[hop]
+            if "detected" in spans and previous != spans["detected"]:
+                total.append((previous - spans["detected"]) * 1000)
+                by_via.setdefault(via or "unknown", []).append(total[-1])
+
+        return {
+            "traces": len(traces),
+            "hops": {hop: latency_stats(hops[hop]) for hop in HOPS if hop in hops},
+            "total": latency_stats(total) if total else None,
+            "by_via": {via: latency_stats(samples) for via, samples in by_via.items()},
+        }
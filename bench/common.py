@@ -0,0 +1,142 @@
+"""
+Shared helpers for the benchmark scripts: a portable copy of the schema,
+a seeder for large parcel tables and latency statistics.
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import (Boolean, Column, ForeignKey, Integer, MetaData, String, Table, TIMESTAMP,
+                        create_engine, insert)
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(ROOT_DIR, "db"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "app"))
+
+import box_state  # noqa: E402
+from stats import percentile  # noqa: E402,F401  (re-exported for the benchmarks)
+
+# Mirrors db/schema.sql so the benchmarks can run on SQLite as well as MySQL
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(100), nullable=False),
+    Column("email", String(100), unique=True, nullable=False),
+    Column("password_hash", String(255), nullable=False),
+    Column("data_version", Integer, nullable=False, server_default="0"),
+)
+
+boxes = Table(
+    "boxes", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("box_name", String(100), nullable=False),
+    Column("location", String(255)),
+    Column("state", String(16), nullable=False, server_default="empty"),
+    Column("occupant_parcel_id", String(100)),
+    Column("expected_parcel_id", String(100)),
+    Column("state_updated_at", TIMESTAMP),
+)
+
+parcels = Table(
+    "parcels", metadata,
+    Column("id", String(100), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("box_id", Integer, ForeignKey("boxes.id", ondelete="CASCADE"), nullable=False),
+    Column("parcel_name", String(255), nullable=False),
+    Column("is_delivered", Boolean, default=False),
+    Column("delivered_at", TIMESTAMP),
+    Column("collected_at", TIMESTAMP),
+)
+
+
+def make_engine(url=None):
+    """Engine for url, or for a fresh SQLite file when url is None"""
+    if url is None:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="delivery-box-bench-"), "bench.db")
+    return create_engine(url)
+
+
+def make_app(url, pubnub=None, profile="prod", **overrides):
+    """Flask app from the application factory, pointed at url, with the pool settings of profile"""
+    from app import create_app
+    from config import get_config
+
+    class BenchConfig(get_config(profile)):
+        SQLALCHEMY_DATABASE_URI = url
+        SQLALCHEMY_ECHO = False
+
+    for key, value in overrides.items():
+        setattr(BenchConfig, key, value)
+    return create_app(BenchConfig, pubnub=pubnub)
+
+
+def create_schema(engine):
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+
+def seed(engine, n_users=1000, n_boxes=200, n_parcels=300000, active_per_box=1, seed_value=42):
+    """Fill the database with mostly historical (collected) parcels
+
+    Every box gets active_per_box delivered-but-uncollected parcels plus one
+    registered parcel still in transit; everything else is history.
+    """
+    rng = random.Random(seed_value)
+    now = datetime.now()
+
+    with engine.begin() as conn:
+        conn.execute(insert(users), [
+            {"name": f"User {i}", "email": f"user{i}@example.com", "password_hash": f"sub-{i}"}
+            for i in range(1, n_users + 1)
+        ])
+        conn.execute(insert(boxes), [
+            {"box_name": f"Box {i}", "location": f"Block {i % 20}"}
+            for i in range(1, n_boxes + 1)
+        ])
+
+    rows = []
+    for i in range(n_parcels):
+        box_id = i % n_boxes + 1
+        delivered_at = now - timedelta(minutes=(n_parcels - i) * 5)
+        rows.append({
+            "id": f"PCL{i:08d}",
+            "user_id": rng.randint(1, n_users),
+            "box_id": box_id,
+            "parcel_name": f"Parcel {i}",
+            "is_delivered": True,
+            "delivered_at": delivered_at,
+            "collected_at": delivered_at + timedelta(hours=rng.randint(1, 48)),
+        })
+
+    for box_id in range(1, n_boxes + 1):
+        for j in range(active_per_box):
+            rows.append({
+                "id": f"ACT{box_id:05d}{j:02d}", "user_id": rng.randint(1, n_users), "box_id": box_id,
+                "parcel_name": f"Active {box_id}-{j}", "is_delivered": True,
+                "delivered_at": now, "collected_at": None,
+            })
+        rows.append({
+            "id": f"EXP{box_id:05d}", "user_id": rng.randint(1, n_users), "box_id": box_id,
+            "parcel_name": f"Expected {box_id}", "is_delivered": False,
+            "delivered_at": None, "collected_at": None,
+        })
+
+    with engine.begin() as conn:
+        for start in range(0, len(rows), 5000):
+            conn.execute(insert(parcels), rows[start:start + 5000])
+        box_state.reconcile(conn)
+    return len(rows)
+
+
+def summarize(samples_ms):
+    return {
+        "count": len(samples_ms),
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "max_ms": round(max(samples_ms), 3),
+    }
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for /api/parcel-delivered
+Many threads deliver different parcels into the same box at once; exactly one
+of them may succeed, every other request must report the box as occupied.
+Usage:
+    python3 bench/delivery_race.py                 # SQLite scratch database
+    python3 bench/delivery_race.py --threads 64 --rounds 20
+    python3 bench/delivery_race.py --url mysql+pymysql://root@localhost/delivery_box_bench
+
+The target database is dropped and re-seeded, never point --url at real data.
+"""
+import argparse
+import sys
+import threading
+from collections import Counter
+from sqlalchemy import insert, update
+from common import boxes, create_schema, make_app, make_engine, parcels, users
+import box_state
+
+
+def run_round(app, box_id, parcel_ids):
+    barrier = threading.Barrier(len(parcel_ids))
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def deliver(parcel_id):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post("/api/parcel-delivered", json={"parcel_id": parcel_id})
+        outcome = (response.get_json() or {}).get("outcome", f"http_{response.status_code}")
+        with lock:
+            outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=deliver, args=(pid,)) for pid in parcel_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer one box with concurrent deliveries")
+    parser.add_argument("--url", help="SQLAlchemy URL of a scratch database (default: temporary SQLite file)")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(users), [{"name": "Race", "email": "race@example.com", "password_hash": "x"}])
+        conn.execute(insert(boxes), [{"box_name": "Race Box", "location": "Bench"}])
+        conn.execute(insert(parcels), [
+            {"id": f"R{r:03d}-{t:03d}", "user_id": 1, "box_id": 1, "parcel_name": f"Race parcel {r}-{t}",
+             "is_delivered": False}
+            for r in range(args.rounds) for t in range(args.threads)
+        ])
+        box_state.reconcile(conn)
+
+    app = make_app(engine.url.render_as_string(hide_password=False))
+    failures = 0
+    for r in range(args.rounds):
+        outcomes = run_round(app, 1, [f"R{r:03d}-{t:03d}" for t in range(args.threads)])
+        ok = outcomes["delivered"] == 1 and outcomes["box_occupied"] == args.threads - 1
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} round {r + 1}: {dict(outcomes)}")
+
+        # Collect the delivered parcel so the next round starts with an empty box
+        with engine.begin() as conn:
+            conn.execute(update(parcels).where(parcels.c.is_delivered == True).values(collected_at=parcels.c.delivered_at))
+            box_state.reconcile(conn)
+
+    print(f"\n{args.rounds - failures}/{args.rounds} rounds had exactly one successful delivery")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
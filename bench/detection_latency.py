@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Delivery detection latency and CPU cost of the load cell pipeline, off the Pi
+Usage:
+    python3 bench/detection_latency.py
+    python3 bench/detection_latency.py --boxes 200 --seconds 10 --rate 80 --noise 5
+
+Runs --boxes virtual boxes in this process on the simulated backend of
+hardware/hal.py. Each box has a LoadCellSensor (with its background
+sampler) over a SimLoadCell whose trace steps from empty to --weight grams
+at a random time, and a monitor thread doing what monitor_deliveries()
+does. Reports the time from the step to check_delivery() firing, and the
+process CPU time spent per box.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+os.environ["HARDWARE_BACKEND"] = "sim"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hardware"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import hal  # noqa: E402
+from load_cell import LoadCellSensor  # noqa: E402
+from stats import percentile  # noqa: E402
+
+
+def run_box(args, latencies, stop):
+    # The parcel arrives some time after the first second, once the sampler has settled
+    step_at = random.uniform(1, args.seconds - 2)
+    trace = hal.Trace([(0, 0), (step_at, args.weight)])
+    sensor = LoadCellSensor(cell=hal.SimLoadCell(trace, rate=args.rate, noise=args.noise))
+    try:
+        while not stop.is_set():
+            sensor.wait_for_change(timeout=1)
+            if sensor.check_delivery():
+                latencies.append((time.monotonic() - trace.start - step_at) * 1000)
+                break
+        stop.wait()
+    finally:
+        sensor.sampler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure simulated delivery detection latency and CPU per box")
+    parser.add_argument("--boxes", type=int, default=50, help="Virtual boxes to run")
+    parser.add_argument("--seconds", type=float, default=8, help="Duration of the run")
+    parser.add_argument("--rate", type=float, default=10, help="HX711 samples per second (10 or 80)")
+    parser.add_argument("--noise", type=float, default=2, help="Reading noise (std dev, grams)")
+    parser.add_argument("--weight", type=float, default=500, help="Parcel weight in grams")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    print(f"📦 {args.boxes} simulated boxes, HX711 at {args.rate} SPS, noise {args.noise}g, {args.seconds}s\n")
+    latencies = []
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_box, args=(args, latencies, stop), daemon=True)
+               for _ in range(args.boxes)]
+
+    # The sensors' per-box prints would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall_start, cpu_start = time.monotonic(), time.process_time()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+        stop.set()
+        for thread in threads:
+            thread.join(5)
+
+    results = {
+        "boxes": args.boxes,
+        "detected": len(latencies),
+        "cpu_percent": round(cpu / wall * 100, 1),
+        "cpu_ms_per_box_second": round(cpu / wall / args.boxes * 1000, 2),
+    }
+    if latencies:
+        results.update({
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "max_ms": round(max(latencies), 1),
+            "mean_ms": round(statistics.mean(latencies), 1),
+        })
+
+    for key, value in results.items():
+        print(f"{key:<22}{value:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Fleet load test: N simulated boxes and M simulated users against the backend
+Usage:
+    python3 bench/fleet_load.py                                   # In-process server, SQLite, local PubNub
+    python3 bench/fleet_load.py --boxes 200 --users 500 --duration 120 --json baseline.json
+    python3 bench/fleet_load.py --compare baseline.json           # Fail if p95 or throughput regressed
+    python3 bench/fleet_load.py --target http://10.0.0.5 --url mysql+pymysql://root@10.0.0.5/delivery_box_bench
+
+Boxes poll /api/box/<id>/expected-parcel and report deliveries the way
+load_cell.py does (HTTP post plus a PubNub copy with the same event ID);
+they also acknowledge lock/unlock commands and answer weight checks.
+Users load the dashboard, fetch active and history parcels, register
+parcels and run the unlock -> mark collected -> lock flow.
+
+By default the app runs in this process on a threaded WSGI server, with
+bench/local_pubnub.py standing in for PubNub and the consumer's delivery
+pipeline subscribed to it. Server and load generator then share one
+interpreter, so compare runs with each other rather than reading the
+numbers as the capacity of a deployment. With --target the load goes to a
+running deployment instead (e.g. nginx + gunicorn); --url must then be
+the database that deployment uses, JWT_SECRET must match its secret, and
+without PubNub round trips collections are forced and only HTTP delivery
+reports are sent.
+
+The database at --url is dropped and re-seeded, never point it at real data.
+Results (throughput and latency percentiles per endpoint) are printed and,
+with --json, saved as a baseline for --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import jwt
+import requests
+from sqlalchemy import insert
+from common import ROOT_DIR, create_schema, make_app, make_engine, parcels, percentile, seed
+from local_pubnub import LocalPubNub
+import box_state
+
+JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")  # Same default as app.py
+
+
+class Stats:
+    """Latency samples and status codes per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, name, ms, status):
+        with self.lock:
+            self.samples[name].append(ms)
+            self.statuses[name][status] += 1
+
+    def report(self, duration):
+        endpoints = {}
+        for name in sorted(self.samples):
+            samples = self.samples[name]
+            statuses = self.statuses[name]
+            errors = sum(count for status, count in statuses.items() if status == "error" or status >= 500)
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": errors,
+                "rps": round(len(samples) / duration, 2),
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "max_ms": round(max(samples), 2),
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            }
+        return endpoints
+
+
+class Fleet:
+    """Shared state of one load test run"""
+
+    def __init__(self, args, base_url, stats, pubnub=None):
+        self.args = args
+        self.base_url = base_url
+        self.stats = stats
+        self.pubnub = pubnub
+        self.stop = threading.Event()
+        self.pool_lock = threading.Lock()
+        self.pool = {}  # box_id -> unregistered parcel IDs
+        self.local = threading.local()
+
+    def session(self):
+        """Keep-alive session of the calling thread"""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, name, method, path, session=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = (session or self.session()).request(method, self.base_url + path, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, "error"
+        self.stats.record(name, (time.perf_counter() - start) * 1000, status)
+        return response
+
+    def claim_parcel(self, rng):
+        """An unregistered parcel for a user to register, or None when the pool is empty"""
+        with self.pool_lock:
+            box_ids = [box_id for box_id, ids in self.pool.items() if ids]
+            if not box_ids:
+                return None
+            return self.pool[rng.choice(box_ids)].pop()
+
+
+def json_of(response):
+    if response is None or response.status_code >= 500:
+        return {}
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+def user_token(user_id):
+    now = datetime.utcnow()
+    payload = {"user_id": user_id, "email": f"user{user_id}@example.com", "name": f"User {user_id}",
+               "iat": now, "exp": now + timedelta(days=1)}
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+
+def run_user(fleet, user_id):
+    args = fleet.args
+    rng = random.Random(user_id)
+    session = requests.Session()
+    session.cookies.set("token", user_token(user_id))
+    fleet.stop.wait(rng.uniform(0, args.user_think))  # Spread the first dashboard loads
+
+    while not fleet.stop.is_set():
+        fleet.call("GET /home", "GET", "/home", session)
+        active = json_of(fleet.call("GET /api/fetch-parcels?status=active", "GET",
+                                    "/api/fetch-parcels?status=active", session)).get("parcels", [])
+        fleet.call("GET /api/fetch-parcels?status=history", "GET", "/api/fetch-parcels?status=history", session)
+
+        for parcel in active:
+            if parcel["is_delivered"] and not fleet.stop.is_set():
+                collect(fleet, session, parcel)
+
+        if not any(not parcel["is_delivered"] for parcel in active):
+            parcel_id = fleet.claim_parcel(rng)
+            if parcel_id:
+                fleet.call("POST /api/register-parcel", "POST", "/api/register-parcel", session,
+                           json={"parcel_id": parcel_id})
+
+        fleet.stop.wait(rng.expovariate(1 / args.user_think))
+
+
+def collect(fleet, session, parcel):
+    """Unlock the box, take the parcel, mark it collected and lock up, as home.js does"""
+    opened = json_of(fleet.call("POST /api/open-box", "POST", "/api/open-box", session,
+                                json={"parcel_id": parcel["id"]}))
+    if opened.get("command_id"):
+        fleet.call("GET /api/commands/<id>", "GET", f"/api/commands/{opened['command_id']}?wait=5", session)
+
+    fleet.call("POST /api/mark-collected", "POST", "/api/mark-collected", session,
+               json={"parcel_id": parcel["id"], "force": fleet.pubnub is None})
+
+    locked = json_of(fleet.call("POST /api/lock-box", "POST", "/api/lock-box", session,
+                                json={"box_id": parcel["box_id"]}))
+    if locked.get("command_id"):
+        fleet.call("GET /api/commands/<id>", "GET", f"/api/commands/{locked['command_id']}?wait=5", session)
+
+
+def run_box(fleet, box_id):
+    args = fleet.args
+    rng = random.Random(-box_id)
+    fleet.stop.wait(rng.uniform(0, args.box_interval))
+
+    while not fleet.stop.is_set():
+        expected = json_of(fleet.call("GET /api/box/<id>/expected-parcel", "GET",
+                                      f"/api/box/{box_id}/expected-parcel"))
+
+        # A courier only delivers into a box that is waiting for the parcel
+        if expected.get("parcel_id") and expected.get("state") == box_state.EXPECTING:
+            event = {
+                "event_id": uuid.uuid4().hex,
+                "trace_id": uuid.uuid4().hex,
+                "spans": {"detected": time.time(), "sent": time.time()},
+                "box_id": str(box_id),
+                "parcel_id": expected["parcel_id"],
+                "action": "delivered",
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            if rng.random() < args.batch_fraction:
+                fleet.call("POST /api/parcel-delivered/batch", "POST", "/api/parcel-delivered/batch",
+                           json={"events": [event]})
+            else:
+                fleet.call("POST /api/parcel-delivered", "POST", "/api/parcel-delivered", json=event)
+            if fleet.pubnub:
+                fleet.pubnub.publish().channel("parcel-delivery").message(dict(event, spans=dict(event["spans"]))).sync()
+
+        fleet.stop.wait(rng.expovariate(1 / args.box_interval))
+
+
+class BoxResponder:
+    """The box side of PubNub: acknowledges door commands and answers weight checks"""
+
+    def __init__(self, fleet, actuation):
+        self.fleet = fleet
+        self.actuation = actuation
+
+    def message(self, pubnub, envelope):
+        msg = envelope.message
+        if not isinstance(msg, dict):
+            return
+        if envelope.channel.startswith("box-") and msg.get("action") in ("lock", "unlock"):
+            threading.Timer(self.actuation, self.acknowledge, (pubnub, msg)).start()
+        elif envelope.channel.startswith("load-cell-control-") and msg.get("action") == "check_weight":
+            threading.Thread(target=self.answer_weight_check, args=(envelope.channel, msg), daemon=True).start()
+
+    def acknowledge(self, pubnub, msg):
+        state = "unlocked" if msg["action"] == "unlock" else "locked"
+        pubnub.publish().channel("command-ack").message({
+            "type": "command_ack",
+            "box_id": str(msg.get("box_id")),
+            "command_id": msg.get("command_id"),
+            "action": msg["action"],
+            "status": "done",
+            "state": state,
+            "actuation_ms": self.actuation * 1000,
+        }).sync()
+
+    def answer_weight_check(self, channel, msg):
+        # The user took the parcel out before marking it collected
+        self.fleet.call("POST /api/weight-response", "POST", "/api/weight-response", json={
+            "type": "weight_check_response",
+            "request_id": msg.get("request_id"),
+            "parcel_id": msg.get("parcel_id"),
+            "box_id": channel.rsplit("-", 1)[-1],
+            "has_weight": False,
+            "weight": 0.0,
+        })
+
+
+def seed_fleet(engine, args):
+    """Users, boxes and parcel history, plus a pool of unregistered parcels per box; returns the pool"""
+    seed(engine, n_users=args.users, n_boxes=args.boxes, n_parcels=args.history)
+    pool = {box_id: [f"FLT{box_id:05d}{i:03d}" for i in range(args.pool)] for box_id in range(1, args.boxes + 1)}
+    with engine.begin() as conn:
+        conn.execute(insert(parcels), [
+            {"id": parcel_id, "user_id": None, "box_id": box_id, "parcel_name": f"Fleet parcel {parcel_id}",
+             "is_delivered": False}
+            for box_id, ids in pool.items() for parcel_id in ids
+        ])
+    return pool
+
+
+def start_local_server(url, pubnub):
+    """App, consumer pipeline and command retries in this process; returns the server's base URL"""
+    from werkzeug.serving import make_server
+    from app import db
+    from consumer import CommandAckListener, ParcelDeliveryListener
+    from delivery_pipeline import DeliveryPipeline
+
+    scratch = tempfile.mkdtemp(prefix="delivery-box-fleet-")
+    app = make_app(
+        url, pubnub=pubnub,
+        TOKEN_CACHE_PATH=os.path.join(scratch, "token_cache.db"),
+        SEEN_EVENTS_PATH=os.path.join(scratch, "seen_events.db"),
+        PENDING_REQUESTS_PATH=os.path.join(scratch, "pending_requests.db"),
+        COMMANDS_PATH=os.path.join(scratch, "commands.db"),
+        DEAD_LETTER_PATH=os.path.join(scratch, "dead-letter.jsonl"),
+        METRICS_PATH=os.path.join(scratch, "metrics.db"),
+        TRACES_PATH=os.path.join(scratch, "traces.db"),
+    )
+
+    # What consumer.py runs next to the web workers
+    pipeline = DeliveryPipeline(app, db, pubnub, workers=app.config["DELIVERY_WORKERS"],
+                                seen_events=app.extensions["seen_events"],
+                                tracer=app.extensions["delivery_tracer"],
+                                dead_letter_path=app.config["DEAD_LETTER_PATH"])
+    pipeline.start()
+    tracker = app.extensions["command_tracker"]
+    pubnub.add_listener(ParcelDeliveryListener(pipeline))
+    pubnub.add_listener(CommandAckListener(tracker))
+    tracker.start_retries(pubnub)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # No access log per request
+    threading.Thread(target=server.serve_forever, name="wsgi", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Print p95 and throughput changes against a baseline; returns the regressed endpoints"""
+    regressions = []
+    for key in ("boxes", "users", "target", "database"):
+        if baseline.get("meta", {}).get(key) != results["meta"][key]:
+            print(f"⚠️ Baseline {key} was {baseline.get('meta', {}).get(key)}, now {results['meta'][key]}: "
+                  f"throughput is not comparable")
+    print(f"\n{'endpoint':<40}{'p95 before':>12}{'p95 now':>10}{'change':>9}{'rps before':>12}{'rps now':>9}")
+    for name, now in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            print(f"{name:<40}{'-':>12}{now['p95_ms']:>10}{'new':>9}{'-':>12}{now['rps']:>9}")
+            continue
+        change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        slower = change > tolerance and now["p95_ms"] - before["p95_ms"] > min_delta
+        fewer = before["rps"] and (before["rps"] - now["rps"]) / before["rps"] * 100 > tolerance
+        if slower or fewer:
+            regressions.append(name)
+        flag = " ❌" if slower or fewer else ""
+        print(f"{name:<40}{before['p95_ms']:>12}{now['p95_ms']:>10}{change:>+8.0f}%"
+              f"{before['rps']:>12}{now['rps']:>9}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of boxes and users against the backend")
+    parser.add_argument("--boxes", type=int, default=50, help="Simulated boxes")
+    parser.add_argument("--users", type=int, default=100, help="Simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--box-interval", type=float, default=1.0, help="Mean seconds between expected-parcel polls")
+    parser.add_argument("--user-think", type=float, default=3.0, help="Mean seconds between dashboard visits")
+    parser.add_argument("--batch-fraction", type=float, default=0.5,
+                        help="Share of deliveries reported to the batch endpoint (like the journal sender)")
+    parser.add_argument("--history", type=int, default=20000, help="Historical parcels to seed")
+    parser.add_argument("--pool", type=int, default=50, help="Unregistered parcels seeded per box")
+    parser.add_argument("--pubnub-delay", type=float, default=30, help="Local PubNub delivery delay (ms)")
+    parser.add_argument("--actuation", type=float, default=200, help="Simulated lock/unlock time (ms)")
+    parser.add_argument("--url", help="SQLAlchemy URL of a scratch database (default: temporary SQLite file)")
+    parser.add_argument("--target", help="Base URL of a running deployment (default: in-process server)")
+    parser.add_argument("--json", help="Save the results as a baseline to this file")
+    parser.add_argument("--compare", help="Baseline file to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=20, help="Allowed p95/throughput regression (%%)")
+    parser.add_argument("--min-delta", type=float, default=5,
+                        help="p95 increases below this many ms are noise, not regressions")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    url = engine.url.render_as_string(hide_password=False)
+    print(f"🌱 Seeding {args.users} users, {args.boxes} boxes, {args.history} historical parcels...")
+    create_schema(engine)
+    pool = seed_fleet(engine, args)
+
+    stats = Stats()
+    if args.target:
+        fleet = Fleet(args, args.target.rstrip("/"), stats)
+    else:
+        pubnub = LocalPubNub(delay=args.pubnub_delay / 1000)
+        base_url = start_local_server(url, pubnub)
+        fleet = Fleet(args, base_url, stats, pubnub)
+        pubnub.add_listener(BoxResponder(fleet, args.actuation / 1000))
+    fleet.pool = pool
+
+    print(f"🚚 {args.boxes} boxes and {args.users} users against {fleet.base_url} for {args.duration:.0f}s...")
+    threads = [threading.Thread(target=run_box, args=(fleet, box_id), daemon=True)
+               for box_id in range(1, args.boxes + 1)]
+    threads += [threading.Thread(target=run_user, args=(fleet, user_id), daemon=True)
+                for user_id in range(1, args.users + 1)]
+
+    # The app's own log lines would drown the results
+    log = open(os.devnull, "w") if not args.target else None
+    real_stdout = sys.stdout
+    if log:
+        sys.stdout = log
+    try:
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        fleet.stop.set()
+        duration = time.monotonic() - start
+        for thread in threads:
+            thread.join(10)
+    finally:
+        sys.stdout = real_stdout
+
+    endpoints = stats.report(duration)
+    total = sum(e["requests"] for e in endpoints.values())
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "target": args.target or "in-process",
+            "database": engine.dialect.name,
+            "boxes": args.boxes,
+            "users": args.users,
+            "duration_s": round(duration, 1),
+        },
+        "totals": {
+            "requests": total,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "rps": round(total / duration, 2),
+        },
+        "endpoints": endpoints,
+    }
+    if fleet.pubnub:
+        results["pubnub"] = {"published": dict(fleet.pubnub.published), "grants": fleet.pubnub.grants}
+    # Where a delivery's time goes between the box and the user's notification
+    results["delivery_latency"] = json_of(fleet.call("GET /api/delivery-latency", "GET", "/api/delivery-latency"))
+
+    print(f"\n{'endpoint':<40}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, e in endpoints.items():
+        print(f"{name:<40}{e['requests']:>9}{e['errors']:>8}{e['rps']:>8}{e['p50_ms']:>9}{e['p95_ms']:>9}{e['p99_ms']:>9}")
+    print(f"\nTotal: {total} requests, {results['totals']['rps']} req/s, {results['totals']['errors']} errors")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Baseline written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+        if regressions:
+            print(f"\n❌ Regressed beyond {args.tolerance:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\n✅ No regression beyond {args.tolerance:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+In-process stand-in for the PubNub client, for load tests
+Implements the parts of the SDK the app, consumer and box scripts use
+(publish, grant_token, set_token, add_listener, subscribe, stop). Every
+published message is delivered to every listener from a dispatcher thread
+after an optional network delay; listeners filter by channel themselves,
+as ParcelDeliveryListener and CommandAckListener already do.
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+OK = SimpleNamespace(is_error=lambda: False, error_data=None)
+
+
+class _Publish:
+    def __init__(self, pubnub):
+        self.pubnub = pubnub
+        self._channel = None
+        self._message = None
+
+    def channel(self, channel):
+        self._channel = channel
+        return self
+
+    def message(self, message):
+        self._message = message
+        return self
+
+    def sync(self):
+        timetoken = self.pubnub.deliver(self._channel, self._message)
+        return SimpleNamespace(result=SimpleNamespace(timetoken=timetoken), status=OK)
+
+    def pn_async(self, callback):
+        envelope = self.sync()
+        callback(envelope.result, envelope.status)
+
+
+class _Grant:
+    def __init__(self, pubnub):
+        self.pubnub = pubnub
+
+    def ttl(self, ttl):
+        return self
+
+    def authorized_uuid(self, uuid):
+        return self
+
+    def channels(self, channels):
+        return self
+
+    def sync(self):
+        with self.pubnub.lock:
+            self.pubnub.grants += 1
+        return SimpleNamespace(result=SimpleNamespace(token=uuid.uuid4().hex), status=OK)
+
+
+class _Subscribe:
+    def channels(self, channels):
+        return self
+
+    def execute(self):
+        pass
+
+
+class LocalPubNub:
+    """Loopback pub/sub: publish() hands messages to all listeners after delay seconds"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.listeners = []
+        self.published = Counter()  # By channel kind (box, user, load-cell-control, ...)
+        self.grants = 0
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, name="local-pubnub", daemon=True)
+        self._thread.start()
+
+    def publish(self):
+        return _Publish(self)
+
+    def grant_token(self):
+        return _Grant(self)
+
+    def set_token(self, token):
+        pass
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def subscribe(self):
+        return _Subscribe()
+
+    def stop(self):
+        self._queue.put(None)
+
+    def deliver(self, channel, message):
+        kind = channel.rsplit("-", 1)[0] if channel.rsplit("-", 1)[-1].isdigit() else channel
+        with self.lock:
+            self.published[kind] += 1
+        timetoken = int(time.time() * 1e7)
+        self._queue.put((time.monotonic() + self.delay, channel, message, timetoken))
+        return timetoken
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            due, channel, message, timetoken = item
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            envelope = SimpleNamespace(channel=channel, message=message, timetoken=timetoken)
+            for listener in list(self.listeners):
+                try:
+                    listener.message(self, envelope)
+                except Exception as e:
+                    print(f"❌ Listener failed on {channel}: {e}")
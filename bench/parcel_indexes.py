@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot parcel queries before and after migration 0004 (keyset indexes)
+Usage:
+    python3 bench/parcel_indexes.py                      # SQLite scratch database
+    python3 bench/parcel_indexes.py --parcels 500000
+    python3 bench/parcel_indexes.py --url mysql+pymysql://root@localhost/delivery_box_bench
+
+"before" is the schema up to 0003, with 0001's idx_parcels_user_state;
+"after" adds 0004. The target database is dropped and re-seeded, never point
+--url at real data.
+"""
+import argparse
+import json
+import random
+import time
+from sqlalchemy import bindparam, text
+from common import box_state, create_schema, make_engine, seed, summarize
+from migrate import migrate_up
+import queries
+
+PAGE_SIZE = 20
+DEEP_PAGE_FRACTION = 0.8  # Deep pages start this far into a user's history
+
+
+def page_statement(history, cursor=None):
+    return queries.parcel_page_statement(tuple(queries.PARCEL_FIELDS), history, cursor)
+
+
+# The statements behind /api/fetch-parcels and the device-facing box_state reads,
+# with the kind of parameters each one takes
+QUERIES = {
+    "active_first_page": (page_statement(False), "user"),
+    "history_first_page": (page_statement(True), "user"),
+    "history_deep_page": (page_statement(True, "after"), "history_cursor"),
+    "box_expected_parcel": (box_state.EXPECTED_PARCEL, "box"),
+    "box_delivery_state": (box_state.DELIVERY_STATE, "parcel"),
+}
+
+
+def history_cursors(conn, n_users):
+    """(user_id, cursor_at, cursor_id) of a deep history page for up to 50 users"""
+    cursors = []
+    for user_id in range(1, min(n_users, 50) + 1):
+        count = conn.execute(text(
+            "SELECT COUNT(*) FROM parcels WHERE user_id = :user_id AND collected_at IS NOT NULL"
+        ), {"user_id": user_id}).scalar()
+        row = conn.execute(text("""
+            SELECT collected_at, id FROM parcels
+            WHERE user_id = :user_id AND collected_at IS NOT NULL
+            ORDER BY collected_at DESC, id DESC
+            LIMIT 1 OFFSET :offset
+        """), {"user_id": user_id, "offset": int(count * DEEP_PAGE_FRACTION)}).fetchone()
+        if row:
+            cursors.append((user_id, row[0], row[1]))
+    return cursors
+
+
+def explain(conn, statement, params):
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    explained = text(prefix + statement.text).bindparams(
+        *[bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, list)]
+    )
+    return [" | ".join(str(col) for col in row) for row in conn.execute(explained, params)]
+
+
+def run_queries(engine, args):
+    rng = random.Random(7)
+    results = {}
+    with engine.connect() as conn:
+        cursors = history_cursors(conn, args.users)
+        parcel_ids = [row[0] for row in conn.execute(text("SELECT id FROM parcels LIMIT 1000"))]
+
+        def params_for(kind):
+            if kind == "user":
+                return {"user_id": rng.randint(1, args.users), "limit": PAGE_SIZE + 1}
+            if kind == "history_cursor":
+                user_id, cursor_at, cursor_id = rng.choice(cursors)
+                return {"user_id": user_id, "cursor_at": cursor_at, "cursor_id": cursor_id, "limit": PAGE_SIZE + 1}
+            if kind == "box":
+                return {"box_id": rng.randint(1, args.boxes)}
+            return {"pids": [rng.choice(parcel_ids)]}
+
+        for name, (statement, kind) in QUERIES.items():
+            plan_params = params_for(kind)
+            samples = []
+            for _ in range(args.runs):
+                params = params_for(kind)
+                start = time.perf_counter()
+                conn.execute(statement, params).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+            results[name] = {"plan": explain(conn, statement, plan_params), **summarize(samples)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a large parcel table and compare query plans and latency")
+    parser.add_argument("--url", help="SQLAlchemy URL of a scratch database (default: temporary SQLite file)")
+    parser.add_argument("--parcels", type=int, default=300000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=200, help="Executions per query and phase")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    print(f"🗄️  Seeding {args.parcels} historical parcels into {engine.url.render_as_string(hide_password=True)}...")
+    create_schema(engine)
+    total = seed(engine, args.users, args.boxes, args.parcels)
+    print(f"   {total} parcels, {args.users} users, {args.boxes} boxes\n")
+
+    migrate_up(engine, "0003")
+    before = run_queries(engine, args)
+    migrate_up(engine, "0004")
+    after = run_queries(engine, args)
+
+    print(f"\n{'query':<30}{'p50 before':>12}{'p50 after':>12}{'p95 before':>12}{'p95 after':>12}{'speedup':>10}")
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        speedup = b["p50_ms"] / a["p50_ms"] if a["p50_ms"] else float("inf")
+        print(f"{name:<30}{b['p50_ms']:>10.3f}ms{a['p50_ms']:>10.3f}ms"
+              f"{b['p95_ms']:>10.3f}ms{a['p95_ms']:>10.3f}ms{speedup:>9.1f}x")
+
+    for name in QUERIES:
+        print(f"\n📋 {name}")
+        print("   before: " + "\n           ".join(before[name]["plan"]))
+        print("   after:  " + "\n           ".join(after[name]["plan"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parcels": total, "before": before, "after": after}, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Per-call overhead of inline text() queries against the statements in app/queries.py
+Usage:
+    python3 bench/statement_overhead.py                  # SQLite scratch database
+    python3 bench/statement_overhead.py --iterations 20000 --batch 50
+    python3 bench/statement_overhead.py --url mysql+pymysql://root@localhost/delivery_box_bench
+
+"inline" builds the text() construct in the call, as the handlers used to,
+and reads the row by index; "module" binds a module-level statement and
+returns a named tuple. The bulk cases compare --batch single-row calls with
+one call for the whole batch. The target database is dropped and re-seeded,
+never point --url at real data.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+from sqlalchemy import text
+from common import create_schema, make_engine, seed
+import queries
+
+
+def inline_owned_parcel(conn, parcel_id, user_id):
+    row = conn.execute(
+        text("""
+            SELECT p.id, p.box_id, p.parcel_name, p.is_delivered, p.collected_at, b.box_name
+            FROM parcels p
+            JOIN boxes b ON p.box_id = b.id
+            WHERE p.id = :pid AND p.user_id = :uid
+        """),
+        {"pid": parcel_id, "uid": user_id}
+    ).fetchone()
+    return row[5]
+
+
+def module_owned_parcel(conn, parcel_id, user_id):
+    return queries.owned_parcel(conn, parcel_id, user_id).box_name
+
+
+def inline_parcels(conn, parcel_ids):
+    names = []
+    for parcel_id in parcel_ids:
+        row = conn.execute(
+            text("SELECT id, user_id, parcel_name, box_id FROM parcels WHERE id=:parcel_id"),
+            {"parcel_id": parcel_id}
+        ).fetchone()
+        names.append(row[2])
+    return names
+
+
+def module_parcels(conn, parcel_ids):
+    return [parcel.parcel_name for parcel in queries.parcels(conn, parcel_ids).values()]
+
+
+def inline_mark_collected(conn, parcel_ids):
+    for parcel_id in parcel_ids:
+        conn.execute(text("UPDATE parcels SET collected_at = :now WHERE id = :pid"),
+                     {"now": datetime.now(), "pid": parcel_id})
+
+
+def module_mark_collected(conn, parcel_ids):
+    queries.mark_collected(conn, parcel_ids)
+
+
+def time_calls(conn, fn, args_list, rollback=False):
+    """Microseconds per call of fn over args_list"""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(conn, *args)
+        samples.append((time.perf_counter() - start) * 1e6)
+        if rollback:
+            conn.rollback()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inline text() queries with precompiled statements")
+    parser.add_argument("--url", help="SQLAlchemy URL of a scratch database (default: SQLite temp file)")
+    parser.add_argument("--parcels", type=int, default=20000, help="Historical parcels to seed")
+    parser.add_argument("--iterations", type=int, default=5000, help="Calls per single-row case")
+    parser.add_argument("--batch", type=int, default=20, help="Parcels per bulk call")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    create_schema(engine)
+    seed(engine, n_users=500, n_boxes=100, n_parcels=args.parcels)
+    print(f"🗄️  {engine.dialect.name}, {args.parcels} parcels\n")
+
+    with engine.connect() as conn:
+        # Uncollected parcels, so both mark_collected variants update every row
+        owned = conn.execute(text(
+            "SELECT id, user_id FROM parcels WHERE collected_at IS NULL AND user_id IS NOT NULL ORDER BY id LIMIT 1000"
+        )).fetchall()
+        single = [tuple(owned[i % len(owned)]) for i in range(args.iterations)]
+        ids = [row[0] for row in owned]
+        starts = range(0, len(ids) - args.batch + 1, args.batch)
+        batches = [(ids[starts[i % len(starts)]:][:args.batch],) for i in range(max(1, args.iterations // args.batch))]
+
+        cases = {
+            "owned_parcel": [("inline", inline_owned_parcel, single, False),
+                             ("module", module_owned_parcel, single, False)],
+            f"parcels x{args.batch}": [("inline", inline_parcels, batches, False),
+                                       ("module", module_parcels, batches, False)],
+            f"mark_collected x{args.batch}": [("inline", inline_mark_collected, batches, True),
+                                              ("module", module_mark_collected, batches, True)],
+        }
+
+        results = {}
+        print(f"{'case':<24}{'variant':<10}{'calls':>8}{'p50 us':>10}{'mean us':>10}")
+        for case, variants in cases.items():
+            for variant, fn, args_list, rollback in variants:
+                time_calls(conn, fn, args_list[:200], rollback)  # Warm the compiled cache and the page cache
+                samples = time_calls(conn, fn, args_list, rollback)
+                results.setdefault(case, {})[variant] = {
+                    "calls": len(samples),
+                    "p50_us": round(statistics.median(samples), 1),
+                    "mean_us": round(statistics.mean(samples), 1),
+                }
+                r = results[case][variant]
+                print(f"{case:<24}{variant:<10}{r['calls']:>8}{r['p50_us']:>10}{r['mean_us']:>10}")
+            inline, module = results[case]["inline"]["p50_us"], results[case]["module"]["p50_us"]
+            results[case]["speedup"] = round(inline / module, 2) if module else None
+            print(f"{'':<24}{'speedup':<10}{'':>8}{results[case]['speedup']:>10}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
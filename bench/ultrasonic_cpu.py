@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+CPU cost of busy-wait vs edge-triggered echo timing in hardware/ultrasonic_led.py
+Usage:
+    python3 bench/ultrasonic_cpu.py
+    python3 bench/ultrasonic_cpu.py --seconds 20 --rate 10 --distance 150
+
+Runs without a Pi: a simulated HC-SR04 raises its echo pin for as long as a
+real echo from --distance would last. The polling loop is the previous
+get_distance() reading that pin; the edge-triggered version gets the edges
+as callbacks (as RPi.GPIO delivers them) and sleeps on an Event. Reports
+process CPU time per reading and CPU utilisation at the sampling rate.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+HIGH, LOW = 1, 0
+SENSOR_LATENCY = 0.0005  # HC-SR04 starts its echo ~0.5 ms after the trigger
+
+
+class SimulatedSensor:
+    """Echo pin that goes high SENSOR_LATENCY after a trigger, for the echo's round trip"""
+
+    def __init__(self, distance_cm, on_edge=None):
+        self.echo_seconds = distance_cm / 17150
+        self.on_edge = on_edge
+        self._rise = self._fall = 0
+
+    def trigger(self):
+        now = time.monotonic()
+        self._rise = now + SENSOR_LATENCY
+        self._fall = self._rise + self.echo_seconds
+        if self.on_edge:
+            threading.Timer(SENSOR_LATENCY, self.on_edge, (HIGH,)).start()
+            threading.Timer(SENSOR_LATENCY + self.echo_seconds, self.on_edge, (LOW,)).start()
+
+    def input(self):
+        return HIGH if self._rise <= time.monotonic() < self._fall else LOW
+
+
+def polling_distance(sensor):
+    """The previous get_distance(): spin on the echo pin"""
+    sensor.trigger()
+    timeout = time.time() + 1
+    while sensor.input() == LOW:
+        pulse_start = time.time()
+        if pulse_start > timeout:
+            return -1
+    timeout = time.time() + 1
+    while sensor.input() == HIGH:
+        pulse_end = time.time()
+        if pulse_end > timeout:
+            return -1
+    return round((pulse_end - pulse_start) * 17150, 2)
+
+
+class EdgeTimer:
+    """Same approach as EchoTimer in hardware/hal.py"""
+
+    def __init__(self, distance_cm):
+        self.sensor = SimulatedSensor(distance_cm, on_edge=self._on_edge)
+        self._rise = self._fall = None
+        self._done = threading.Event()
+
+    def _on_edge(self, level):
+        now = time.monotonic()
+        if level == HIGH:
+            self._rise = now
+        elif self._rise is not None:
+            self._fall = now
+            self._done.set()
+
+    def measure(self):
+        self._rise = self._fall = None
+        self._done.clear()
+        self.sensor.trigger()
+        if not self._done.wait(0.04):
+            return -1
+        return round((self._fall - self._rise) * 17150, 2)
+
+
+def run(measure, seconds, rate):
+    """Take readings at `rate` per second for `seconds`, return CPU and accuracy figures"""
+    readings = []
+    cpu_per_reading = []
+    wall_start, cpu_start = time.monotonic(), time.process_time()
+    while time.monotonic() - wall_start < seconds:
+        cpu = time.process_time()
+        readings.append(measure())
+        cpu_per_reading.append((time.process_time() - cpu) * 1000)
+        time.sleep(1 / rate)
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    valid = [r for r in readings if r > 0]
+    return {
+        "readings": len(readings),
+        "cpu_percent": round(cpu / wall * 100, 2),
+        "cpu_ms_per_reading": round(statistics.mean(cpu_per_reading), 3),
+        "median_cm": round(statistics.median(valid), 2) if valid else None,
+        "stdev_cm": round(statistics.pstdev(valid), 2) if valid else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU use of polled and edge-triggered echo timing")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each run")
+    parser.add_argument("--rate", type=float, default=10, help="Readings per second")
+    parser.add_argument("--distance", type=float, default=100, help="Simulated distance in cm")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    print(f"📏 {args.rate} readings/s at {args.distance} cm for {args.seconds}s per method\n")
+    sensor = SimulatedSensor(args.distance)
+    results = {
+        "polling": run(lambda: polling_distance(sensor), args.seconds, args.rate),
+        "edge_triggered": run(EdgeTimer(args.distance).measure, args.seconds, args.rate),
+    }
+
+    print(f"{'method':<16}{'readings':>10}{'CPU %':>10}{'CPU ms/reading':>16}{'median cm':>12}{'stdev cm':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['readings']:>10}{r['cpu_percent']:>10}{r['cpu_ms_per_reading']:>16}"
+              f"{r['median_cm']:>12}{r['stdev_cm']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the delivery_box database
+Usage:
+    python3 db/migrate.py status
+    python3 db/migrate.py up [target_version]
+    python3 db/migrate.py down [target_version]   (default: undo the latest migration)
+    python3 db/migrate.py init                     (new SQLite database, from schema_sqlite.sql)
+
+Migrations live in db/migrations as NNNN_name.py modules with up(conn) and
+down(conn) functions. Applied versions are recorded in schema_migrations.
+The database URL comes from app/config.py unless --url is given.
+"""
+import argparse
+import importlib
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+SQLITE_SCHEMA = os.path.join(os.path.dirname(MIGRATIONS_DIR), "schema_sqlite.sql")
+
+sys.path.insert(0, os.path.dirname(MIGRATIONS_DIR))
+
+
+def discover_migrations():
+    """Return [(version, name, module)] sorted by version"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename[:4].isdigit() or not filename.endswith(".py"):
+            continue
+        module_name = filename[:-3]
+        version, _, name = module_name.partition("_")
+        module = importlib.import_module(f"migrations.{module_name}")
+        migrations.append((version, name, module))
+    return migrations
+
+
+def ensure_migrations_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(16) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    """))
+
+
+def applied_versions(conn):
+    ensure_migrations_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate_up(engine, target=None):
+    """Apply every pending migration up to and including target"""
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+
+    for version, name, module in discover_migrations():
+        if target and version > target:
+            break
+        if version in applied:
+            continue
+        print(f"⬆️  Applying {version}_{name}")
+        # MySQL commits DDL implicitly, so each migration runs in its own transaction
+        with engine.begin() as conn:
+            module.up(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.now()}
+            )
+
+
+def migrate_down(engine, target=None):
+    """Revert applied migrations newer than target (default: only the latest one)"""
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+
+    to_revert = [m for m in reversed(discover_migrations()) if m[0] in applied]
+    if target is None:
+        to_revert = to_revert[:1]
+    else:
+        to_revert = [m for m in to_revert if m[0] > target]
+
+    for version, name, module in to_revert:
+        print(f"⬇️  Reverting {version}_{name}")
+        with engine.begin() as conn:
+            module.down(conn)
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = :v"), {"v": version})
+
+
+def init_sqlite(engine):
+    """Create the full schema in a SQLite database (MySQL databases are created from schema.sql)"""
+    if engine.dialect.name != "sqlite":
+        raise SystemExit("❌ init only creates SQLite databases, load db/schema.sql into MySQL instead")
+    with open(SQLITE_SCHEMA) as f:
+        statements = [statement.strip() for statement in f.read().split(";") if statement.strip()]
+    print(f"🗄️  Creating tables from {os.path.basename(SQLITE_SCHEMA)}")
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+
+def print_status(engine):
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+    for version, name, _ in discover_migrations():
+        mark = "✅" if version in applied else "⏳"
+        print(f"{mark} {version}_{name}")
+
+
+def default_url():
+    sys.path.insert(0, os.path.join(os.path.dirname(MIGRATIONS_DIR), "..", "app"))
+    from config import get_config
+    return get_config().SQLALCHEMY_DATABASE_URI
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or revert schema migrations")
+    parser.add_argument("command", choices=["up", "down", "status", "init"])
+    parser.add_argument("target", nargs="?", help="Target version, e.g. 0001")
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: app config)")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url or default_url())
+    if args.command == "up":
+        migrate_up(engine, args.target)
+    elif args.command == "down":
+        migrate_down(engine, args.target)
+    elif args.command == "init":
+        init_sqlite(engine)
+    print_status(engine)
+
+
+if __name__ == "__main__":
+    main()
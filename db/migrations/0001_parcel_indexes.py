@@ -0,0 +1,24 @@
+"""
+Composite indexes for the hot parcel queries.
+
+idx_parcels_user_state covers fetch_parcels: both the active list
+(user_id, collected_at IS NULL, ORDER BY delivered_at) and the history list
+(user_id, collected_at IS NOT NULL, ORDER BY collected_at) are answered from
+the index without touching the table rows.
+
+idx_parcels_box_state covers the per-box lookups in get_expected_parcel and
+parcel_delivered (box_id, is_delivered, collected_at, user_id).
+"""
+from migrations import create_index, drop_index
+
+
+def up(conn):
+    create_index(conn, "parcels", "idx_parcels_user_state",
+                 ["user_id", "collected_at", "delivered_at", "box_id", "is_delivered", "parcel_name"])
+    create_index(conn, "parcels", "idx_parcels_box_state",
+                 ["box_id", "is_delivered", "collected_at", "user_id"])
+
+
+def down(conn):
+    drop_index(conn, "parcels", "idx_parcels_user_state")
+    drop_index(conn, "parcels", "idx_parcels_box_state")
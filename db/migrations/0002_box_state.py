@@ -0,0 +1,45 @@
+"""
+Materialized occupancy state on boxes.
+
+boxes.state is one of empty / expecting / occupied / unlocked.
+occupant_parcel_id is the delivered, uncollected parcel in the box and
+expected_parcel_id the next registered parcel still in transit to it.
+The app keeps these columns current in the same transaction as
+register / deliver / collect (see app/box_state.py); the backfill below uses
+the same rules as `flask reconcile-boxes`.
+"""
+from sqlalchemy import text
+from migrations import add_column, drop_column
+
+
+def up(conn):
+    add_column(conn, "boxes", "state", "VARCHAR(16) NOT NULL DEFAULT 'empty'")
+    add_column(conn, "boxes", "occupant_parcel_id", "VARCHAR(100) NULL")
+    add_column(conn, "boxes", "expected_parcel_id", "VARCHAR(100) NULL")
+    add_column(conn, "boxes", "state_updated_at", "TIMESTAMP NULL")
+
+    conn.execute(text("""
+        UPDATE boxes SET
+            occupant_parcel_id = (
+                SELECT MIN(p.id) FROM parcels p
+                WHERE p.box_id = boxes.id AND p.is_delivered = 1 AND p.collected_at IS NULL
+            ),
+            expected_parcel_id = (
+                SELECT MIN(p.id) FROM parcels p
+                WHERE p.box_id = boxes.id AND p.is_delivered = 0 AND p.user_id IS NOT NULL
+            )
+    """))
+    conn.execute(text("""
+        UPDATE boxes SET state = CASE
+            WHEN occupant_parcel_id IS NOT NULL THEN 'occupied'
+            WHEN expected_parcel_id IS NOT NULL THEN 'expecting'
+            ELSE 'empty'
+        END
+    """))
+
+
+def down(conn):
+    drop_column(conn, "boxes", "state_updated_at")
+    drop_column(conn, "boxes", "expected_parcel_id")
+    drop_column(conn, "boxes", "occupant_parcel_id")
+    drop_column(conn, "boxes", "state")
@@ -0,0 +1,16 @@
+"""
+Per-user data version.
+
+users.data_version is bumped in the same transaction as every registration,
+delivery and collection of the user's parcels (see app/queries.py), so
+/api/fetch-parcels can answer If-None-Match from this one column.
+"""
+from migrations import add_column, drop_column
+
+
+def up(conn):
+    add_column(conn, "users", "data_version", "INT NOT NULL DEFAULT 0")
+
+
+def down(conn):
+    drop_column(conn, "users", "data_version")
@@ -0,0 +1,29 @@
+"""
+Parcel list indexes that end in the keyset order.
+
+fetch_parcels pages with ORDER BY <sort> DESC, id DESC and a
+(<sort>, id) cursor (see parcel_page_statement in app/queries.py).
+idx_parcels_user_state from 0001 put box_id, is_delivered and parcel_name
+after delivered_at, so the history list could not be read in
+(collected_at, id) order from it and every page sorted the user's whole
+history.
+
+idx_parcels_user_active serves the active list (user_id, collected_at IS NULL,
+ORDER BY delivered_at, id) and idx_parcels_user_history the history list
+(user_id, collected_at IS NOT NULL, ORDER BY collected_at, id); both let a
+cursor seek straight to its position.
+"""
+from migrations import create_index, drop_index
+
+
+def up(conn):
+    create_index(conn, "parcels", "idx_parcels_user_active", ["user_id", "collected_at", "delivered_at", "id"])
+    create_index(conn, "parcels", "idx_parcels_user_history", ["user_id", "collected_at", "id"])
+    drop_index(conn, "parcels", "idx_parcels_user_state")
+
+
+def down(conn):
+    create_index(conn, "parcels", "idx_parcels_user_state",
+                 ["user_id", "collected_at", "delivered_at", "box_id", "is_delivered", "parcel_name"])
+    drop_index(conn, "parcels", "idx_parcels_user_active")
+    drop_index(conn, "parcels", "idx_parcels_user_history")
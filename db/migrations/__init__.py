@@ -0,0 +1,48 @@
+"""
+Helpers shared by the versioned migrations in this package.
+Every helper checks the live schema first, so re-running a migration is a no-op.
+"""
+from sqlalchemy import inspect, text
+
+
+def index_exists(conn, table, name):
+    return any(index["name"] == name for index in inspect(conn).get_indexes(table))
+
+
+def create_index(conn, table, name, columns):
+    if index_exists(conn, table, name):
+        print(f"  = index {name} already exists")
+        return
+    conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+    print(f"  + index {name} on {table}({', '.join(columns)})")
+
+
+def drop_index(conn, table, name):
+    if not index_exists(conn, table, name):
+        print(f"  = index {name} already dropped")
+        return
+    if conn.dialect.name == "mysql":
+        conn.execute(text(f"DROP INDEX {name} ON {table}"))
+    else:
+        conn.execute(text(f"DROP INDEX {name}"))
+    print(f"  - index {name}")
+
+
+def column_exists(conn, table, name):
+    return any(column["name"] == name for column in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table, name, definition):
+    if column_exists(conn, table, name):
+        print(f"  = column {table}.{name} already exists")
+        return
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+    print(f"  + column {table}.{name}")
+
+
+def drop_column(conn, table, name):
+    if not column_exists(conn, table, name):
+        print(f"  = column {table}.{name} already dropped")
+        return
+    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+    print(f"  - column {table}.{name}")
@@ -4,6 +4,7 @@ CREATE DATABASE delivery_box;
 USE delivery_box;
 
 -- Drop tables if they exist 
+DROP TABLE IF EXISTS schema_migrations;
 DROP TABLE IF EXISTS parcels;
 DROP TABLE IF EXISTS boxes;
 DROP TABLE IF EXISTS users;
@@ -13,14 +14,21 @@ CREATE TABLE users (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     email VARCHAR(100) UNIQUE NOT NULL,
-    password_hash VARCHAR(255) NOT NULL
+    password_hash VARCHAR(255) NOT NULL,
+    -- Bumped whenever the user's parcels change (migration 0003, ETags of /api/fetch-parcels)
+    data_version INT NOT NULL DEFAULT 0
 );
 
 -- Table for delivery boxes
 CREATE TABLE boxes (
     id INT AUTO_INCREMENT PRIMARY KEY,
     box_name VARCHAR(100) NOT NULL, 
-    location VARCHAR(255) NULL      
+    location VARCHAR(255) NULL,
+    -- Materialized occupancy state (migration 0002, maintained by app/box_state.py)
+    state VARCHAR(16) NOT NULL DEFAULT 'empty',  -- empty / expecting / occupied / unlocked
+    occupant_parcel_id VARCHAR(100) NULL,        -- delivered, uncollected parcel in the box
+    expected_parcel_id VARCHAR(100) NULL,        -- next registered parcel in transit to the box
+    state_updated_at TIMESTAMP NULL
 );
 
 -- Table for parcels
@@ -35,3 +43,21 @@ CREATE TABLE parcels (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (box_id) REFERENCES boxes(id) ON DELETE CASCADE
 );
+
+-- Indexes from migrations 0001 and 0004 (created after the table so the foreign keys keep their own indexes)
+CREATE INDEX idx_parcels_box_state ON parcels (box_id, is_delivered, collected_at, user_id);
+CREATE INDEX idx_parcels_user_active ON parcels (user_id, collected_at, delivered_at, id);
+CREATE INDEX idx_parcels_user_history ON parcels (user_id, collected_at, id);
+
+-- Migrations already contained in this schema (see db/migrate.py)
+CREATE TABLE schema_migrations (
+    version VARCHAR(16) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+
+INSERT INTO schema_migrations (version, name, applied_at) VALUES
+    ('0001', 'parcel_indexes', NOW()),
+    ('0002', 'box_state', NOW()),
+    ('0003', 'user_data_version', NOW()),
+    ('0004', 'parcel_keyset_indexes', NOW());
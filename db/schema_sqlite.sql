@@ -0,0 +1,49 @@
+-- SQLite copy of db/schema.sql for the test profile and local runs without MySQL.
+-- Created by `python3 db/migrate.py init`, keep it in step with schema.sql and the migrations.
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    data_version INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    box_name VARCHAR(100) NOT NULL,
+    location VARCHAR(255) NULL,
+    state VARCHAR(16) NOT NULL DEFAULT 'empty',
+    occupant_parcel_id VARCHAR(100) NULL,
+    expected_parcel_id VARCHAR(100) NULL,
+    state_updated_at TIMESTAMP NULL
+);
+
+-- NOCASE matches parcel IDs the way MySQL's default collation does
+CREATE TABLE IF NOT EXISTS parcels (
+    id VARCHAR(100) PRIMARY KEY COLLATE NOCASE,
+    user_id INT NULL,
+    box_id INT NOT NULL,
+    parcel_name VARCHAR(255) NOT NULL,
+    is_delivered BOOLEAN DEFAULT FALSE,
+    delivered_at TIMESTAMP NULL,
+    collected_at TIMESTAMP NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (box_id) REFERENCES boxes(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_parcels_box_state ON parcels (box_id, is_delivered, collected_at, user_id);
+CREATE INDEX IF NOT EXISTS idx_parcels_user_active ON parcels (user_id, collected_at, delivered_at, id);
+CREATE INDEX IF NOT EXISTS idx_parcels_user_history ON parcels (user_id, collected_at, id);
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(16) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+
+INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES
+    ('0001', 'parcel_indexes', CURRENT_TIMESTAMP),
+    ('0002', 'box_state', CURRENT_TIMESTAMP),
+    ('0003', 'user_data_version', CURRENT_TIMESTAMP),
+    ('0004', 'parcel_keyset_indexes', CURRENT_TIMESTAMP);
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Device daemon: all of a box's hardware in one process
+Usage:
+    python3 device_daemon.py
+
+Runs the load cell, door servo/buzzer and auto-light drivers of
+load_cell.py, servo_and_buzzer.py and ultrasonic_led.py as asyncio tasks
+over one PubNub connection. The drivers share what they observe on an
+in-process event bus, so the light comes on for a delivery or an unlocked
+door, and door acknowledgements say whether the box holds a parcel.
+"""
+import asyncio
+import signal
+import time
+from pubnub.callbacks import SubscribeCallback
+from pubnub.enums import PNStatusCategory
+from pubnub.pubnub_asyncio import PubNubAsyncio
+import hal
+import load_cell
+import servo_and_buzzer
+import ultrasonic_led
+from device_pubnub import BOX_ID, create_pubnub
+from event_journal import EventJournal, JournalSender
+
+LED_ON_DURATION = 10  # Seconds the light stays on after motion, a delivery or an unlock
+RESTART_DELAY = 5  # Seconds before a failed driver is restarted
+
+# PubNub channel -> bus topic
+CHANNEL_TOPICS = {
+    servo_and_buzzer.CHANNEL: "door_command",
+    load_cell.CONTROL_CHANNEL: "control",
+}
+
+
+class EventBus:
+    """In-process publish/subscribe between the drivers
+
+    Each subscriber gets its own queue of (topic, data) tuples for the
+    topics it asked for. publish() must run on the event loop; threads
+    (PubNub callbacks, the actuator worker) use publish_threadsafe().
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._subscribers = []
+
+    def subscribe(self, *topics):
+        queue = asyncio.Queue()
+        self._subscribers.append((set(topics), queue))
+        return queue
+
+    def publish(self, topic, data=None):
+        for topics, queue in self._subscribers:
+            if topic in topics:
+                queue.put_nowait((topic, data))
+
+    def publish_threadsafe(self, topic, data=None):
+        self.loop.call_soon_threadsafe(self.publish, topic, data)
+
+
+class PubNubBridge(SubscribeCallback):
+    """Puts messages from the box's channels on the bus as (message, timetoken)"""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def message(self, pubnub, message):
+        topic = CHANNEL_TOPICS.get(message.channel)
+        if topic:
+            self.bus.publish_threadsafe(topic, (message.message, message.timetoken))
+
+    def status(self, pubnub, status):
+        print(f"Status: {status.category.name}")
+        if status.category in (PNStatusCategory.PNConnectedCategory, PNStatusCategory.PNReconnectedCategory):
+            self.bus.publish_threadsafe("connected")
+
+
+class DeviceDaemon:
+    """Owns the box's PubNub connection, GPIO and drivers"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.bus = EventBus(self.loop)
+        self.pubnub = create_pubnub(PubNubAsyncio)
+        self.occupied = False  # Set by the load cell driver, read by door acks
+
+    async def publish(self, channel, message):
+        result = await self.pubnub.publish().channel(channel).message(message).future()
+        if result.is_error():
+            print(f"⚠️ Failed to publish to {channel}")
+            return False
+        return True
+
+    def publish_ack(self, ack):
+        """Called on the actuator thread for every door command"""
+        ack["occupied"] = self.occupied
+        self.bus.publish_threadsafe("door", ack)
+        asyncio.run_coroutine_threadsafe(self.publish(servo_and_buzzer.ACK_CHANNEL, ack), self.loop)
+
+    async def supervise(self, name, driver, *args):
+        """Run a driver, restarting it if it fails"""
+        while True:
+            try:
+                await driver(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ {name} driver failed: {e}, restarting in {RESTART_DELAY}s")
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def run_load_cell(self, sensor, expected_cache, journal, sender):
+        """Report deliveries and notice collections"""
+        print(f"📦 Monitoring Box {BOX_ID} for parcel deliveries...")
+        while True:
+            # Re-check as soon as the weight steps, at least every second
+            await asyncio.to_thread(sensor.wait_for_change, 1)
+
+            if self.occupied:
+                if sensor.is_empty():
+                    self.occupied = False
+                    sensor.delivery_detected = False
+                    print("Box is empty again. Ready for next delivery.\n")
+                    self.bus.publish("collected")
+            elif sensor.check_delivery():
+                self.occupied = True
+                await self.report_delivery(expected_cache, journal, sender, sensor.detected_at)
+                print("\nWaiting for parcel to be collected...")
+
+    async def report_delivery(self, expected_cache, journal, sender, detected_at=None):
+        print(f"📬 Delivery detected in Box {BOX_ID}")
+        hit, parcel_id = expected_cache.get()
+        if not hit:
+            print("Checking which parcel is expected in this box...")
+            parcel_id = await asyncio.to_thread(load_cell.get_expected_parcel, BOX_ID)
+        self.bus.publish("delivery", parcel_id)
+
+        if not parcel_id:
+            print("⚠️ No parcel expected in this box. Delivery not recorded.")
+            return
+
+        print(f"Found expected parcel: {parcel_id}")
+        # Journaled first, as in load_cell.py; the PubNub copy carries the same event ID
+        event = load_cell.delivery_event(parcel_id, detected_at)
+        await asyncio.to_thread(journal.append, event)
+        sender.wake()
+        expected_cache.invalidate()
+        if await self.publish(load_cell.DELIVERY_CHANNEL, load_cell.sent_copy(event)):
+            print(f"📡 Real-time notification sent via PubNub")
+        print("📝 Delivery journaled")
+
+    async def run_control(self, events, sensor, expected_cache):
+        """Backend messages on load-cell-control-{BOX_ID}"""
+        while True:
+            topic, data = await events.get()
+            try:
+                if topic == "connected":
+                    # Pushes may have been missed while disconnected: refresh from the backend
+                    await asyncio.to_thread(load_cell.refresh_expected_parcel, expected_cache)
+                    continue
+
+                msg, _ = data
+                action = msg.get('action')
+
+                if action == 'expected_parcel':
+                    expected_cache.set(msg.get('parcel_id'))
+                    print(f"📥 Expected parcel for Box {BOX_ID}: {msg.get('parcel_id') or 'none'}")
+
+                elif action == 'check_weight':
+                    response = load_cell.weight_check_response(sensor, msg)
+                    print(f"⚖️ Weight check for {response['parcel_id']}: {response['weight']}g")
+                    replies = [asyncio.to_thread(load_cell.post_weight_response, response)]
+                    if msg.get('user_id'):
+                        replies.append(self.publish(f"user-{msg['user_id']}", response))
+                    await asyncio.gather(*replies)
+
+                elif action == 'reset':
+                    await asyncio.to_thread(sensor.tare)
+            except Exception as e:
+                print(f"❌ Error processing control message: {e}")
+
+    async def run_door(self, commands, actuator):
+        """Lock/unlock messages on box-{BOX_ID}, actuated on the ActuatorWorker thread"""
+        while True:
+            _, (msg, timetoken) = await commands.get()
+            box_id = str(msg.get('box_id'))
+            action = msg.get('action', '').lower()
+
+            if box_id != BOX_ID:
+                print(f"ℹ️ Message for different box: {box_id} (expecting {BOX_ID})")
+            elif action in servo_and_buzzer.ACTIONS:
+                actuator.submit(servo_and_buzzer.door_command(msg, timetoken))
+            else:
+                print(f"⚠️ Unknown action: {action}")
+
+    async def run_light(self, events, distance_sensor):
+        """Motion-activated light that also comes on for deliveries and unlocked doors"""
+        previous_distance = await asyncio.to_thread(ultrasonic_led.get_distance, distance_sensor)
+        last_movement = time.monotonic()
+        lit_until = None
+
+        while True:
+            # Sleep until the next reading (or the light's off time), waking early for bus events
+            if lit_until:
+                timeout = max(0, lit_until - time.monotonic())
+            else:
+                idle = time.monotonic() - last_movement > ultrasonic_led.IDLE_AFTER
+                timeout = 1 / (ultrasonic_led.IDLE_SAMPLE_RATE if idle else ultrasonic_led.SAMPLE_RATE)
+            try:
+                topic, data = await asyncio.wait_for(events.get(), timeout)
+            except asyncio.TimeoutError:
+                topic, data = None, None
+
+            if topic == "delivery" or (topic == "door" and data["status"] == "done" and data["state"] == "unlocked"):
+                if not lit_until:
+                    ultrasonic_led.led_on("Delivery detected!" if topic == "delivery" else "Door unlocked!")
+                lit_until = time.monotonic() + LED_ON_DURATION
+                continue
+            if topic:
+                continue
+
+            if lit_until:
+                if time.monotonic() < lit_until:
+                    continue
+                ultrasonic_led.led_off()
+                lit_until = None
+                previous_distance = await asyncio.to_thread(ultrasonic_led.get_distance, distance_sensor)  # Reset baseline
+                last_movement = time.monotonic()
+                continue
+
+            current_distance = await asyncio.to_thread(ultrasonic_led.get_distance, distance_sensor)
+            if current_distance <= 0:
+                continue
+
+            distance_change = abs(current_distance - previous_distance)
+            if distance_change > 1:  # More than sensor noise: stay at the active rate
+                last_movement = time.monotonic()
+
+            if (distance_change > ultrasonic_led.MOTION_SENSITIVITY
+                    or current_distance < ultrasonic_led.DISTANCE_THRESHOLD):
+                ultrasonic_led.led_on()
+                lit_until = time.monotonic() + LED_ON_DURATION
+            else:
+                previous_distance = current_distance
+
+    async def run(self):
+        print(f"🚀 Starting device daemon for Box {BOX_ID}")
+        hal.cleanup()
+        servo_and_buzzer.setup_gpio()
+        distance_sensor = ultrasonic_led.setup_gpio()
+        sensor = load_cell.LoadCellSensor()
+
+        actuator = servo_and_buzzer.ActuatorWorker(self.publish_ack)
+        actuator.start()
+        expected_cache = load_cell.ExpectedParcelCache()
+
+        # Report journaled deliveries, including any left over from an outage
+        journal = EventJournal(load_cell.JOURNAL_PATH)
+        sender = JournalSender(journal, load_cell.BACKEND_URL)
+        sender.start()
+
+        # Subscribe before connecting so no message or "connected" event is missed
+        control_events = self.bus.subscribe("control", "connected")
+        door_commands = self.bus.subscribe("door_command")
+        light_events = self.bus.subscribe("delivery", "door")
+
+        self.pubnub.add_listener(PubNubBridge(self.bus))
+        self.pubnub.subscribe().channels(list(CHANNEL_TOPICS)).execute()
+        print(f"📡 Subscribed to {', '.join(CHANNEL_TOPICS)}")
+
+        tasks = [
+            asyncio.create_task(self.supervise("load cell", self.run_load_cell, sensor, expected_cache, journal, sender)),
+            asyncio.create_task(self.supervise("control", self.run_control, control_events, sensor, expected_cache)),
+            asyncio.create_task(self.supervise("door", self.run_door, door_commands, actuator)),
+            asyncio.create_task(self.supervise("light", self.run_light, light_events, distance_sensor)),
+        ]
+        print("Press Ctrl+C to exit\n")
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.pubnub.stop()
+            sender.stop()
+            distance_sensor.close()
+            ultrasonic_led.led_off()
+            servo_and_buzzer.cleanup()
+            sensor.sampler.stop()
+            hal.cleanup()
+            print("🔒 Door locked and system cleaned up")
+
+
+async def main():
+    # systemd stops the daemon with SIGTERM: clean up as for Ctrl+C
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await DeviceDaemon().run()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\n⚠️ Exiting...")
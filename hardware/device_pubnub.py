@@ -0,0 +1,34 @@
+"""
+PubNub connection shared by the box scripts
+"""
+import os
+from pubnub.pnconfiguration import PNConfiguration
+from pubnub.pubnub import PubNub
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BOX_ID = os.getenv('BOX_ID', '1')
+
+
+def create_pubnub(pubnub_class=PubNub):
+    """Create the box's PubNub client (pass PubNubAsyncio for asyncio code)"""
+    token = os.getenv('PUBNUB_TOKEN')  # PAM token
+    
+    pnconfig = PNConfiguration()
+    pnconfig.subscribe_key = os.getenv('PUBNUB_SUBSCRIBE_KEY')
+    pnconfig.publish_key = os.getenv('PUBNUB_PUBLISH_KEY')
+    pnconfig.user_id = f"box-{BOX_ID}-device"  # Must match token's authorized_uuid
+    pnconfig.ssl = True
+    
+    pubnub = pubnub_class(pnconfig)
+    
+    # Set PAM token if available
+    if token:
+        pubnub.set_token(token)
+        print(f"🔐 PAM token enabled for box-{BOX_ID}-device")
+    else:
+        print("⚠️ No PAM token - connection may fail if Access Manager is enabled")
+    
+    return pubnub
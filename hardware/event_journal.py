@@ -0,0 +1,177 @@
+"""
+Durable delivery event journal for the box
+Every delivery is written to a local SQLite file before it is reported, and
+a sender thread drains the journal to the backend's batch ingest endpoint.
+Events recorded while the backend or network is down are replayed in
+batches once it is reachable again.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+# Backend outcomes that will not change on retry; "processing" means another
+# copy of the event is still in flight, so it is asked about again later
+FINAL_OUTCOMES = {"delivered", "already_delivered", "box_occupied", "not_found", "invalid"}
+
+
+class EventJournal:
+    """Append-first store of delivery events, kept until the backend has accepted them"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    event_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    sent_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_pending ON events (sent_at, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            conn.execute("PRAGMA synchronous=FULL")  # An appended event must survive a power cut
+            yield conn
+        finally:
+            conn.close()
+
+    def append(self, event):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO events (event_id, payload, created_at) VALUES (?, ?, ?)",
+                (event["event_id"], json.dumps(event), time.time())
+            )
+
+    def pending(self, limit=50):
+        """Oldest unsent events"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT payload FROM events WHERE sent_at IS NULL ORDER BY created_at LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pending_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM events WHERE sent_at IS NULL").fetchone()[0]
+
+    def mark_sent(self, event_ids):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE events SET sent_at = ? WHERE event_id = ?",
+                [(time.time(), event_id) for event_id in event_ids]
+            )
+
+    def record_attempt(self, event_ids):
+        with self._connect() as conn:
+            conn.executemany("UPDATE events SET attempts = attempts + 1 WHERE event_id = ?",
+                             [(event_id,) for event_id in event_ids])
+
+    def prune(self, max_age=7 * 86400):
+        """Drop sent events older than max_age seconds"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM events WHERE sent_at IS NOT NULL AND sent_at < ?", (time.time() - max_age,))
+
+
+class JournalSender:
+    """Drains an EventJournal to POST {backend_url}/api/parcel-delivered/batch
+
+    Uses one keep-alive HTTP session. After a failed attempt it backs off
+    exponentially (with jitter) up to max_delay seconds; the whole backlog
+    then goes out in batches of up to batch_size events per request.
+    """
+
+    def __init__(self, journal, backend_url, batch_size=50, base_delay=1, max_delay=300, timeout=10):
+        self.journal = journal
+        self.url = f"{backend_url}/api/parcel-delivered/batch"
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.failures = 0
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="journal-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def wake(self):
+        """Send newly journaled events now (unless backing off after a failure)"""
+        self._wake.set()
+
+    def _run(self):
+        last_prune = 0
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                accepted = self.send_batch()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+                delay *= random.uniform(0.5, 1)
+                print(f"⚠️ Backend unreachable ({e}), {self.journal.pending_count()} event(s) journaled, "
+                      f"retrying in {delay:.0f}s")
+                self._stop.wait(delay)
+                continue
+
+            if accepted == self.batch_size:
+                continue  # More backlog to replay
+
+            if time.time() - last_prune > 3600:
+                self.journal.prune()
+                last_prune = time.time()
+            self._wake.wait(30)
+
+    def send_batch(self):
+        """Send the oldest pending events in one request. Returns how many the backend accepted"""
+        events = self.journal.pending(self.batch_size)
+        if not events:
+            return 0
+
+        event_ids = [event["event_id"] for event in events]
+        self.journal.record_attempt(event_ids)
+        for event in events:
+            if event.get("trace_id"):
+                event.setdefault("spans", {})["sent"] = time.time()
+        response = self.session.post(self.url, json={"events": events}, timeout=self.timeout)
+        response.raise_for_status()
+
+        results = response.json().get("results", [])
+        accepted = [r["event_id"] for r in results if r.get("outcome") in FINAL_OUTCOMES]
+        self.journal.mark_sent(accepted)
+
+        for result in results:
+            if result.get("outcome") == "delivered" and not result.get("duplicate"):
+                print(f"✅ Parcel '{result.get('parcel_name')}' delivered to Box {result.get('box_name')}")
+            elif result.get("outcome") in ("box_occupied", "not_found", "invalid"):
+                print(f"❌ Delivery of {result.get('parcel_id')} rejected: {result.get('outcome')}")
+
+        if len(events) > 1:
+            print(f"📤 Synced {len(accepted)}/{len(events)} journaled delivery event(s)")
+        return len(accepted)
@@ -0,0 +1,304 @@
+"""
+Hardware abstraction layer for the box scripts
+Drivers for the load cell, ultrasonic sensor, servo, buzzer and LED, with
+a real backend (RPi.GPIO + HX711) and a simulated one driven by signal
+traces. HARDWARE_BACKEND selects it:
+
+    HARDWARE_BACKEND=gpio   Raspberry Pi pins (default)
+    HARDWARE_BACKEND=sim    Simulated devices, e.g. on a laptop or CI box
+
+Simulated sensors follow a Trace: scripted in code, or recorded from a
+real box with `python3 load_cell.py record weight.csv` and replayed from
+SIM_WEIGHT_TRACE / SIM_DISTANCE_TRACE. Simulated outputs keep a history
+of what they were set to, with monotonic timestamps.
+"""
+import bisect
+import csv
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BACKEND = os.getenv('HARDWARE_BACKEND', 'gpio')
+
+if BACKEND == 'gpio':
+    import RPi.GPIO as GPIO
+    from hx711 import HX711
+
+ECHO_TIMEOUT = 0.04  # Longest echo for the HC-SR04's ~4 m range is ~24 ms
+MAX_DISTANCE = 400  # cm; no echo beyond the sensor's range
+HX711_REFERENCE_UNIT = float(os.getenv('HX711_REFERENCE_UNIT', 1))  # From `python3 load_cell.py calibrate`
+
+
+def setup():
+    """Put the pins in BCM numbering (call before creating devices)"""
+    if BACKEND == 'gpio':
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+
+
+def cleanup():
+    """Release all pins"""
+    if BACKEND == 'gpio':
+        GPIO.cleanup()
+
+
+def load_cell(dt_pin, sck_pin, trace=None):
+    if BACKEND == 'sim':
+        return SimLoadCell(trace or Trace.from_env('SIM_WEIGHT_TRACE', 0))
+    return HX711LoadCell(dt_pin, sck_pin, HX711_REFERENCE_UNIT)
+
+
+def ultrasonic(trig_pin, echo_pin, trace=None):
+    if BACKEND == 'sim':
+        return SimUltrasonic(trace or Trace.from_env('SIM_DISTANCE_TRACE', 100))
+    return EchoTimer(trig_pin, echo_pin)
+
+
+def servo(pin):
+    if BACKEND == 'sim':
+        return SimOutput(0)
+    return PWMOutput(pin, 50)
+
+
+def buzzer(pin, frequency=500):
+    if BACKEND == 'sim':
+        return SimOutput(0)
+    return PWMOutput(pin, frequency)
+
+
+def led(pin):
+    if BACKEND == 'sim':
+        return SimOutput(False)
+    return DigitalOutput(pin)
+
+
+class Trace:
+    """A signal over time as (seconds, value) points; each value holds until the next point
+
+    Time counts from when the trace is created (or restart()). With repeat,
+    the trace loops with the last point's time as its period. A value of
+    None means no reading (e.g. no echo).
+    """
+
+    def __init__(self, points, repeat=False):
+        points = sorted(points, key=lambda point: point[0])
+        self.times = [t for t, _ in points]
+        self.values = [value for _, value in points]
+        self.repeat = repeat and self.times[-1] > 0
+        self.restart()
+
+    def restart(self):
+        self.start = time.monotonic()
+
+    def value(self, now=None):
+        t = (now if now is not None else time.monotonic()) - self.start
+        if self.repeat:
+            t %= self.times[-1]
+        index = bisect.bisect_right(self.times, t) - 1
+        return self.values[max(index, 0)]
+
+    @classmethod
+    def constant(cls, value):
+        return cls([(0, value)])
+
+    @classmethod
+    def load(cls, path, repeat=False):
+        """Read a CSV of seconds,value rows (an empty value means no reading)"""
+        points = []
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#') or row[0] == 'seconds':
+                    continue
+                points.append((float(row[0]), float(row[1]) if row[1] else None))
+        return cls(points, repeat)
+
+    @classmethod
+    def from_env(cls, name, default):
+        path = os.getenv(name)
+        return cls.load(path, repeat=True) if path else cls.constant(default)
+
+
+def record_trace(read, path, duration, interval=0.1):
+    """Write read()'s values to a CSV trace every interval seconds, for duration seconds"""
+    start = time.monotonic()
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['seconds', 'value'])
+        while time.monotonic() - start < duration:
+            value = read()
+            writer.writerow([round(time.monotonic() - start, 3), '' if value is None else value])
+            time.sleep(interval)
+
+
+class HX711LoadCell:
+    """HX711 amplifier on two GPIO pins; tared on creation"""
+
+    def __init__(self, dt_pin, sck_pin, reference_unit=1):
+        self.hx = HX711(dt_pin, sck_pin)
+        self.hx.set_reading_format("MSB", "MSB")
+        self.hx.set_reference_unit(reference_unit)
+        self.hx.reset()
+        self.hx.tare()
+
+    def is_ready(self):
+        return self.hx.is_ready()
+
+    def read(self, samples=1):
+        """Weight in grams, averaged over samples conversions"""
+        return self.hx.get_weight(samples)
+
+    def read_raw(self, samples=10):
+        """Uncalibrated reading, for working out the reference unit"""
+        return self.hx.get_value(samples)
+
+    def tare(self):
+        self.hx.tare()
+
+
+class SimLoadCell:
+    """Load cell whose weight follows a trace, converting at the HX711's rate (10 or 80 SPS)"""
+
+    def __init__(self, trace, rate=10, noise=0.0):
+        self.trace = trace
+        self.interval = 1 / rate
+        self.noise = noise
+        self._next_sample = time.monotonic()
+        self._offset = 0
+        self.tare()
+
+    def is_ready(self):
+        return time.monotonic() >= self._next_sample
+
+    def read(self, samples=1):
+        # Blocks for the conversions like the real chip
+        wait = self._next_sample + (samples - 1) * self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_sample = time.monotonic() + self.interval
+        return self._weight() - self._offset + random.gauss(0, self.noise)
+
+    def read_raw(self, samples=10):
+        return self.read(samples) + self._offset
+
+    def tare(self):
+        self._offset = self._weight()
+
+    def _weight(self):
+        return self.trace.value() or 0
+
+
+class EchoTimer:
+    """HC-SR04 on GPIO, timing echo pulses from edge callbacks instead of polling the pin
+
+    The rising and falling edges are timestamped with a monotonic clock in
+    RPi.GPIO's callback thread, and measure() sleeps on an Event until the
+    falling edge arrives, so no core spins while waiting.
+    """
+
+    def __init__(self, trig_pin, echo_pin):
+        self.trig_pin = trig_pin
+        self.echo_pin = echo_pin
+        self._rise = None
+        self._fall = None
+        self._done = threading.Event()
+        GPIO.setup(trig_pin, GPIO.OUT)
+        GPIO.setup(echo_pin, GPIO.IN)
+        GPIO.output(trig_pin, GPIO.LOW)
+        GPIO.add_event_detect(echo_pin, GPIO.BOTH, callback=self._on_edge)
+
+    def _on_edge(self, channel):
+        now = time.monotonic()
+        if GPIO.input(channel) == GPIO.HIGH:
+            self._rise = now
+        elif self._rise is not None:
+            self._fall = now
+            self._done.set()
+
+    def measure(self):
+        """One ping. Returns the distance in cm, or -1 if no echo came back"""
+        self._rise = None
+        self._fall = None
+        self._done.clear()
+
+        # Send trigger pulse
+        GPIO.output(self.trig_pin, GPIO.HIGH)
+        time.sleep(0.00001)
+        GPIO.output(self.trig_pin, GPIO.LOW)
+
+        if not self._done.wait(ECHO_TIMEOUT):
+            return -1
+
+        # Calculate distance
+        pulse_duration = self._fall - self._rise
+        return round(pulse_duration * 17150, 2)  # Speed of sound / 2
+
+    def close(self):
+        GPIO.remove_event_detect(self.echo_pin)
+
+
+class SimUltrasonic:
+    """Ultrasonic sensor whose distance follows a trace; a ping takes as long as its echo"""
+
+    def __init__(self, trace, noise=0.0):
+        self.trace = trace
+        self.noise = noise
+
+    def measure(self):
+        distance = self.trace.value()
+        if distance is None or distance > MAX_DISTANCE:
+            time.sleep(ECHO_TIMEOUT)
+            return -1
+        time.sleep(distance / 17150)
+        return round(max(0.1, distance + random.gauss(0, self.noise)), 2)
+
+    def close(self):
+        pass
+
+
+class PWMOutput:
+    """PWM pin (servo, buzzer); set() changes the duty cycle, 0 stops the signal"""
+
+    def __init__(self, pin, frequency):
+        GPIO.setup(pin, GPIO.OUT)
+        self.pwm = GPIO.PWM(pin, frequency)
+        self.pwm.start(0)
+
+    def set(self, duty):
+        self.pwm.ChangeDutyCycle(duty)
+
+    def stop(self):
+        self.pwm.stop()
+
+
+class DigitalOutput:
+    """On/off pin (LED)"""
+
+    def __init__(self, pin):
+        self.pin = pin
+        GPIO.setup(pin, GPIO.OUT)
+
+    def set(self, on):
+        GPIO.output(self.pin, GPIO.HIGH if on else GPIO.LOW)
+
+    def stop(self):
+        self.set(False)
+
+
+class SimOutput:
+    """Stands in for a PWM or digital output, keeping a (monotonic time, value) history"""
+
+    def __init__(self, value):
+        self.value = value
+        self.history = [(time.monotonic(), value)]
+
+    def set(self, value):
+        self.value = value
+        self.history.append((time.monotonic(), value))
+
+    def stop(self):
+        self.set(0)
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
 import time
 import os
+import threading
+import uuid
 import requests
-from hx711 import HX711
-from pubnub.pnconfiguration import PNConfiguration
-from pubnub.pubnub import PubNub
+import hal
+from weight_sampler import WeightSampler
+from event_journal import EventJournal, JournalSender
+from device_pubnub import create_pubnub
+from pubnub.callbacks import SubscribeCallback
+from pubnub.enums import PNStatusCategory
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -21,31 +25,76 @@ DELIVERY_THRESHOLD = 100  # Weight must exceed this to trigger delivery (in gram
 # Box configuration
 BOX_ID = os.getenv('BOX_ID', '1')
 BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:5001')
+CONTROL_CHANNEL = f"load-cell-control-{BOX_ID}"
+DELIVERY_CHANNEL = "parcel-delivery"
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'delivery_journal.db'))
+
+# Keep-alive connection for backend lookups
+http = requests.Session()
 
 class LoadCellSensor:
-    def __init__(self, dt_pin=DT_PIN, sck_pin=SCK_PIN):
-        """Initialize the load cell sensor"""
-        self.hx = HX711(dt_pin, sck_pin)
-        self.hx.set_reading_format("MSB", "MSB")
-        self.hx.set_reference_unit(1)  
-        self.hx.reset()
-        self.hx.tare()
+    def __init__(self, dt_pin=DT_PIN, sck_pin=SCK_PIN, sample_continuously=True, cell=None):
+        """Initialize the load cell sensor
+
+        With sample_continuously the HX711 is read by a background sampler and
+        get_weight() returns the filtered current weight without blocking.
+        cell overrides the HARDWARE_BACKEND driver (e.g. a hal.SimLoadCell).
+        """
+        self.cell = cell or hal.load_cell(dt_pin, sck_pin)
+        self.hx_lock = threading.Lock()  # The sampler, blocking reads and tare share the HX711
         
         self.previous_weight = 0
         self.delivery_detected = False
+        self.detected_at = None  # Wall-clock time of the last detected delivery, for tracing
         self.was_empty = True  # Track previous empty state
         
+        # A parcel is a step of at least the empty/delivery threshold gap
+        self.sampler = WeightSampler(self._read_sample, step_threshold=DELIVERY_THRESHOLD - EMPTY_THRESHOLD)
+        if sample_continuously:
+            self.sampler.start()
+        
         print("Load cell initialized and tared")
     
-    def get_weight(self, samples=10):
-        """Get average weight reading in grams"""
+    def _read_sample(self):
+        """One HX711 reading, sleeping rather than spinning until it is ready"""
+        while not self.cell.is_ready():
+            time.sleep(0.005)
+        with self.hx_lock:
+            return self.cell.read(1)
+    
+    def get_weight(self, samples=None):
+        """Get weight reading in grams
+
+        Returns the sampler's filtered weight instantly, or blocks for an
+        average of `samples` fresh readings when asked to (or not sampling).
+        """
+        if samples is None and self.sampler.running:
+            weight = self.sampler.weight()
+            return None if weight is None else max(0, weight)
+        
         try:
-            weight = self.hx.get_weight(samples)
+            with self.hx_lock:
+                weight = self.cell.read(samples or 10)
             return max(0, weight)  # Return 0 if negative
         except Exception as e:
             print(f"Error reading weight: {e}")
             return None
     
+    def tare(self):
+        """Zero the scale at its current load and drop samples taken before"""
+        with self.hx_lock:
+            self.cell.tare()
+        self.sampler.reset()
+        self.previous_weight = 0
+        print("Load cell re-tared")
+    
+    def wait_for_change(self, timeout):
+        """Block until the weight steps up or down, or timeout seconds pass"""
+        if not self.sampler.running:
+            time.sleep(timeout)
+            return None
+        return self.sampler.wait_for_step(timeout)
+    
     def is_empty(self):
         """Check if box is empty (weight below threshold)"""
         weight = self.get_weight()
@@ -75,6 +124,7 @@ class LoadCellSensor:
         if current_weight >= DELIVERY_THRESHOLD and self.previous_weight < DELIVERY_THRESHOLD:
             print("🚨 DELIVERY DETECTED!")
             self.delivery_detected = True
+            self.detected_at = time.time()
             self.previous_weight = current_weight
             return True
         
@@ -83,35 +133,124 @@ class LoadCellSensor:
     
     def cleanup(self):
         """Clean up GPIO"""
-        GPIO.cleanup()
+        self.sampler.stop()
+        hal.cleanup()
+
+
+class ExpectedParcelCache:
+    """Parcel the backend says this box should receive next
+
+    The backend pushes an expected_parcel message on the control channel
+    whenever registration, delivery or collection changes the assignment,
+    so a delivery can be reported without asking the backend first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parcel_id = None
+        self._valid = False  # False until the first push or HTTP lookup
+
+    def set(self, parcel_id):
+        with self._lock:
+            self._parcel_id = parcel_id
+            self._valid = True
+
+    def invalidate(self):
+        with self._lock:
+            self._valid = False
+
+    def get(self):
+        """Return (hit, parcel_id)"""
+        with self._lock:
+            return self._valid, self._parcel_id
+
+
+class ControlListener(SubscribeCallback):
+    """Handles backend messages on load-cell-control-{BOX_ID}"""
+
+    def __init__(self, sensor, expected_cache):
+        self.sensor = sensor
+        self.expected_cache = expected_cache
+
+    def message(self, pubnub, message):
+        try:
+            msg = message.message
+            action = msg.get('action')
+
+            if action == 'expected_parcel':
+                self.expected_cache.set(msg.get('parcel_id'))
+                print(f"📥 Expected parcel for Box {BOX_ID}: {msg.get('parcel_id') or 'none'}")
+
+            elif action == 'check_weight':
+                answer_weight_check(pubnub, self.sensor, msg)
+
+            elif action == 'reset':
+                # Tare off the HX711 thread PubNub delivers messages on
+                threading.Thread(target=self.sensor.tare, daemon=True).start()
+        except Exception as e:
+            print(f"❌ Error processing control message: {e}")
+
+    def status(self, pubnub, status):
+        # Pushes may have been missed while disconnected: refresh from the backend
+        if status.category in (PNStatusCategory.PNConnectedCategory, PNStatusCategory.PNReconnectedCategory):
+            threading.Thread(target=refresh_expected_parcel, args=(self.expected_cache,), daemon=True).start()
+
+
+def weight_check_response(sensor, request):
+    """Reply to a check_weight request from the sampler's current filtered weight"""
+    weight = sensor.get_weight()
+    return {
+        "type": "weight_check_response",
+        "request_id": request.get("request_id"),
+        "parcel_id": request.get("parcel_id"),
+        "box_id": BOX_ID,
+        # Without a reading, let the user confirm rather than assume the box is empty
+        "has_weight": weight is None or weight >= EMPTY_THRESHOLD,
+        "weight": round(weight, 1) if weight is not None else None,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def answer_weight_check(pubnub, sensor, request):
+    """Answer a check_weight request on the user channel and to the backend"""
+    response = weight_check_response(sensor, request)
+    print(f"⚖️ Weight check for {response['parcel_id']}: {response['weight']}g")
+
+    # The user's dashboard acts on the PubNub reply; the backend gets the same answer
+    def callback(envelope, status):
+        if status.is_error():
+            print(f"⚠️ Failed to publish weight check: {status.error_data}")
+
+    if request.get("user_id"):
+        pubnub.publish().channel(f"user-{request['user_id']}").message(response).pn_async(callback)
+    threading.Thread(target=post_weight_response, args=(response,), daemon=True).start()
+    return response
+
+
+def post_weight_response(response):
+    try:
+        http.post(f"{BACKEND_URL}/api/weight-response", json=response, timeout=5)
+    except Exception as e:
+        print(f"⚠️ Failed to send weight check to backend: {e}")
 
 
 def init_pubnub():
     """Initialize PubNub connection"""
-    token = os.getenv('PUBNUB_TOKEN')  # PAM token
-    
-    pnconfig = PNConfiguration()
-    pnconfig.subscribe_key = os.getenv('PUBNUB_SUBSCRIBE_KEY')
-    pnconfig.publish_key = os.getenv('PUBNUB_PUBLISH_KEY')
-    pnconfig.user_id = f"box-{BOX_ID}-device"  # Must match token's authorized_uuid
-    pnconfig.ssl = True
-    
-    pubnub = PubNub(pnconfig)
-    
-    # Set PAM token if available
-    if token:
-        pubnub.set_token(token)
-        print(f"🔐 PAM token enabled for box-{BOX_ID}-device")
-    else:
-        print("⚠️ No PAM token - connection may fail if Access Manager is enabled")
-    
-    return pubnub
+    return create_pubnub()
+
+
+def refresh_expected_parcel(expected_cache):
+    """Load the current assignment over HTTP (startup, reconnect, cache miss)"""
+    expected_cache.invalidate()
+    parcel_id = get_expected_parcel(BOX_ID)
+    expected_cache.set(parcel_id)
+    return parcel_id
 
 
 def get_expected_parcel(box_id):
     """Query backend for parcel expected in this box"""
     try:
-        response = requests.get(
+        response = http.get(
             f"{BACKEND_URL}/api/box/{box_id}/expected-parcel",
             timeout=5
         )
@@ -124,41 +263,34 @@ def get_expected_parcel(box_id):
         return None
 
 
-def notify_delivery_http(box_id, parcel_id):
-    """Notify backend via HTTP that parcel has been delivered"""
-    try:
-        response = requests.post(
-            f"{BACKEND_URL}/api/parcel-delivered",
-            json={"parcel_id": parcel_id},
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ {data.get('message', 'Delivery confirmed')}")
-            return True
-        else:
-            data = response.json()
-            print(f"❌ Failed: {data.get('error', 'Unknown error')}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Failed to notify backend via HTTP: {e}")
-        return False
+def delivery_event(parcel_id, detected_at=None):
+    """Delivery report, journaled and published with one event ID
 
-
-def notify_delivery_pubnub(pubnub, box_id, parcel_id):
-    """Notify via PubNub for real-time UI updates"""
-    channel = "parcel-delivery"
-    message = {
-        "box_id": box_id,
+    trace_id follows the delivery through the backend to the user's
+    dashboard; each hop adds its time to spans (see app/tracing.py).
+    """
+    return {
+        "event_id": uuid.uuid4().hex,
+        "trace_id": uuid.uuid4().hex,
+        "spans": {"detected": detected_at or time.time()},
+        "box_id": BOX_ID,
         "parcel_id": parcel_id,
         "action": "delivered",
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
     }
+
+
+def sent_copy(event):
+    """Copy of a delivery event stamped with the time it leaves the box"""
+    return {**event, "spans": {**event.get("spans", {}), "sent": time.time()}}
+
+
+def notify_delivery_pubnub(pubnub, event):
+    """Notify via PubNub for real-time UI updates"""
+    channel = DELIVERY_CHANNEL
     
     try:
-        pubnub.publish().channel(channel).message(message).sync()
+        pubnub.publish().channel(channel).message(sent_copy(event)).sync()
         print(f"📡 Real-time notification sent via PubNub")
         return True
     except Exception as e:
@@ -166,7 +298,7 @@ def notify_delivery_pubnub(pubnub, box_id, parcel_id):
         return False
 
 
-def monitor_deliveries(sensor, pubnub):
+def monitor_deliveries(sensor, pubnub, expected_cache, journal, sender):
     """Continuously monitor for deliveries in this box"""
     print(f"📦 Monitoring Box {BOX_ID} for parcel deliveries...")
     print(f"Backend: {BACKEND_URL}")
@@ -175,33 +307,41 @@ def monitor_deliveries(sensor, pubnub):
     try:
         while True:
             if sensor.check_delivery():
-                # Delivery detected! Get expected parcel from backend
+                # Delivery detected! Use the assignment pushed by the backend
                 print(f"📬 Delivery detected in Box {BOX_ID}")
-                print("Checking which parcel is expected in this box...")
                 
-                parcel_id = get_expected_parcel(BOX_ID)
+                hit, parcel_id = expected_cache.get()
+                if not hit:
+                    print("Checking which parcel is expected in this box...")
+                    parcel_id = get_expected_parcel(BOX_ID)
                 
                 if parcel_id:
                     print(f"Found expected parcel: {parcel_id}")
                     
-                    # Notify via both HTTP and PubNub
-                    http_success = notify_delivery_http(BOX_ID, parcel_id)
-                    pubnub_success = notify_delivery_pubnub(pubnub, BOX_ID, parcel_id)
+                    # Journal the delivery first so it survives a backend or network
+                    # outage; the sender reports it over HTTP. The PubNub copy carries
+                    # the same event ID so the backend records the delivery only once
+                    event = delivery_event(parcel_id, sensor.detected_at)
+                    journal.append(event)
+                    sender.wake()
+                    notify_delivery_pubnub(pubnub, event)
+                    print("📝 Delivery journaled")
                     
-                    if http_success or pubnub_success:
-                        print("✅ Delivery notification sent successfully")
+                    # The backend pushes the next assignment once it records the delivery
+                    expected_cache.invalidate()
                 else:
                     print("⚠️ No parcel expected in this box. Delivery not recorded.")
                 
                 # Wait for parcel to be collected before detecting next delivery
                 print("\nWaiting for parcel to be collected...")
                 while not sensor.is_empty():
-                    time.sleep(2)
+                    sensor.wait_for_change(timeout=2)
                 
                 print("Box is empty again. Ready for next delivery.\n")
                 sensor.delivery_detected = False
             
-            time.sleep(1)  # Check every second
+            # Re-check as soon as the weight steps, at least every second
+            sensor.wait_for_change(timeout=1)
             
     except KeyboardInterrupt:
         print("\n⚠️ Stopping monitoring...")
@@ -213,19 +353,19 @@ def calibrate():
     print("Remove all weight from the load cell")
     input("Press Enter when ready...")
     
-    sensor = LoadCellSensor()
+    sensor = LoadCellSensor(sample_continuously=False)
     
     print("\nPlace a known weight on the load cell (e.g., 100g)")
     known_weight = float(input("Enter the weight in grams: "))
     
     print("Reading...")
     time.sleep(2)
-    reading = sensor.hx.get_value(10)
+    reading = sensor.cell.read_raw(10)
     
     reference_unit = reading / known_weight
     print(f"\nCalibration complete!")
     print(f"Reference unit: {reference_unit}")
-    print(f"Update the reference unit in load_cell.py: self.hx.set_reference_unit({reference_unit})")
+    print(f"Set HX711_REFERENCE_UNIT={reference_unit} in .env")
     
     sensor.cleanup()
 
@@ -235,12 +375,34 @@ if __name__ == "__main__":
     
     if len(sys.argv) > 1 and sys.argv[1] == "calibrate":
         calibrate()
+    elif len(sys.argv) > 2 and sys.argv[1] == "record":
+        # Record a weight trace for the simulated backend (HARDWARE_BACKEND=sim)
+        duration = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+        sensor = LoadCellSensor()
+        print(f"⏺️ Recording weight to {sys.argv[2]} for {duration:.0f}s...")
+        try:
+            hal.record_trace(sensor.get_weight, sys.argv[2], duration)
+        finally:
+            sensor.cleanup()
     else:
         # Monitor mode - monitors the box specified in BOX_ID env variable
         sensor = LoadCellSensor()
         pubnub = init_pubnub()
         
+        # Receive expected-parcel pushes and weight checks for this box
+        expected_cache = ExpectedParcelCache()
+        pubnub.add_listener(ControlListener(sensor, expected_cache))
+        pubnub.subscribe().channels(CONTROL_CHANNEL).execute()
+        print(f"📡 Subscribed to {CONTROL_CHANNEL}")
+        
+        # Report journaled deliveries, including any left over from an outage
+        journal = EventJournal(JOURNAL_PATH)
+        sender = JournalSender(journal, BACKEND_URL)
+        sender.start()
+        
         try:
-            monitor_deliveries(sensor, pubnub)
+            monitor_deliveries(sensor, pubnub, expected_cache, journal, sender)
         finally:
+            sender.stop()
+            pubnub.stop()
             sensor.cleanup()
\ No newline at end of file
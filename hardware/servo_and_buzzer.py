@@ -1,10 +1,12 @@
-import RPi.GPIO as GPIO
-from pubnub.pnconfiguration import PNConfiguration
-from pubnub.pubnub import PubNub
+import hal
 from pubnub.callbacks import SubscribeCallback
+from device_pubnub import create_pubnub
+from collections import deque
 from time import sleep
 from dotenv import load_dotenv
 import os
+import threading
+import time
 
 # Load environment variables
 load_dotenv()
@@ -20,44 +22,150 @@ BUZZER_PIN = 23
 # PubNub setup
 BOX_ID = os.getenv('BOX_ID', '1')  # Default to '1' if not set
 CHANNEL = f"box-{BOX_ID}"
+ACK_CHANNEL = "command-ack"
+MAX_COMMAND_AGE = float(os.getenv('MAX_COMMAND_AGE', 30))  # Seconds after which a queued command is dropped
 
-# Initialize GPIO
-GPIO.setwarnings(False)
-GPIO.cleanup()
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(SERVO_PIN, GPIO.OUT)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-servo_pwm = GPIO.PWM(SERVO_PIN, 50)
-servo_pwm.start(0)  # Start with no signal
-buzzer_pwm = GPIO.PWM(BUZZER_PIN, 500)  # 500Hz tone for piezo buzzer
+servo = None
+buzzer = None
+
+def setup_gpio():
+    """Initialize the servo and buzzer pins"""
+    global servo, buzzer
+    hal.setup()
+    servo = hal.servo(SERVO_PIN)  # Starts with no signal
+    buzzer = hal.buzzer(BUZZER_PIN, 500)  # 500Hz tone for piezo buzzer
+
+def cleanup():
+    """Leave the door locked and release the pins"""
+    servo.set(LOCKED)
+    sleep(1)
+    servo.stop()
+    buzzer.stop()
+
+buzzer_lock = threading.Lock()  # One beep pattern at a time
 
 def beep(duration=0.1, times=1):
     """Make the buzzer beep using PWM"""
-    for _ in range(times):
-        buzzer_pwm.start(50)  # 50% duty cycle
-        sleep(duration)
-        buzzer_pwm.stop()
-        sleep(duration)
+    with buzzer_lock:
+        for _ in range(times):
+            buzzer.set(50)  # 50% duty cycle
+            sleep(duration)
+            buzzer.set(0)
+            sleep(duration)
+
+def beep_async(duration=0.1, times=1):
+    """Play a beep pattern without waiting for it, e.g. while the servo moves"""
+    threading.Thread(target=beep, args=(duration, times), daemon=True).start()
 
 def lock_door():
     """Lock the door"""
     print("🔒 Locking door...")
-    servo_pwm.ChangeDutyCycle(LOCKED)
+    beep_async(0.1, 2)  # Short double beep
+    servo.set(LOCKED)
     sleep(2)  
-    servo_pwm.ChangeDutyCycle(0)  # Stop signal after movement
-    beep(0.1, 2)  # Short double beep
+    servo.set(0)  # Stop signal after movement
     return "locked"
 
 def unlock_door():
     """Unlock the door"""
     print("🔓 Unlocking door...")
-    servo_pwm.ChangeDutyCycle(UNLOCKED)
+    beep_async(0.2, 1)  # Single longer beep
+    servo.set(UNLOCKED)
     sleep(2)  
-    servo_pwm.ChangeDutyCycle(0)  # Stop signal after movement
-    beep(0.2, 1)  # Single longer beep
+    servo.set(0)  # Stop signal after movement
     return "unlocked"
 
+ACTIONS = {"lock": (lock_door, "locked"), "unlock": (unlock_door, "unlocked")}
+
+class ActuatorWorker:
+    """Runs door commands on one worker thread, off the PubNub callback thread
+
+    Commands that queue up while the servo is moving are coalesced: only the
+    newest one is actuated and the ones it supersedes are acknowledged with
+    its result. Commands older than MAX_COMMAND_AGE are dropped, and a command
+    for the state the door is already in does not move the servo. Every
+    command is acknowledged on ACK_CHANNEL with its measured latency.
+    """
+
+    def __init__(self, publish_ack, max_age=MAX_COMMAND_AGE):
+        self.publish_ack = publish_ack  # Callable taking the ack message
+        self.max_age = max_age
+        self.state = None  # Unknown until the first command
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="actuator", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, command):
+        with self._cond:
+            self._pending.append(command)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = list(self._pending)
+                self._pending.clear()
+
+            try:
+                self._process(batch)
+            except Exception as e:
+                print(f"❌ Error actuating door: {e}")
+
+    def _process(self, batch):
+        now = time.time()
+        fresh = []
+        for command in batch:
+            if now - command["sent_at"] > self.max_age:
+                print(f"⏭️ Dropping stale {command['action']} command ({now - command['sent_at']:.0f}s old)")
+                self._ack(command, "stale")
+            else:
+                fresh.append(command)
+        if not fresh:
+            return
+
+        final = fresh[-1]
+        actuate, state = ACTIONS[final["action"]]
+        # The servo starts moving now; coalesced commands waited in the queue until here
+        started_at = time.time()
+        if state == self.state:
+            status = "noop"
+        else:
+            actuate()
+            self.state = state
+            status = "done"
+            print(f"✅ Door {state}")
+
+        for command in fresh[:-1]:
+            self._ack(command, "coalesced", started_at)
+        self._ack(final, status, started_at)
+
+    def _ack(self, command, status, started_at=None):
+        """Acknowledge a command; queue_ms is the wait before the servo started, actuation_ms the move itself"""
+        completed_at = time.time()
+        ack = {
+            "type": "command_ack",
+            "box_id": BOX_ID,
+            "command_id": command.get("command_id"),
+            "action": command["action"],
+            "status": status,
+            "state": self.state,
+            "completed_at": completed_at,
+            "transit_ms": round((command["received_at"] - command["sent_at"]) * 1000, 1),
+            "queue_ms": round(((started_at or completed_at) - command["received_at"]) * 1000, 1),
+            # Stale commands never reach the servo
+            "actuation_ms": round((completed_at - started_at) * 1000, 1) if started_at else None,
+        }
+        self.publish_ack(ack)
+
 class ServoListener(SubscribeCallback):
+    def __init__(self, actuator):
+        self.actuator = actuator
+
     def message(self, pubnub, message):
         try:
             msg = message.message
@@ -69,12 +177,8 @@ class ServoListener(SubscribeCallback):
             if box_id == BOX_ID:
                 action = msg.get('action', '').lower()
                 
-                if action == 'lock':
-                    status = lock_door()
-                    print(f"✅ Door {status}")
-                elif action == 'unlock':
-                    status = unlock_door()
-                    print(f"✅ Door {status}")
+                if action in ACTIONS:
+                    self.actuator.submit(door_command(msg, message.timetoken))
                 else:
                     print(f"⚠️ Unknown action: {action}")
             else:
@@ -86,50 +190,58 @@ class ServoListener(SubscribeCallback):
     def status(self, pubnub, status):
         print(f"Status: {status.category.name}")
 
+def door_command(msg, timetoken=None):
+    """Queue entry for a lock/unlock message"""
+    received_at = time.time()
+    return {
+        "action": msg.get('action', '').lower(),
+        "command_id": msg.get('command_id'),
+        # PubNub's publish timetoken (100 ns units) dates the command
+        "sent_at": int(timetoken) / 1e7 if timetoken else received_at,
+        "received_at": received_at
+    }
+
 def init_pubnub():
     """Initialize PubNub connection"""
-    token = os.getenv('PUBNUB_TOKEN')  # PAM token
+    pubnub = create_pubnub()
     
-    pnconfig = PNConfiguration()
-    pnconfig.subscribe_key = os.getenv('PUBNUB_SUBSCRIBE_KEY')
-    pnconfig.publish_key = os.getenv('PUBNUB_PUBLISH_KEY')
-    pnconfig.user_id = f"box-{BOX_ID}-device"  # Must match token's authorized_uuid
-    pnconfig.ssl = True
-    
-    pubnub = PubNub(pnconfig)
-    
-    # Set PAM token if available
-    if token:
-        pubnub.set_token(token)
-        print(f"🔐 PAM token enabled for box-{BOX_ID}-device")
-    else:
-        print("⚠️ No PAM token - connection may fail if Access Manager is enabled")
-    
-    pubnub.add_listener(ServoListener())
+    def publish_ack(ack):
+        def callback(envelope, status):
+            if status.is_error():
+                print(f"⚠️ Failed to publish command ack: {status.error_data}")
+        pubnub.publish().channel(ACK_CHANNEL).message(ack).pn_async(callback)
+
+    actuator = ActuatorWorker(publish_ack)
+    actuator.start()
+    pubnub.add_listener(ServoListener(actuator))
     
     return pubnub
 
-try:
-    print(f"🚀 Starting door lock system for Box {BOX_ID}")
-    print(f"📡 Subscribing to channel: {CHANNEL}")
+def main():
+    hal.cleanup()
+    setup_gpio()
     
-    # Initialize and subscribe to PubNub
-    pubnub = init_pubnub()
-    pubnub.subscribe().channels(CHANNEL).execute()
-    
-    print("✅ Connected! Waiting for messages...")
-    print("Press Ctrl+C to exit")
-    
-    # Keep the script running
-    while True:
-        sleep(1)
+    try:
+        print(f"🚀 Starting door lock system for Box {BOX_ID}")
+        print(f"📡 Subscribing to channel: {CHANNEL}")
         
-except KeyboardInterrupt:
-    print("\n⚠️ Exiting...")
-finally:
-    servo_pwm.ChangeDutyCycle(LOCKED)
-    sleep(1)
-    servo_pwm.stop()
-    buzzer_pwm.stop()
-    GPIO.cleanup()
-    print("🔒 Door locked and system cleaned up")
\ No newline at end of file
+        # Initialize and subscribe to PubNub
+        pubnub = init_pubnub()
+        pubnub.subscribe().channels(CHANNEL).execute()
+        
+        print("✅ Connected! Waiting for messages...")
+        print("Press Ctrl+C to exit")
+        
+        # Keep the script running
+        while True:
+            sleep(1)
+            
+    except KeyboardInterrupt:
+        print("\n⚠️ Exiting...")
+    finally:
+        cleanup()
+        hal.cleanup()
+        print("🔒 Door locked and system cleaned up")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
-import RPi.GPIO as GPIO
+import hal
+import os
+import statistics
+import sys
 import time
 
 # Pin Configuration
@@ -10,73 +13,73 @@ ECHO_PIN = 4
 DISTANCE_THRESHOLD = 12  # Distance in cm to trigger motion detection
 MOTION_SENSITIVITY = 3  # Change in distance (cm) to consider as motion
 
-# Setup GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+# Sampling settings
+SAMPLE_RATE = float(os.getenv('ULTRASONIC_SAMPLE_RATE', 10))  # Readings per second while there is movement
+IDLE_SAMPLE_RATE = float(os.getenv('ULTRASONIC_IDLE_RATE', 2))  # Readings per second once idle
+IDLE_AFTER = float(os.getenv('ULTRASONIC_IDLE_AFTER', 30))  # Seconds without movement before backing off
+MEDIAN_SAMPLES = 3  # Pings per reading; the median rejects spurious echoes
+PING_INTERVAL = 0.06  # Let echoes of the previous ping die out (HC-SR04 datasheet)
 
-GPIO.setup(LED_PIN, GPIO.OUT)
-GPIO.setup(TRIG_PIN, GPIO.OUT)
-GPIO.setup(ECHO_PIN, GPIO.IN)
+led = None
 
-def get_distance():
-    """Measure distance using ultrasonic sensor"""
-    # Send trigger pulse
-    GPIO.output(TRIG_PIN, GPIO.LOW)
-    time.sleep(0.002)
-    GPIO.output(TRIG_PIN, GPIO.HIGH)
-    time.sleep(0.00001)
-    GPIO.output(TRIG_PIN, GPIO.LOW)
-    
-    # Wait for echo response
-    timeout = time.time() + 1
-    while GPIO.input(ECHO_PIN) == GPIO.LOW:
-        pulse_start = time.time()
-        if pulse_start > timeout:
-            return -1
-    
-    timeout = time.time() + 1
-    while GPIO.input(ECHO_PIN) == GPIO.HIGH:
-        pulse_end = time.time()
-        if pulse_end > timeout:
-            return -1
-    
-    # Calculate distance
-    pulse_duration = pulse_end - pulse_start
-    distance = pulse_duration * 17150  # Speed of sound / 2
-    distance = round(distance, 2)
+def setup_gpio():
+    """Set up the LED and ultrasonic sensor; returns the sensor"""
+    global led
+    hal.setup()
+    led = hal.led(LED_PIN)
+    return hal.ultrasonic(TRIG_PIN, ECHO_PIN)
+
+def get_distance(sensor, samples=MEDIAN_SAMPLES):
+    """Median distance of several pings in cm, or -1 if none got an echo"""
+    readings = []
+    for i in range(samples):
+        if i:
+            time.sleep(PING_INTERVAL)
+        distance = sensor.measure()
+        if distance > 0:
+            readings.append(distance)
     
-    return distance
+    if not readings:
+        return -1
+    return round(statistics.median(readings), 2)
 
-def led_on():
+def led_on(reason="Motion detected!"):
     """Turn LED on"""
-    GPIO.output(LED_PIN, GPIO.HIGH)
-    print("LED ON - Motion detected!")
+    led.set(True)
+    print(f"LED ON - {reason}")
 
 def led_off():
     """Turn LED off"""
-    GPIO.output(LED_PIN, GPIO.LOW)
+    led.set(False)
     print("LED OFF")
 
 def main():
     print("Motion Detection System Started")
     print(f"LED Pin: {LED_PIN}, Trigger Pin: {TRIG_PIN}, Echo Pin: {ECHO_PIN}")
     print(f"Detection threshold: {DISTANCE_THRESHOLD}cm, Sensitivity: {MOTION_SENSITIVITY}cm")
+    print(f"Sampling: {SAMPLE_RATE}/s, {IDLE_SAMPLE_RATE}/s after {IDLE_AFTER}s without movement")
     print("Press Ctrl+C to exit\n")
     
-    previous_distance = get_distance()
+    sensor = setup_gpio()
+    time.sleep(0.002)
+    
+    previous_distance = get_distance(sensor)
     led_on_duration = 10  # Keep LED on for 10 seconds after motion
     is_detecting = True  # Flag to control detection
+    last_movement = time.monotonic()
     
     try:
         while True:
             if is_detecting:
-                current_distance = get_distance()
+                current_distance = get_distance(sensor)
                 
                 if current_distance > 0:
                     print(f"Distance: {current_distance} cm")
                     
                     # Check for motion (significant change in distance or object within threshold)
                     distance_change = abs(current_distance - previous_distance)
+                    if distance_change > 1:  # More than sensor noise: stay at the active rate
+                        last_movement = time.monotonic()
                     
                     if distance_change > MOTION_SENSITIVITY or current_distance < DISTANCE_THRESHOLD:
                         led_on()
@@ -85,21 +88,41 @@ def main():
                         time.sleep(led_on_duration)  # Wait for 10 seconds
                         led_off()
                         is_detecting = True  # Resume detecting
-                        previous_distance = get_distance()  # Reset baseline distance
+                        previous_distance = get_distance(sensor)  # Reset baseline distance
+                        last_movement = time.monotonic()
                         print("Detection resumed")
                     else:
                         previous_distance = current_distance
                 
-                time.sleep(0.1)
+                # Back off when nothing has moved for a while
+                idle = time.monotonic() - last_movement > IDLE_AFTER
+                time.sleep(1 / (IDLE_SAMPLE_RATE if idle else SAMPLE_RATE))
             else:
                 time.sleep(0.1)
             
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
+        sensor.close()
         led_off()
-        GPIO.cleanup()
+        hal.cleanup()
         print("GPIO cleaned up")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 2 and sys.argv[1] == "record":
+        # Record a distance trace for the simulated backend (HARDWARE_BACKEND=sim)
+        duration = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+        sensor = setup_gpio()
+        
+        def read_distance():
+            distance = get_distance(sensor)
+            return distance if distance > 0 else None  # No echo
+        
+        print(f"⏺️ Recording distance to {sys.argv[2]} for {duration:.0f}s...")
+        try:
+            hal.record_trace(read_distance, sys.argv[2], duration)
+        finally:
+            sensor.close()
+            hal.cleanup()
+    else:
+        main()